@@ -11,9 +11,10 @@
 # output: ../data/bias_correction.csv
 
 import pandas as pd
-import numpy as np
 import os
-import re
+
+from correction_cache import correction_terms
+from states import attach, keys_from_fips
 
 # Constants
 RHO = -0.0045
@@ -22,54 +23,15 @@ RHO = -0.0045
 script_dir: str = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_dir)
 
-# Helper function to clean percentage strings
-def clean_percentage(pct_str):
-    if pd.isna(pct_str):
-        return np.nan
-    if isinstance(pct_str, (int, float)):
-        return pct_str / 100  # Already a number, just convert to proportion
-    # Remove % sign and convert to float, then to proportion
-    return float(pct_str.rstrip('%')) / 100
-
-# Helper function to clean numeric strings with commas
-def clean_numeric(num_str):
-    if pd.isna(num_str):
-        return np.nan
-    if isinstance(num_str, (int, float)):
-        return num_str  # Already a number
-    # Remove commas and convert to float
-    return float(re.sub(r'[,]', '', str(num_str)))
-
 # Load data
 df = pd.read_csv('../data/merged_all_voters.csv')
 
-# Load turnout data
-turnout_2016 = pd.read_csv('../data/Turnout_2016G_v1.0.csv')
-turnout_2024 = pd.read_csv('../data/Turnout_2024G_v0.3.csv')
-
-# Prepare turnout data
-# Extract VEP_TURNOUT_RATE from 2016 data (as proportion)
-turnout_2016['turnout_rate_2016'] = turnout_2016['VEP_TURNOUT_RATE'].apply(clean_percentage)
-
-# Extract VEP from 2024 data
-turnout_2024['vep_2024'] = turnout_2024['VEP'].apply(clean_numeric)
-
-# Prepare data for merging
-turnout_2016 = turnout_2016[['STATE', 'turnout_rate_2016']]
-turnout_2024 = turnout_2024[['STATE', 'vep_2024']]
-
-# Merge the turnout data frames together
-turnout_data = pd.merge(turnout_2016, turnout_2024, on='STATE', how='inner')
-
-# Rename the state column in the main dataframe to match turnout data for merging
-df['STATE'] = df['State']
-
-# Merge the turnout data with the main dataframe
-df = pd.merge(df, turnout_data, on='STATE', how='left')
+# 2016 VEP turnout rate (as proportion) and 2024 VEP, gathered from the state dimension by state key
+df = attach(df, keys_from_fips(df['inputstate']), ['VEP_TURNOUT_RATE_2016', 'VEP_2024'],
+            {'VEP_TURNOUT_RATE_2016': 'turnout_rate_2016', 'VEP_2024': 'vep_2024'})
 
 # Print some debugging information
 print(f"States in merged_all_voters: {df['State'].nunique()}")
-print(f"States in turnout data: {turnout_data['STATE'].nunique()}")
 print(f"States successfully matched: {df['turnout_rate_2016'].notna().sum()}")
 
 # Calculate estimated votes = 2016 turnout rate * 2024 vep
@@ -82,15 +44,15 @@ if df['estimated_votes'].isna().any():
     # Use total_votes as a fallback
     df.loc[df['estimated_votes'].isna(), 'estimated_votes'] = df.loc[df['estimated_votes'].isna(), 'total_votes']
 
-# Calculate sample ratio f = num_respondents_all / estimated_votes
-df['f'] = df['num_respondents_all'] / df['estimated_votes']
-
-# Calculate sigma for each row as the standard deviation of a Bernoulli distribution
-# For a Bernoulli distribution with probability p, the standard deviation is sqrt(p*(1-p))
-df['sigma'] = np.sqrt(df['trump_poll_all'] * (1 - df['trump_poll_all']))
+# f, sigma and sqrt((1-f)/f) * sigma do not depend on RHO, so they come from the memoized cache
+# f = num_respondents_all / estimated_votes
+# sigma is the standard deviation of a Bernoulli distribution, sqrt(p*(1-p))
+terms = correction_terms(df['num_respondents_all'], df['estimated_votes'], df['trump_poll_all'])
+df['f'] = terms['f']
+df['sigma'] = terms['sigma']
 
 # Calculate the bias correction term: rho * sqrt((1-f)/f) * sigma
-df['bias_correction_term'] = RHO * np.sqrt((1 - df['f']) / df['f']) * df['sigma']
+df['bias_correction_term'] = RHO * terms['scale']
 
 # Calculate the bias-corrected estimator
 df['trump_poll_corrected'] = df['trump_poll_all'] - df['bias_correction_term']
@@ -0,0 +1,109 @@
+# this file runs the bias correction of bias_correction.py under several definitions of N side by side
+# input: ../data/merged_all_voters.csv
+# Turnout data: ../data/Turnout_2016G_v1.0.csv
+# Turnout data: ../data/Turnout_2024G_v0.3.csv
+# output: ../data/bias_correction_scenarios.csv
+
+# N scenarios (columns of the N matrix):
+# 1. rate2016_vep2024: 2016 VEP turnout rate * 2024 VEP (what bias_correction.py uses)
+# 2. ballots2024: 2024 total ballots counted
+# 3. rate2016_vap2024: 2016 VAP turnout rate * 2024 VAP
+# 4. ap_total_votes: AP total_votes
+# any missing N falls back to AP total_votes, as in bias_correction.py
+
+# for every scenario we compute f = n / N, the correction term rho * sqrt((1-f)/f) * sigma
+# and the corrected estimate, as one states x scenarios array operation
+
+import os
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+from states import attach, keys_from_fips, turnout_columns
+
+# Constants
+RHO = -0.0045
+
+SCENARIOS: Dict[str, Callable[[pd.DataFrame], pd.Series]] = {
+    "rate2016_vep2024": lambda d: d["VEP_TURNOUT_RATE_2016"] * d["VEP_2024"],
+    "ballots2024": lambda d: d["TOTAL_BALLOTS_COUNTED_2024"],
+    "rate2016_vap2024": lambda d: d["VAP_TURNOUT_RATE_2016"] * d["VAP_2024"],
+    "ap_total_votes": lambda d: d["total_votes"],
+}
+
+
+def estimated_votes_matrix(df: pd.DataFrame) -> np.ndarray:
+    """
+    Build the states x scenarios matrix of N, falling back to AP total_votes where missing.
+
+    Args:
+        df: merged voters data with the turnout columns of states.py
+
+    Returns:
+        Array of shape (n_states, n_scenarios)
+    """
+    N = np.column_stack([scenario(df).to_numpy(dtype=float) for scenario in SCENARIOS.values()])
+    fallback = df["total_votes"].to_numpy(dtype=float)[:, None]
+    return np.where(np.isnan(N), fallback, N)
+
+
+def run_scenarios(
+    df: pd.DataFrame, candidate: str = "trump", population: str = "all", rho: float = RHO
+) -> pd.DataFrame:
+    """
+    Compute f, the correction term and the corrected estimate for every N scenario in one pass.
+
+    Args:
+        df: merged voters data with the turnout columns of states.py
+        candidate: "trump" or "harris"
+        population: "all", "likely" or "validated"
+        rho: Assumed data defect correlation
+
+    Returns:
+        DataFrame with one row per state and {scenario}_{quantity} columns
+    """
+    poll = df[f"{candidate}_poll_{population}"].to_numpy(dtype=float)
+    n = df[f"num_respondents_{population}"].to_numpy(dtype=float)
+
+    N = estimated_votes_matrix(df)
+    f = n[:, None] / N
+    sigma = np.sqrt(poll * (1 - poll))[:, None]
+    correction = rho * np.sqrt((1 - f) / f) * sigma
+    corrected = poll[:, None] - correction
+
+    results = pd.DataFrame({
+        "state": df["state"],
+        f"{candidate}_share": df[f"{candidate}_share"],
+        f"{candidate}_poll_{population}": poll,
+        f"num_respondents_{population}": n,
+    })
+    for k, name in enumerate(SCENARIOS):
+        results[f"{name}_estimated_votes"] = N[:, k]
+        results[f"{name}_f"] = f[:, k]
+        results[f"{name}_bias_correction_term"] = correction[:, k]
+        results[f"{name}_{candidate}_poll_corrected"] = corrected[:, k]
+    return results
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    df = pd.read_csv("../data/merged_all_voters.csv")
+    df = attach(df, keys_from_fips(df["inputstate"]), turnout_columns())
+
+    results = run_scenarios(df)
+
+    # RMSE of the corrected estimate against the actual share, per scenario
+    for name in SCENARIOS:
+        error = results[f"{name}_trump_poll_corrected"] - results["trump_share"]
+        print(f"{name}: RMSE {np.sqrt(np.mean(error ** 2)):.4f}")
+
+    results.to_csv("../data/bias_correction_scenarios.csv", index=False)
+    print("Scenario matrix saved to '../data/bias_correction_scenarios.csv'")
+
+
+if __name__ == "__main__":
+    main()
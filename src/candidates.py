@@ -0,0 +1,168 @@
+# candidate axis for the results, the poll encoding and the data defect metrics
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv
+# input: state_json_files/{XX}.json
+# output: ../data/candidate_metrics.csv (or _likely / _validated)
+
+# the figure scripts carry one trump_* and one harris_* column per quantity. Here a candidate is an axis:
+# - every AP candidate is a column of a (states x AP candidates) vote matrix (extract_ap_results.extract_candidate_votes)
+# - every CC24_364b option is a column of a (states x options) poll matrix, from one grouped reduction of the
+#   one-hot answers (cces.grouped_sums)
+# - AP candidates are mapped onto the options by a (AP candidates x options) 0/1 matrix, so the actual shares of
+#   all options are one matrix product; "other" collects every AP candidate other than Harris and Trump
+# - error, sigma_g, f, rho, Z_n,N and Z_n come from one data_defect_metrics call on (states x options) arrays
+# won't vote / not sure have a poll share but no vote share, so their metrics are NaN.
+# figure_5_dataset.py, figure_6_dataset.py and figure_7.py compute their trump_* / harris_* columns with
+# merged_metrics on the merged tables and read them off the candidate axis with candidate_columns.
+
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cces import add_voter_flags, group_index, grouped_sums, load_cces, population_masks
+from data_defect import data_defect_metrics
+from extract_ap_results import HARRIS_ID, TRUMP_ID, extract_candidate_votes
+from states import gather, inner_join, keys_from_abbr, keys_from_fips
+
+# CC24_364b code per option
+OPTIONS: Dict[str, int] = {"harris": 1, "trump": 2, "other": 3, "wont_vote": 4, "not_sure": 5}
+# AP candidate IDs per option; the option listed in OTHER_OPTION takes every unlisted AP candidate
+AP_CANDIDATE_IDS: Dict[str, List[str]] = {"harris": [HARRIS_ID], "trump": [TRUMP_ID]}
+OTHER_OPTION = "other"
+# candidates of the figure scripts, in the order of their {candidate}_* columns
+FIGURE_CANDIDATES: List[str] = ["trump", "harris"]
+
+population = "all"  # all, likely or validated
+
+
+def option_mapping(candidate_ids: np.ndarray, options: List[str] = list(OPTIONS)) -> np.ndarray:
+    """(AP candidates x options) 0/1 matrix assigning every AP candidate to one option."""
+    mapping = np.zeros((len(candidate_ids), len(options)))
+    listed = np.zeros(len(candidate_ids), dtype=bool)
+    for k, option in enumerate(options):
+        ids = AP_CANDIDATE_IDS.get(option, [])
+        match = np.isin(candidate_ids.astype(str), ids)
+        mapping[match, k] = 1
+        listed |= match
+    if OTHER_OPTION in options:
+        mapping[~listed, options.index(OTHER_OPTION)] = 1
+    return mapping
+
+
+def option_shares(votes: np.ndarray, total_votes: np.ndarray, mapping: np.ndarray) -> np.ndarray:
+    """(states x options) actual vote shares; NaN for options without any AP candidate."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = votes @ mapping / total_votes[:, None]
+    shares[:, mapping.sum(axis=0) == 0] = np.nan
+    return shares
+
+
+def option_polls(
+    state_index: np.ndarray, codes: np.ndarray, n_states: int, options: List[str] = list(OPTIONS)
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Respondent counts and poll shares of every option per state.
+
+    Args:
+        state_index: State index per respondent
+        codes: CC24_364b per respondent (respondents without an answer should be filtered out)
+        n_states: Number of states
+        options: Options to return
+
+    Returns:
+        (n of shape (states,), polls of shape (states x options))
+    """
+    one_hot = codes[:, None] == np.array([OPTIONS[option] for option in options])[None, :]
+    sums = grouped_sums(state_index, np.column_stack([np.ones(len(codes)), one_hot]), n_states)
+    n = sums[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return n, sums[:, 1:] / n[:, None]
+
+
+def candidate_metrics(polls: np.ndarray, shares: np.ndarray, n: np.ndarray, total_votes: np.ndarray) -> Dict[str, np.ndarray]:
+    """data_defect_metrics over (states x options)."""
+    return data_defect_metrics(polls, shares, n[:, None], total_votes[:, None])
+
+
+def merged_metrics(
+    df: pd.DataFrame, poll_column: str, n_column: str, candidates: List[str] = FIGURE_CANDIDATES
+) -> Dict[str, np.ndarray]:
+    """
+    candidate_metrics of a merged_{population}_voters table, over (states x candidates).
+
+    Args:
+        df: Table with {candidate}_share and total_votes columns
+        poll_column: Poll share column, with a {candidate} field (e.g. "{candidate}_poll_likely")
+        n_column: Number of respondents column
+        candidates: Candidates, in the order of the candidate axis
+    """
+    polls = df[[poll_column.format(candidate=candidate) for candidate in candidates]].to_numpy(dtype=float)
+    shares = df[[f"{candidate}_share" for candidate in candidates]].to_numpy(dtype=float)
+    return candidate_metrics(polls, shares, df[n_column].to_numpy(dtype=float), df["total_votes"].to_numpy(dtype=float))
+
+
+def candidate_columns(
+    metrics: Dict[str, np.ndarray], names: List[str], candidates: List[str] = FIGURE_CANDIDATES
+) -> Dict[str, np.ndarray]:
+    """{candidate}_{name} columns, name by name, as views of the candidate axis of metrics."""
+    return {f"{candidate}_{name}": metrics[name][:, k] for name in names for k, candidate in enumerate(candidates)}
+
+
+def metrics_table(
+    state_keys: np.ndarray, options: List[str], polls: np.ndarray, shares: np.ndarray,
+    n: np.ndarray, total_votes: np.ndarray, metrics: Dict[str, np.ndarray],
+) -> pd.DataFrame:
+    """Long table with one row per state x option."""
+    n_states, n_options = polls.shape
+    table = pd.DataFrame({
+        "state": np.repeat(gather("name", state_keys), n_options),
+        "candidate": np.tile(options, n_states),
+        "sample_size": np.repeat(n, n_options),
+        "total_votes": np.repeat(total_votes, n_options),
+        "poll": polls.ravel(),
+        "share": shares.ravel(),
+    })
+    for name in ["error", "sigma_g", "sample_ratio", "data_defect_correlation", "Z_n_N", "Z_n"]:
+        table[name] = np.broadcast_to(metrics[name], polls.shape).ravel()
+    return table
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    options = list(OPTIONS)
+
+    # actual shares per option, by state key
+    abbrs, candidate_ids, votes, total_votes = extract_candidate_votes()
+    result_keys = keys_from_abbr(abbrs)
+    shares = option_shares(votes, total_votes.astype(float), option_mapping(candidate_ids, options))
+
+    # poll shares per option, by state key
+    poll_df = add_voter_flags(load_cces(["inputstate", "CC24_364b", "CC24_363", "TS_g2024"]))
+    poll_df = poll_df[population_masks(poll_df)[population]]
+    fips, state_index = group_index(poll_df["inputstate"].to_numpy())
+    n, polls = option_polls(state_index, poll_df["CC24_364b"].to_numpy(dtype=float), len(fips), options)
+    poll_keys = keys_from_fips(fips)
+
+    # states with both results and polls, joined on the state key
+    rows = inner_join(
+        pd.DataFrame({"result_row": np.arange(len(result_keys))}), result_keys,
+        pd.DataFrame({"poll_row": np.arange(len(poll_keys))}), poll_keys,
+    )
+    result_rows, poll_rows = rows["result_row"].to_numpy(), rows["poll_row"].to_numpy()
+    polls, n = polls[poll_rows], n[poll_rows]
+    shares, total_votes = shares[result_rows], total_votes[result_rows].astype(float)
+
+    metrics = candidate_metrics(polls, shares, n, total_votes)
+    table = metrics_table(result_keys[result_rows], options, polls, shares, n, total_votes, metrics)
+    suffix = "" if population == "all" else f"_{population}"
+    output_file = f"../data/candidate_metrics{suffix}.csv"
+    table.to_csv(output_file, index=False)
+    print(f"Saved {len(options)} candidates x {len(rows)} states to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
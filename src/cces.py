@@ -0,0 +1,115 @@
+# shared helpers for the CCES 2024 common content
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv
+
+# CC24_364b: 1 = Harris, 2 = Trump, 3 = Other, 4 = Won't vote, 5 = Not sure
+# CC24_363: 1 = Yes definitely, 2 = Probably, 3 = Already voted, 4 = Plan to vote, 5 = No, 6 = Undecided
+# TS_g2024: validated 2024 general election vote method, < 7 means the respondent voted
+
+# state aggregation is done with one sparse (states x respondents) indicator matrix product,
+# so every per-state sum needed (counts, weighted sums, sums of squared weights) comes from a single pass.
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+DATA_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+CCES_PATH: str = os.path.join(DATA_DIR, "CCES24_Common_OUTPUT_vv_topost_final.csv")
+
+LIKELY_VOTER_CODES: List[int] = [1, 2, 3, 4]
+PREFERENCE_CODES: Dict[str, int] = {"harris": 1, "trump": 2}
+
+
+def load_cces(columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read the CCES file, optionally only the given columns."""
+    return pd.read_csv(CCES_PATH, usecols=columns)
+
+
+def add_voter_flags(poll_df: pd.DataFrame) -> pd.DataFrame:
+    """Add is_likely_voter and is_validated_voter columns."""
+    poll_df["is_likely_voter"] = poll_df["CC24_363"].isin(LIKELY_VOTER_CODES)
+    poll_df["is_validated_voter"] = poll_df["TS_g2024"].notna() & (poll_df["TS_g2024"] < 7)
+    return poll_df
+
+
+def encode_preferences(poll_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add harris_preference and trump_preference columns, vectorized.
+
+    1.0 if the respondent picked the candidate, 0.0 for any other answer, NaN if CC24_364b is missing.
+    """
+    code = poll_df["CC24_364b"].to_numpy(dtype=float)
+    for candidate, candidate_code in PREFERENCE_CODES.items():
+        poll_df[f"{candidate}_preference"] = np.where(np.isnan(code), np.nan, (code == candidate_code).astype(float))
+    return poll_df
+
+
+def population_masks(poll_df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Boolean masks for the all, likely and validated populations among respondents with a preference."""
+    answered = poll_df["CC24_364b"].notna().to_numpy()
+    return {
+        "all": answered,
+        "likely": answered & poll_df["is_likely_voter"].to_numpy(),
+        "validated": answered & poll_df["is_validated_voter"].to_numpy(),
+    }
+
+
+def group_index(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Map arbitrary keys (e.g. FIPS codes) to 0..G-1; returns (unique keys, index per row)."""
+    return np.unique(keys, return_inverse=True)
+
+
+def grouped_sums(index: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Per-group column sums of values in one sparse matrix product.
+
+    Args:
+        index: Group index per row, in 0..n_groups-1
+        values: Array of shape (n_rows,) or (n_rows, k)
+        n_groups: Number of groups
+
+    Returns:
+        Array of shape (n_groups,) or (n_groups, k)
+    """
+    n_rows = len(index)
+    indicator = sp.csr_matrix((np.ones(n_rows), (index, np.arange(n_rows))), shape=(n_groups, n_rows))
+    return np.asarray(indicator @ values)
+
+
+def weighted_state_summary(poll_df: pd.DataFrame, weight_col: str) -> pd.DataFrame:
+    """
+    Weighted harris/trump preference per state, with Kish design effect, in one grouped pass.
+
+    Respondents with a missing or non-positive weight are left out of the weighted means and the
+    design effect, but still counted in caseid.
+
+    Returns:
+        DataFrame with inputstate, harris_preference, trump_preference, caseid,
+        kish_deff (n_w * sum(w^2) / sum(w)^2) and weight_effective_sample_size (sum(w)^2 / sum(w^2))
+    """
+    states, index = group_index(poll_df["inputstate"].to_numpy())
+    w = poll_df[weight_col].to_numpy(dtype=float)
+    valid = ~np.isnan(w) & (w > 0)
+    w = np.where(valid, w, 0.0)
+    harris = np.nan_to_num(poll_df["harris_preference"].to_numpy(dtype=float))
+    trump = np.nan_to_num(poll_df["trump_preference"].to_numpy(dtype=float))
+
+    sums = grouped_sums(
+        index,
+        np.column_stack([np.ones(len(w)), valid.astype(float), w, w * harris, w * trump, w ** 2]),
+        len(states),
+    )
+    count, n_valid, sum_w, sum_wh, sum_wt, sum_w2 = sums.T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        summary = pd.DataFrame({
+            "inputstate": states,
+            "harris_preference": np.where(sum_w > 0, sum_wh / sum_w, np.nan),
+            "trump_preference": np.where(sum_w > 0, sum_wt / sum_w, np.nan),
+            "caseid": count.astype(int),
+            "kish_deff": np.where(sum_w > 0, n_valid * sum_w2 / sum_w ** 2, np.nan),
+            "weight_effective_sample_size": np.where(sum_w2 > 0, sum_w ** 2 / sum_w2, np.nan),
+        })
+    return summary
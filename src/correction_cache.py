@@ -0,0 +1,153 @@
+# memoized intermediates for the bias correction in bias_correction.py
+# input: ../data/merged_{population}_voters.csv
+# Turnout data: ../data/Turnout_2016G_v1.0.csv
+# VEP data: ../data/Turnout_2024G_v0.3.csv
+
+# f, sigma and sqrt((1-f)/f) * sigma depend only on the survey and turnout inputs, not on rho.
+# They are cached per state, keyed by a fingerprint of the arrays they are computed from,
+# so changing rho only redoes the final multiply-subtract:
+#     poll_corrected = poll - rho * scale, where scale = sqrt((1-f)/f) * sigma
+# loaded input files are cached too, keyed by (path, size, mtime), so an edited CSV is picked up.
+# terms are also written to ../data/.cache so a fresh process can reuse them; only the MAX_CACHED_TERMS
+# most recently used files are kept, older ones are deleted when a new one is written.
+
+import hashlib
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from states import attach, keys_from_fips
+from turnout import DATA_DIR, TURNOUT_2016_PATH, TURNOUT_2024_PATH
+
+CACHE_DIR: str = os.path.join(DATA_DIR, ".cache")
+MAX_CACHED_TERMS = 16
+
+_input_cache: Dict[tuple, pd.DataFrame] = {}
+_terms_cache: Dict[str, Dict[str, np.ndarray]] = {}
+
+
+def file_fingerprint(path: str) -> Tuple[str, int, int]:
+    """Identify a file version by its path, size and modification time."""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def array_fingerprint(*arrays: np.ndarray) -> str:
+    """Hash the dtype, shape and bytes of each array into a short hex key."""
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str((array.dtype.str, array.shape)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def prune_terms_cache(cache_dir: str = CACHE_DIR, keep: int = MAX_CACHED_TERMS) -> None:
+    """Delete all but the keep most recently used correction_terms_*.npz files in cache_dir."""
+    paths = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+             if name.startswith("correction_terms_") and name.endswith(".npz")]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        os.remove(path)
+
+
+def load_inputs(population: str = "all") -> pd.DataFrame:
+    """
+    Load merged_{population}_voters.csv joined with turnout, with estimated_votes filled in.
+
+    The result is cached until one of the three input files changes.
+    """
+    merged_path = os.path.join(DATA_DIR, f"merged_{population}_voters.csv")
+    key = tuple(file_fingerprint(p) for p in (merged_path, TURNOUT_2016_PATH, TURNOUT_2024_PATH))
+    if key in _input_cache:
+        return _input_cache[key]
+
+    df = pd.read_csv(merged_path)
+    df = attach(df, keys_from_fips(df["inputstate"]), ["VEP_TURNOUT_RATE_2016", "VEP_2024"])
+
+    # estimated_votes = 2016 turnout rate * 2024 vep, falling back to total_votes
+    df["estimated_votes"] = (df["VEP_TURNOUT_RATE_2016"] * df["VEP_2024"]).fillna(df["total_votes"])
+
+    _input_cache[key] = df
+    return df
+
+
+def correction_terms(
+    n: np.ndarray, N: np.ndarray, poll: np.ndarray, cache_dir: Optional[str] = CACHE_DIR
+) -> Dict[str, np.ndarray]:
+    """
+    Per-state f, sigma and scale = sqrt((1-f)/f) * sigma, memoized on the input arrays.
+
+    Args:
+        n: Number of respondents per state
+        N: Population size per state (e.g. estimated_votes)
+        poll: Poll share per state
+        cache_dir: Directory for the on-disk cache, or None to keep it in memory only
+
+    Returns:
+        Dict with keys "f", "sigma" and "scale"
+    """
+    n = np.asarray(n, dtype=float)
+    N = np.asarray(N, dtype=float)
+    poll = np.asarray(poll, dtype=float)
+    key = array_fingerprint(n, N, poll)
+    if key in _terms_cache:
+        return _terms_cache[key]
+
+    cache_path = os.path.join(cache_dir, f"correction_terms_{key}.npz") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with np.load(cache_path) as stored:
+            terms = {name: stored[name] for name in stored.files}
+        # mark as recently used for prune_terms_cache
+        os.utime(cache_path)
+    else:
+        f = n / N
+        # standard deviation of a Bernoulli distribution with probability poll
+        sigma = np.sqrt(poll * (1 - poll))
+        terms = {"f": f, "sigma": sigma, "scale": np.sqrt((1 - f) / f) * sigma}
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(cache_path, **terms)
+            prune_terms_cache(cache_dir)
+
+    _terms_cache[key] = terms
+    return terms
+
+
+def bias_corrected(
+    rho: float, candidate: str = "trump", population: str = "all"
+) -> pd.DataFrame:
+    """
+    Bias-corrected poll estimate for one rho; only the multiply-subtract depends on rho.
+
+    Args:
+        rho: Assumed data defect correlation
+        candidate: "trump" or "harris"
+        population: "all", "likely" or "validated"
+
+    Returns:
+        DataFrame with state, f, sigma, bias_correction_term and {candidate}_poll_corrected
+    """
+    df = load_inputs(population)
+    poll = df[f"{candidate}_poll_{population}"].to_numpy(dtype=float)
+    terms = correction_terms(
+        df[f"num_respondents_{population}"].to_numpy(dtype=float),
+        df["estimated_votes"].to_numpy(dtype=float),
+        poll,
+    )
+    correction = rho * terms["scale"]
+    return pd.DataFrame({
+        "state": df["state"],
+        "f": terms["f"],
+        "sigma": terms["sigma"],
+        "bias_correction_term": correction,
+        f"{candidate}_poll_corrected": poll - correction,
+    })
+
+
+def clear_cache() -> None:
+    """Drop all in-memory cached inputs and terms."""
+    _input_cache.clear()
+    _terms_cache.clear()
@@ -0,0 +1,140 @@
+# county-level version of figure_5_dataset.py and figure_6_dataset.py
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv (countyfips)
+# input: state_json_files/{XX}.json through reporting_units.py
+# output: ../data/figure_5_county.csv, ../data/figure_6_county.csv (or _likely_county / _validated_county)
+
+# 50 states are few points for the log N regressions of figure_6.py, so here every county is a point.
+# respondents are summed per county FIPS in one sparse grouped reduction (cces.grouped_sums, ~3,000 groups)
+# and joined to the AP reporting-unit totals by fipsCode with the O(1) FIPS index of reporting_units.py.
+# error, sigma_g, f, rho and Z_n,N are computed as in figure_5_dataset.py / figure_6_dataset.py.
+
+# AP reports Alaska as one statewide unit (fipsCode 02000) instead of counties, so in states without any
+# county unit every respondent is assigned the statewide code {state}000 and the state is one row.
+# respondents whose FIPS code still has no AP unit are counted per state and reported.
+
+# the output keeps the figure 5 / figure 6 column names, with the parent state in the state column
+# (so figure_6.py colors counties by their state's classification) and the county FIPS code in fips.
+# set suffix = "_county" in figure_6.py to draw the county version of figure 6 with the same regression code.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from cces import add_voter_flags, encode_preferences, group_index, grouped_sums, load_cces, population_masks
+from data_defect import data_defect_metrics
+from extract_ap_results import HARRIS_ID, STATE_NAMES, TRUMP_ID
+from reporting_units import MAX_FIPS, candidate_column, fips_votes, load_store
+from states import gather, keys_from_fips
+
+CANDIDATES = {"harris": HARRIS_ID, "trump": TRUMP_ID}
+
+population = "all"  # all, likely or validated
+min_respondents = 20  # counties with fewer respondents are dropped
+
+
+def statewide_states(store) -> np.ndarray:
+    """State FIPS codes of the states AP reports as one statewide unit (fipsCode {state}000) and no counties."""
+    statewide = store["unit_fips"] % 1000 == 0
+    with_counties = np.unique(store["unit_state"][~statewide])
+    only_statewide = statewide & ~np.isin(store["unit_state"], with_counties)
+    return np.unique(store["unit_fips"][only_statewide] // 1000)
+
+
+def respondent_fips(poll_df: pd.DataFrame, store) -> np.ndarray:
+    """FIPS code per respondent: countyfips, or {state}000 in the states of statewide_states."""
+    state = poll_df["inputstate"].to_numpy(dtype=float)
+    return np.where(np.isin(state, statewide_states(store)), state * 1000, poll_df["countyfips"].to_numpy(dtype=float))
+
+
+def unmatched_respondents(poll_df: pd.DataFrame, store) -> pd.Series:
+    """Number of respondents per state whose fips has no AP reporting unit (states with none are left out)."""
+    fips = poll_df["fips"].to_numpy(dtype=float)
+    valid = np.isfinite(fips) & (fips >= 0) & (fips < MAX_FIPS)
+    position = np.full(len(fips), -1)
+    position[valid] = store["fips_position"][fips[valid].astype(np.int64)]
+    state = gather("name", keys_from_fips(poll_df["inputstate"]))
+    counts = pd.Series(state[position < 0]).value_counts()
+    return counts[counts > 0]
+
+
+def county_polls(poll_df: pd.DataFrame) -> pd.DataFrame:
+    """Respondent counts and poll shares per FIPS code (fips column), from one grouped reduction."""
+    poll_df = poll_df[poll_df["fips"].notna()]
+    counties, index = group_index(poll_df["fips"].to_numpy(dtype=np.int64))
+    values = np.column_stack([np.ones(len(poll_df))] + [
+        poll_df[f"{candidate}_preference"].to_numpy(dtype=float) for candidate in CANDIDATES
+    ])
+    sums = grouped_sums(index, values, len(counties))
+    result = pd.DataFrame({"fips": counties, "sample_size": sums[:, 0].astype(int)})
+    for k, candidate in enumerate(CANDIDATES):
+        result[f"{candidate}_poll"] = sums[:, k + 1] / sums[:, 0]
+    return result
+
+
+def county_dataset(polls: pd.DataFrame, store) -> pd.DataFrame:
+    """Join county polls to AP county totals and compute the figure 5 and figure 6 quantities."""
+    votes = fips_votes(store, polls["fips"].to_numpy())
+    total_votes = votes[:, -1]
+    matched = np.isfinite(total_votes) & (total_votes > 0)
+    polls = polls[matched].reset_index(drop=True)
+    votes = votes[matched]
+    total_votes = votes[:, -1]
+
+    # parent state from the first reporting unit of each FIPS code (New England towns share their county's code)
+    position = store["fips_position"][polls["fips"].to_numpy()]
+    first_unit = store["fips_start"][position]
+    state_abbr = store["states"][store["unit_state"][first_unit]]
+
+    result = pd.DataFrame({
+        "state": [STATE_NAMES.get(abbr) for abbr in state_abbr],
+        "fips": polls["fips"],
+        "sample_size": polls["sample_size"],
+        "total_votes": total_votes,
+    })
+    for candidate, candidate_id in CANDIDATES.items():
+        share = votes[:, candidate_column(store, candidate_id)] / total_votes
+        metrics = data_defect_metrics(polls[f"{candidate}_poll"], share, polls["sample_size"], total_votes)
+        result[f"{candidate}_share"] = share
+        result[f"{candidate}_error"] = metrics["error"]
+        result[f"{candidate}_sigma_g"] = metrics["sigma_g"]
+        result[f"{candidate}_data_defect_correlation"] = metrics["data_defect_correlation"]
+        result[f"{candidate}_Z_n_N"] = metrics["Z_n_N"]
+    result["sample_ratio"] = result["sample_size"] / result["total_votes"]
+    return result
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    poll_df = load_cces(["inputstate", "countyfips", "CC24_364b", "CC24_363", "TS_g2024"])
+    poll_df = encode_preferences(add_voter_flags(poll_df))
+    poll_df = poll_df[population_masks(poll_df)[population]]
+
+    store = load_store()
+    poll_df = poll_df.assign(fips=respondent_fips(poll_df, store))
+    unmatched = unmatched_respondents(poll_df, store)
+    if len(unmatched):
+        per_state = ", ".join(f"{state} {count}" for state, count in unmatched.items())
+        print(f"{unmatched.sum()} respondents without an AP county: {per_state}")
+
+    polls = county_polls(poll_df)
+    polls = polls[polls["sample_size"] >= min_respondents]
+    result = county_dataset(polls, store)
+    print(f"{len(result)} counties with at least {min_respondents} respondents matched to AP results")
+
+    suffix = "_county" if population == "all" else f"_{population}_county"
+    figure_5_columns = ["state", "fips", "trump_error", "harris_error", "trump_sigma_g", "harris_sigma_g",
+                        "sample_ratio", "trump_data_defect_correlation", "harris_data_defect_correlation",
+                        "sample_size", "total_votes"]
+    figure_6_columns = ["state", "fips", "trump_sigma_g", "harris_sigma_g", "sample_ratio", "sample_size",
+                        "total_votes", "trump_error", "harris_error", "trump_Z_n_N", "harris_Z_n_N"]
+    result[figure_5_columns].to_csv(f"../data/figure_5{suffix}.csv", index=False)
+    result[figure_6_columns].to_csv(f"../data/figure_6{suffix}.csv", index=False)
+    print(f"Saved ../data/figure_5{suffix}.csv and ../data/figure_6{suffix}.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# the data defect pipeline over several election cycles at once
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv, and the 2016 / 2020 CCES files if present
+# input: ../data/2024_us_election_results_by_state.csv, and ../data/{year}_us_election_results_by_state.csv if present
+# input: ../data/Turnout_{year}G_*.csv (through turnout.py)
+# output: ../data/cycles/{year}.npz (per-cycle store)
+# output: ../data/cycle_metrics.csv
+
+# every cycle names its CCES items differently (CC24_364b / CC20_364b / CC16_364c, ...) and codes the answers
+# differently, so CYCLES maps each year onto one schema: state FIPS, vote choice coded to the options
+# dem / rep / other (other answers, e.g. won't vote or not sure, stay in n but in no option), likely voter
+# and validated voter. Item names and codes other than 2024's follow the CCES codebooks of those years.
+
+# each cycle is reduced once to state-level counts and stored in ../data/cycles/{year}.npz, keyed by the
+# sizes and modification times of its input files and by its CYCLES schema (so editing an item name or code
+# rebuilds it):
+#   n (states x populations), counts (states x populations x options), votes (states x options),
+#   total_votes (states,), and the cycle's turnout columns (vep, vep_turnout_rate) per state
+# states are on the state key axis of states.py, so all cycles share one layout and stack into
+# (years x states x populations x options) arrays; the metrics of every cycle come from one
+# data_defect_metrics call, and rho across cycles is compared per state and option in cycle_metrics.csv.
+
+import hashlib
+import io
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cces import CCES_PATH, LIKELY_VOTER_CODES, PREFERENCE_CODES, grouped_sums
+from data_defect import data_defect_metrics
+from file_io import atomic_write
+from states import STATE_FIPS, keys_from_fips, keys_from_names
+from turnout import DATA_DIR, TURNOUT_2016_PATH, TURNOUT_2024_PATH, load_turnout
+
+OPTIONS = ["dem", "rep", "other"]
+POPULATIONS = ["all", "likely", "validated"]
+STORE_DIR: str = os.path.join(DATA_DIR, "cycles")
+
+# schema per cycle
+#   cces_path / sep: CCES common content file
+#   choice: pre-election vote choice item, choice_codes: answer code -> option
+#   intent: turnout intent item, likely_codes: answers counted as likely voters
+#   validated: validated vote item, validated_max: values below this count as voted (None: any value)
+#   results_path: state, {option}_votes for dem and rep, total_votes; results_columns maps them from the file
+#   turnout_path: Election Lab turnout file
+CYCLES: Dict[int, Dict[str, Any]] = {
+    2016: {
+        "cces_path": os.path.join(DATA_DIR, "CCES16_Common_OUTPUT_Feb2018_VV.tab"),
+        "sep": "\t",
+        "choice": "CC16_364c",
+        "choice_codes": {2: "dem", 1: "rep", 3: "other", 4: "other", 5: "other"},
+        "intent": "CC16_364",
+        "likely_codes": [1, 2, 3, 4],
+        "validated": "CL_E2016GVM",
+        "validated_max": None,
+        "results_path": os.path.join(DATA_DIR, "2016_us_election_results_by_state.csv"),
+        "results_columns": {"state": "state", "dem_votes": "clinton_votes", "rep_votes": "trump_votes",
+                            "total_votes": "total_votes"},
+        "turnout_path": TURNOUT_2016_PATH,
+    },
+    2020: {
+        "cces_path": os.path.join(DATA_DIR, "CES20_Common_OUTPUT_vv.csv"),
+        "sep": ",",
+        "choice": "CC20_364b",
+        "choice_codes": {1: "dem", 2: "rep", 3: "other"},
+        "intent": "CC20_363",
+        "likely_codes": [1, 2, 3, 4],
+        "validated": "CL_2020gvm",
+        "validated_max": None,
+        "results_path": os.path.join(DATA_DIR, "2020_us_election_results_by_state.csv"),
+        "results_columns": {"state": "state", "dem_votes": "biden_votes", "rep_votes": "trump_votes",
+                            "total_votes": "total_votes"},
+        "turnout_path": os.path.join(DATA_DIR, "Turnout_2020G_v1.2.csv"),
+    },
+    2024: {
+        "cces_path": CCES_PATH,
+        "sep": ",",
+        "choice": "CC24_364b",
+        "choice_codes": {PREFERENCE_CODES["harris"]: "dem", PREFERENCE_CODES["trump"]: "rep", 3: "other"},
+        "intent": "CC24_363",
+        "likely_codes": LIKELY_VOTER_CODES,
+        "validated": "TS_g2024",
+        "validated_max": 7,
+        "results_path": os.path.join(DATA_DIR, "2024_us_election_results_by_state.csv"),
+        "results_columns": {"state": "state", "dem_votes": "harris_votes", "rep_votes": "trump_votes",
+                            "total_votes": "total_votes"},
+        "turnout_path": TURNOUT_2024_PATH,
+    },
+}
+
+years: Optional[List[int]] = None  # None runs every cycle whose input files are present
+
+
+def available_cycles() -> List[int]:
+    """Years whose CCES and results files are both present."""
+    return [
+        year for year, schema in CYCLES.items()
+        if os.path.exists(schema["cces_path"]) and os.path.exists(schema["results_path"])
+    ]
+
+
+def normalize(raw: pd.DataFrame, schema: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    A cycle's respondents in the shared schema.
+
+    Returns:
+        (state key per respondent, option index per respondent (-1 for other answers),
+        population masks of shape (respondents x populations)); respondents without a vote choice are dropped
+    """
+    choice = pd.to_numeric(raw[schema["choice"]], errors="coerce").to_numpy(dtype=float)
+    answered = np.isfinite(choice)
+    raw, choice = raw[answered], choice[answered].astype(int)
+
+    code_to_option = np.full(max(max(schema["choice_codes"]), choice.max(initial=0)) + 1, -1)
+    for code, option in schema["choice_codes"].items():
+        code_to_option[code] = OPTIONS.index(option)
+    option = code_to_option[choice]
+
+    likely = raw[schema["intent"]].isin(schema["likely_codes"]).to_numpy()
+    validated_value = raw[schema["validated"]]
+    validated = validated_value.notna().to_numpy()
+    if schema["validated_max"] is not None:
+        validated &= (pd.to_numeric(validated_value, errors="coerce") < schema["validated_max"]).to_numpy()
+    masks = np.column_stack([np.ones(len(raw), dtype=bool), likely, validated])
+    return keys_from_fips(raw["inputstate"]), option, masks
+
+
+def cycle_counts(state_keys: np.ndarray, option: np.ndarray, masks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Respondents and option counts per state and population, in one grouped reduction.
+
+    Returns:
+        (n of shape (states x populations), counts of shape (states x populations x options))
+    """
+    n_states, n_populations, n_options = len(STATE_FIPS), masks.shape[1], len(OPTIONS)
+    keep = state_keys >= 0
+    one_hot = option[keep, None] == np.arange(n_options)[None, :]
+    # columns: per population, the respondent indicator followed by the option indicators
+    values = np.concatenate([
+        np.column_stack([masks[keep, p], masks[keep, p, None] & one_hot]) for p in range(n_populations)
+    ], axis=1).astype(float)
+    sums = grouped_sums(state_keys[keep], values, n_states).reshape(n_states, n_populations, n_options + 1)
+    return sums[:, :, 0], sums[:, :, 1:]
+
+
+def cycle_results(schema: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Votes per option and total votes on the state key axis (NaN for states without results).
+
+    Returns:
+        (votes of shape (states x options), total_votes of shape (states,))
+    """
+    results = pd.read_csv(schema["results_path"])
+    columns = schema["results_columns"]
+    keys = keys_from_names(results[columns["state"]])
+    valid = keys >= 0
+    total = results[columns["total_votes"]].to_numpy(dtype=float)[valid]
+    dem = results[columns["dem_votes"]].to_numpy(dtype=float)[valid]
+    rep = results[columns["rep_votes"]].to_numpy(dtype=float)[valid]
+
+    votes = np.full((len(STATE_FIPS), len(OPTIONS)), np.nan)
+    total_votes = np.full(len(STATE_FIPS), np.nan)
+    votes[keys[valid]] = np.column_stack([dem, rep, total - dem - rep])
+    total_votes[keys[valid]] = total
+    return votes, total_votes
+
+
+def cycle_turnout(schema: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """VEP and VEP turnout rate on the state key axis (NaN if the turnout file is missing)."""
+    vep = np.full(len(STATE_FIPS), np.nan)
+    rate = np.full(len(STATE_FIPS), np.nan)
+    if os.path.exists(schema["turnout_path"]):
+        turnout = load_turnout(schema["turnout_path"])
+        keys = keys_from_names(turnout["STATE"])
+        valid = keys >= 0
+        vep[keys[valid]] = turnout["VEP"].to_numpy()[valid]
+        rate[keys[valid]] = turnout["VEP_TURNOUT_RATE"].to_numpy()[valid]
+    return {"vep": vep, "vep_turnout_rate": rate}
+
+
+def _fingerprint(schema: Dict[str, Any]) -> str:
+    # the schema (items, codes, paths) as well as the input files, so an edited CYCLES entry is rebuilt
+    items = sorted((name, sorted(value.items()) if isinstance(value, dict) else value) for name, value in schema.items())
+    parts = [hashlib.sha1(repr(items).encode()).hexdigest()]
+    for path in [schema["cces_path"], schema["results_path"], schema["turnout_path"]]:
+        stat = os.stat(path) if os.path.exists(path) else None
+        parts.append(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}" if stat else f"{path}:missing")
+    return ";".join(parts)
+
+
+def load_cycle(year: int, store_dir: str = STORE_DIR) -> Dict[str, np.ndarray]:
+    """A cycle's state-level arrays from the store, rebuilt when its input files changed."""
+    schema = CYCLES[year]
+    path = os.path.join(store_dir, f"{year}.npz")
+    key = _fingerprint(schema)
+    if os.path.exists(path):
+        with np.load(path) as stored:
+            if str(stored["fingerprint"]) == key:
+                return {name: stored[name] for name in stored.files if name != "fingerprint"}
+
+    columns = ["inputstate", schema["choice"], schema["intent"], schema["validated"]]
+    raw = pd.read_csv(schema["cces_path"], sep=schema["sep"], usecols=columns)
+    n, counts = cycle_counts(*normalize(raw, schema))
+    votes, total_votes = cycle_results(schema)
+    cycle = {"n": n, "counts": counts, "votes": votes, "total_votes": total_votes, **cycle_turnout(schema)}
+
+    os.makedirs(store_dir, exist_ok=True)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, fingerprint=np.array(key), **cycle)
+    atomic_write(path, buffer.getvalue())
+    return cycle
+
+
+def stack_cycles(cycles: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """Stack per-cycle arrays along a leading year axis."""
+    return {name: np.stack([cycle[name] for cycle in cycles]) for name in cycles[0]}
+
+
+def cycle_metrics(stacked: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Metrics of every year, state, population and option in one call; arrays are (years x states x populations x options)."""
+    n = stacked["n"][..., None]
+    total_votes = stacked["total_votes"][:, :, None, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        polls = stacked["counts"] / n
+        shares = stacked["votes"][:, :, None, :] / total_votes
+    metrics = data_defect_metrics(polls, shares, n, total_votes)
+    metrics["poll"], metrics["share"] = polls, np.broadcast_to(shares, polls.shape)
+    return metrics
+
+
+def metrics_table(year_axis: List[int], stacked: Dict[str, np.ndarray], metrics: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Long table with one row per year x state x population x option with results and respondents."""
+    shape = metrics["poll"].shape
+    index = np.indices(shape).reshape(len(shape), -1)
+    table = pd.DataFrame({
+        "year": np.array(year_axis)[index[0]],
+        "state": np.array([name for _, _, name in STATE_FIPS])[index[1]],
+        "population": np.array(POPULATIONS)[index[2]],
+        "candidate": np.array(OPTIONS)[index[3]],
+        "sample_size": stacked["n"][index[0], index[1], index[2]],
+        "total_votes": stacked["total_votes"][index[0], index[1]],
+        "vep": stacked["vep"][index[0], index[1]],
+    })
+    for name in ["poll", "share", "error", "sigma_g", "sample_ratio", "data_defect_correlation", "Z_n_N", "Z_n"]:
+        table[name] = np.broadcast_to(metrics[name], shape).ravel()
+    return table[(table["sample_size"] > 0) & table["share"].notna()].reset_index(drop=True)
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    year_axis = years or available_cycles()
+    if not year_axis:
+        print("No cycle has both its CCES and results files in ../data")
+        return
+    stacked = stack_cycles([load_cycle(year) for year in year_axis])
+    metrics = cycle_metrics(stacked)
+    table = metrics_table(year_axis, stacked, metrics)
+    output_file = "../data/cycle_metrics.csv"
+    table.to_csv(output_file, index=False)
+    print(f"Saved {len(year_axis)} cycles to {output_file}")
+
+    # vote-weighted mean rho per cycle (all respondents), to compare across elections
+    rho = metrics["data_defect_correlation"][:, :, 0, :]
+    weights = np.where(np.isfinite(rho), stacked["total_votes"][:, :, None], 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_rho = np.nansum(weights * np.nan_to_num(rho), axis=1) / weights.sum(axis=1)
+    for year, row in zip(year_axis, mean_rho):
+        print(f"{year}: " + ", ".join(f"{option} rho {value:.4f}" for option, value in zip(OPTIONS, row)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# the data defect identity and the metrics derived from it, as used across the figure scripts
+# error = poll - share = rho * sigma_g * sqrt((1-f)/f)
+
+# every function works elementwise on arrays of any (broadcastable) shape, e.g. states,
+# states x candidates or weights x states x candidates
+
+from typing import Dict
+
+import numpy as np
+
+
+def data_defect_metrics(poll, share, n, N) -> Dict[str, np.ndarray]:
+    """
+    Error, sigma_g, sample ratio, data defect correlation, Z scores and effective sample size.
+
+    Args:
+        poll: Poll estimate of the share
+        share: Actual vote share
+        n: Number of respondents
+        N: Population size (e.g. total_votes)
+
+    Returns:
+        Dict of arrays:
+        error = poll - share (figure_5_dataset.py)
+        sigma_g = sqrt(share * (1 - share)) (figure_5_dataset.py)
+        sample_ratio = f = n / N (figure_5_dataset.py)
+        data_defect_correlation = error / (sigma_g * sqrt((1-f)/f)) (figure_5_dataset.py)
+        s_g_sq = N/(N-1) * sigma_g^2, var_srs = (1-f)/n * s_g_sq (figure_6_dataset.py)
+        Z_n_N = error / sqrt(var_srs) (figure_6_dataset.py)
+        Z_n = error / sqrt(poll * (1 - poll) / n) (figure_7.py)
+        effective_sample_size = f / (1-f) / rho^2 (effective_sample_size.py)
+    """
+    poll = np.asarray(poll, dtype=float)
+    share = np.asarray(share, dtype=float)
+    n = np.asarray(n, dtype=float)
+    N = np.asarray(N, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        error = poll - share
+        sigma_g = np.sqrt(share * (1 - share))
+        f = n / N
+        rho = error / (sigma_g * np.sqrt((1 - f) / f))
+        s_g_sq = N / (N - 1) * sigma_g ** 2
+        var_srs = (1 - f) / n * s_g_sq
+        return {
+            "error": error,
+            "sigma_g": sigma_g,
+            "sample_ratio": f,
+            "data_defect_correlation": rho,
+            "s_g_sq": s_g_sq,
+            "var_srs": var_srs,
+            "Z_n_N": error / np.sqrt(var_srs),
+            "Z_n": error / np.sqrt(poll * (1 - poll) / n),
+            "effective_sample_size": f / (1 - f) / rho ** 2,
+        }
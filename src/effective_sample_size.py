@@ -11,6 +11,17 @@
 
 # output to ../data/output.csv
 
+# if ../data/design_effect.csv (from figure_4_weighted.py) exists, the loss of the weighted estimator is also
+# split into a weighting part and a selection-bias part:
+# weight_effective_sample_size = sum(w)^2 / sum(w^2), kish_deff = sample_size / weight_effective_sample_size
+# weighted_effective_sample_size = f/(1-f)/rho_w^2, with rho_w the data defect correlation of the weighted poll
+# weighting_percentage_reduction = (1 - weight_effective_sample_size/sample_size)*100%
+# selection_percentage_reduction = (1 - weighted_effective_sample_size/weight_effective_sample_size)*100%
+# so that sample_size / weighted_effective_sample_size
+#     = kish_deff * (weight_effective_sample_size / weighted_effective_sample_size)
+# both parts describe the weighted estimator; effective_sample_size above is that of the unweighted one.
+# for the fixed-rho table the fixed rho is taken as the weighted estimator's.
+
 import pandas as pd
 import os
 
@@ -20,6 +31,8 @@ os.chdir(script_dir)
 
 # Define input and output paths
 input_path = os.path.join("../data", "figure_5.csv")
+population = "all"  # population of figure_5.csv, used to pick the design effect columns
+design_effect_path = os.path.join("../data", "design_effect.csv")
 output_path = os.path.join("../data", "effective_sample_size.csv")
 fixed_rho_output_path = os.path.join("../data", "effective_sample_size_fixed_rho.csv")
 
@@ -52,6 +65,32 @@ df["harris_percentage_reduction"] = (
     1 - df["harris_effective_sample_size"] / df["sample_size"]
 ) * 100
 
+# Split the loss into a weighting part and a selection-bias part
+if os.path.exists(design_effect_path):
+    design_effect = pd.read_csv(design_effect_path)
+    design_effect = design_effect[[
+        "state", f"kish_deff_{population}", f"weight_effective_sample_size_{population}",
+        f"trump_weighted_effective_sample_size_{population}", f"harris_weighted_effective_sample_size_{population}",
+    ]].rename(columns={
+        f"kish_deff_{population}": "kish_deff",
+        f"weight_effective_sample_size_{population}": "weight_effective_sample_size",
+        f"trump_weighted_effective_sample_size_{population}": "trump_weighted_effective_sample_size",
+        f"harris_weighted_effective_sample_size_{population}": "harris_weighted_effective_sample_size",
+    })
+    df = df.merge(design_effect, on="state", how="left")
+    df["weighting_percentage_reduction"] = (
+        1 - df["weight_effective_sample_size"] / df["sample_size"]
+    ) * 100
+    df["trump_selection_percentage_reduction"] = (
+        1 - df["trump_weighted_effective_sample_size"] / df["weight_effective_sample_size"]
+    ) * 100
+    df["harris_selection_percentage_reduction"] = (
+        1 - df["harris_weighted_effective_sample_size"] / df["weight_effective_sample_size"]
+    ) * 100
+    print(f"Average Kish design effect: {df['kish_deff'].mean():.2f}")
+else:
+    print(f"{design_effect_path} not found, run figure_4_weighted.py to split off the weighting loss")
+
 # Print summary statistics
 print(f"Number of states processed: {len(df)}")
 print(
@@ -97,6 +136,14 @@ df_fixed["harris_percentage_reduction"] = (
     1 - df_fixed["harris_effective_sample_size"] / df_fixed["sample_size"]
 ) * 100
 
+if "weight_effective_sample_size" in df_fixed.columns:
+    df_fixed["trump_selection_percentage_reduction"] = (
+        1 - df_fixed["trump_effective_sample_size"] / df_fixed["weight_effective_sample_size"]
+    ) * 100
+    df_fixed["harris_selection_percentage_reduction"] = (
+        1 - df_fixed["harris_effective_sample_size"] / df_fixed["weight_effective_sample_size"]
+    ) * 100
+
 # Print summary statistics for fixed values
 print("\nFixed rho values:")
 print(f"Trump data defect correlation: -0.0044")
@@ -0,0 +1,133 @@
+# extraction of the state totals from the AP detail files
+# input: state_json_files/{XX}.json
+# output: ../data/2024_us_election_results_by_state.csv
+
+# each AP file is one JSON object whose keys are the reporting units ("20001", "20003", ...) and, last, "summary".
+# only summary.candidates, summary.parameters.vote.total and summary.lastUpdated are needed, so instead of
+# json.load-ing the whole file we memory-map it, find the top-level "summary" key from the end of the file,
+# and decode just that object with JSONDecoder.raw_decode. The decoded object is only accepted if nothing but
+# the closing brace of the file follows it; otherwise (e.g. a reordered file) we fall back to a full parse.
+# reading a summary this way takes tens of microseconds, so the 50 state files are read in-process: starting
+# a process pool costs more than the whole extraction. Larger batches (POOL_MIN_FILES or more, e.g. the
+# county-level race files) are spread over a process pool.
+
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from states import STATE_FIPS
+
+TRUMP_ID = "8639"
+HARRIS_ID = "64984"
+STATE_NAMES: Dict[str, str] = {abbr: name for _, abbr, name in STATE_FIPS}
+SUMMARY_KEY = b'"summary"'
+POOL_MIN_FILES = 500
+
+input_folder = "state_json_files"
+output_file = "../data/2024_us_election_results_by_state.csv"
+
+
+def read_summary(path: str) -> Dict[str, Any]:
+    """Decode only the top-level summary object of an AP detail file."""
+    decoder = json.JSONDecoder()
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        key = data.rfind(SUMMARY_KEY)
+        if key >= 0:
+            start = data.find(b"{", key + len(SUMMARY_KEY))
+            if start >= 0:
+                text = data[start:].decode("utf-8")
+                try:
+                    summary, end = decoder.raw_decode(text)
+                except json.JSONDecodeError:
+                    pass  # "summary" was not the top-level key, parse the whole file below
+                else:
+                    # only the closing brace of the top-level object may follow
+                    if text[end:].strip() == "}":
+                        return summary
+        return json.loads(data[:].decode("utf-8"))["summary"]
+
+
+def json_files(folder: str) -> List[str]:
+    """Names of the AP detail files in folder, sorted; dotfiles such as the fetch manifest are skipped."""
+    return sorted(f for f in os.listdir(folder) if f.endswith(".json") and not f.startswith("."))
+
+
+def state_row(path: str) -> Dict[str, Any]:
+    """One row of the results table from one state file."""
+    summary = read_summary(path)
+    votes = {candidate["candidateID"]: candidate["voteCount"] for candidate in summary.get("candidates", [])}
+    state_abbr = os.path.basename(path).split(".")[0]
+    return {
+        "state": STATE_NAMES.get(state_abbr),
+        "trump_votes": votes.get(TRUMP_ID),
+        "harris_votes": votes.get(HARRIS_ID),
+        "total_votes": summary["parameters"]["vote"]["total"],
+        "last_updated": summary.get("lastUpdated"),
+    }
+
+
+def candidate_votes(paths: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Votes of every AP candidate in every file (one state, or one race).
+
+    Returns:
+        (candidate IDs, votes of shape (files x candidates), total votes per file)
+    """
+    summaries = [read_summary(path) for path in paths]
+    row, candidate_id, vote_count = zip(*(
+        (i, int(candidate["candidateID"]), candidate["voteCount"])
+        for i, summary in enumerate(summaries) for candidate in summary.get("candidates", [])
+    ))
+    candidate_ids, column = np.unique(candidate_id, return_inverse=True)
+    votes = np.zeros((len(paths), len(candidate_ids)), dtype=np.int64)
+    np.add.at(votes, (np.array(row), column), vote_count)
+    total_votes = np.array([summary["parameters"]["vote"]["total"] for summary in summaries], dtype=np.int64)
+    return candidate_ids, votes, total_votes
+
+
+def extract_candidate_votes(folder: str = input_folder) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Votes of every AP candidate in every state file, in file name order.
+
+    Returns:
+        (state abbreviations, candidate IDs, votes of shape (states x candidates), total votes per state)
+    """
+    names = json_files(folder)
+    candidate_ids, votes, total_votes = candidate_votes([os.path.join(folder, name) for name in names])
+    return np.array([name.split(".")[0] for name in names]), candidate_ids, votes, total_votes
+
+
+def extract_state_results(folder: str = input_folder, use_pool: Optional[bool] = None) -> pd.DataFrame:
+    """
+    Results table for every {XX}.json in folder, in file name order.
+
+    Args:
+        folder: Folder of AP detail files
+        use_pool: Spread the files over a process pool; None decides by the number of files
+    """
+    paths: List[str] = [os.path.join(folder, f) for f in json_files(folder)]
+    if use_pool is None:
+        use_pool = len(paths) >= POOL_MIN_FILES
+    if not use_pool:
+        return pd.DataFrame([state_row(path) for path in paths])
+    with ProcessPoolExecutor() as executor:
+        return pd.DataFrame(list(executor.map(state_row, paths, chunksize=max(1, len(paths) // 64))))
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    df = extract_state_results()
+    df.to_csv(output_file)
+    print(f"Saved {len(df)} states to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# concurrent fetcher for the AP race results (the detail.json files in state_json_files)
+# output: state_json_files/{XX}.json, state_json_files/.manifest.json
+# output: ../data/ap_snapshots.npz (through snapshots.py, when record_snapshots is set)
+
+# scrape_ap_results.ipynb used to fetch the 50 files one after another with requests.get.
+# here all states are fetched concurrently: each request runs in a worker thread (asyncio.to_thread) and an
+# asyncio.Semaphore bounds how many are in flight, so a full refresh takes about one round trip.
+# - failed requests (connection errors, 429 and 5xx) are retried with exponential backoff and jitter
+# - the ETag and Last-Modified of every saved file are kept in .manifest.json and sent back as
+#   If-None-Match / If-Modified-Since, so states that did not change answer 304 and are skipped
+# - files are written to a temporary file in the same folder and moved into place with os.replace,
+#   so a reader never sees a half-written file
+
+# serve_directory starts a local stand-in for the AP server that serves the existing JSON files at the same
+# URL layout (with ETag / Last-Modified / 304 support), to test the fetcher without the network:
+#     use_local_server = True
+
+import asyncio
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from file_io import atomic_write
+from snapshots import load_snapshots, record, save_snapshots
+from states import state_abbreviations
+
+AP_BASE_URL = "https://interactives.apelections.org/election-results/data-live"
+ELECTION_DATE = "2024-11-05"
+STATE_ABBREVIATIONS: List[str] = state_abbreviations()
+MANIFEST_NAME = ".manifest.json"
+
+MAX_CONCURRENCY = 16
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 0.5
+TIMEOUT_SECONDS = 30
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+output_folder = "state_json_files"
+use_local_server = False  # serve the files already in output_folder and fetch from them
+record_snapshots = True  # add the fetched summaries to ../data/ap_snapshots.npz (snapshots.py)
+
+
+def get_race_url(race_id: str, base_url: str = AP_BASE_URL, date: str = ELECTION_DATE) -> str:
+    """URL of a race's detail.json; race_id is AP's {yyyymmdd}{state}{race number}, e.g. 20241105KS0."""
+    state_abbr = race_id[8:10]
+    return f"{base_url}/{date}/results/races/{state_abbr}/{race_id}/detail.json"
+
+
+def get_state_url(state_abbr: str, base_url: str = AP_BASE_URL, date: str = ELECTION_DATE) -> str:
+    """URL of a state's presidential race detail.json."""
+    compressed_date = date.replace("-", "")
+    return get_race_url(f"{compressed_date}{state_abbr}0", base_url, date)
+
+
+def load_manifest(folder: str) -> Dict[str, Dict[str, str]]:
+    """ETag and Last-Modified per state from the last fetch, empty if there is none."""
+    path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _get(url: str, headers: Dict[str, str]) -> requests.Response:
+    return requests.get(url, headers=headers, timeout=TIMEOUT_SECONDS)
+
+
+async def fetch_state(
+    state_abbr: str, base_url: str, folder: str, manifest: Dict[str, Dict[str, str]], semaphore: asyncio.Semaphore,
+    url: Optional[str] = None,
+) -> Tuple[str, str]:
+    """
+    Fetch one state, retrying with backoff, and save it if it changed.
+
+    Args:
+        state_abbr: State, or any name the file is saved under ({name}.json)
+        url: URL to fetch instead of the state's presidential race (e.g. from get_race_url)
+
+    Returns:
+        (state_abbr, status) with status "updated", "unchanged" or "failed: <reason>"
+    """
+    url = url or get_state_url(state_abbr, base_url)
+    cached = manifest.get(state_abbr, {})
+    headers = {}
+    if cached.get("etag") and os.path.exists(os.path.join(folder, f"{state_abbr}.json")):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified") and os.path.exists(os.path.join(folder, f"{state_abbr}.json")):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    reason = ""
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(BACKOFF_SECONDS * 2 ** (attempt - 1) * (1 + random.random()))
+        try:
+            async with semaphore:
+                response = await asyncio.to_thread(_get, url, headers)
+        except requests.RequestException as err:
+            reason = str(err)
+            continue
+        if response.status_code in RETRY_STATUS:
+            reason = f"HTTP {response.status_code}"
+            continue
+        if response.status_code == 304:
+            return state_abbr, "unchanged"
+        if response.status_code != 200:
+            return state_abbr, f"failed: HTTP {response.status_code}"
+
+        atomic_write(os.path.join(folder, f"{state_abbr}.json"), response.content)
+        manifest[state_abbr] = {
+            "etag": response.headers.get("ETag", ""),
+            "last_modified": response.headers.get("Last-Modified", ""),
+        }
+        return state_abbr, "updated"
+    return state_abbr, f"failed: {reason}"
+
+
+async def fetch_all(
+    states: List[str] = STATE_ABBREVIATIONS, folder: str = output_folder, base_url: str = AP_BASE_URL,
+    max_concurrency: int = MAX_CONCURRENCY, urls: Optional[Dict[str, str]] = None,
+) -> Dict[str, str]:
+    """
+    Fetch every state concurrently and save the manifest.
+
+    Args:
+        urls: Name -> URL to fetch instead of the states' presidential races (e.g. one per race ID)
+
+    Returns:
+        Status per state (or per name of urls)
+    """
+    os.makedirs(folder, exist_ok=True)
+    manifest = load_manifest(folder)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    urls = urls or {state: get_state_url(state, base_url) for state in states}
+    results = await asyncio.gather(*(
+        fetch_state(name, base_url, folder, manifest, semaphore, url) for name, url in urls.items()
+    ))
+    atomic_write(os.path.join(folder, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return dict(results)
+
+
+def serve_directory(folder: str, host: str = "127.0.0.1", port: int = 0) -> Tuple[http.server.ThreadingHTTPServer, str]:
+    """
+    Serve {XX}.json (and {race_id}.json) files from folder at the AP URL layout, with ETag / Last-Modified and 304 responses.
+
+    Returns:
+        (server, base_url); call server.shutdown() to stop it
+    """
+    pattern = re.compile(r"/results/races/([A-Z]{2})/(\d{8}[A-Z]{2}(\d+))/detail\.json$")
+    folder = os.path.abspath(folder)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = pattern.search(self.path)
+            path = None
+            if match:
+                # presidential races are saved as {XX}.json, other races as {race_id}.json
+                name = match.group(1) if match.group(3) == "0" else match.group(2)
+                path = os.path.join(folder, f"{name}.json")
+            if path is None or not os.path.exists(path):
+                self.send_error(404)
+                return
+            with open(path, "rb") as file:
+                content = file.read()
+            etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+            mtime = int(os.path.getmtime(path))
+            if self.headers.get("If-None-Match") == etag or (
+                self.headers.get("If-Modified-Since")
+                and "If-None-Match" not in self.headers
+                and parsedate_to_datetime(self.headers["If-Modified-Since"]).timestamp() >= mtime
+            ):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", formatdate(mtime, usegmt=True))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/election-results/data-live"
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    server: Optional[http.server.ThreadingHTTPServer] = None
+    base_url = AP_BASE_URL
+    folder = output_folder
+    if use_local_server:
+        server, base_url = serve_directory(output_folder)
+        # fetch into a scratch copy so the served files are not overwritten while being served
+        folder = tempfile.mkdtemp(prefix="state_json_files_")
+        print(f"Serving {output_folder} at {base_url}, fetching into {folder}")
+
+    try:
+        for attempt in ["first fetch", "refresh"] if use_local_server else ["fetch"]:
+            start = time.perf_counter()
+            statuses = asyncio.run(fetch_all(STATE_ABBREVIATIONS, folder, base_url))
+            elapsed = time.perf_counter() - start
+            counts: Dict[str, int] = {}
+            for status in statuses.values():
+                counts[status] = counts.get(status, 0) + 1
+            print(f"{attempt}: {counts} in {elapsed:.2f}s")
+            for state_abbr, status in statuses.items():
+                if status.startswith("failed"):
+                    print(f"  {state_abbr}: {status}")
+            if record_snapshots and not use_local_server and "updated" in statuses.values():
+                store = load_snapshots()
+                before = len(store["state"])
+                store = record(store, folder)
+                save_snapshots(store)
+                print(f"Recorded {len(store['state']) - before} new snapshots")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,9 @@ import matplotlib.pyplot as plt
 from matplotlib.axes import Axes  # Fix the linter error by importing Axes directly
 import numpy as np
 import os
-from typing import Dict, List, Optional, Union
+from typing import List, Optional, Union
+
+from states import attach, inner_join, keys_from_fips, keys_from_names
 
 # Set the current working directory to the script directory
 script_dir: str = os.path.dirname(os.path.abspath(__file__))
@@ -28,10 +30,6 @@ os.makedirs("../figures", exist_ok=True)
 election_results_path: str = "../data/2024_us_election_results_by_state.csv"
 election_df: pd.DataFrame = pd.read_csv(election_results_path)
 
-# Read state classification data
-classification_path: str = "../data/State-Pre-ElectionClassification.csv"
-classification_df: pd.DataFrame = pd.read_csv(classification_path)
-
 # Calculate the actual vote share for each candidate (including third parties)
 election_df["trump_share"] = election_df["trump_votes"] / election_df["total_votes"]
 election_df["harris_share"] = election_df["harris_votes"] / election_df["total_votes"]
@@ -128,51 +126,21 @@ state_polls_validated.rename(columns={
     'caseid': 'num_respondents_validated'
 }, inplace=True)
 
-# Create a mapping from FIPS state codes to state names
-fips_to_state: Dict[int, str] = {
-    1: 'Alabama', 2: 'Alaska', 4: 'Arizona', 5: 'Arkansas', 6: 'California',
-    8: 'Colorado', 9: 'Connecticut', 10: 'Delaware', 11: 'District of Columbia',
-    12: 'Florida', 13: 'Georgia', 15: 'Hawaii', 16: 'Idaho', 17: 'Illinois',
-    18: 'Indiana', 19: 'Iowa', 20: 'Kansas', 21: 'Kentucky', 22: 'Louisiana',
-    23: 'Maine', 24: 'Maryland', 25: 'Massachusetts', 26: 'Michigan',
-    27: 'Minnesota', 28: 'Mississippi', 29: 'Missouri', 30: 'Montana',
-    31: 'Nebraska', 32: 'Nevada', 33: 'New Hampshire', 34: 'New Jersey',
-    35: 'New Mexico', 36: 'New York', 37: 'North Carolina', 38: 'North Dakota',
-    39: 'Ohio', 40: 'Oklahoma', 41: 'Oregon', 42: 'Pennsylvania',
-    44: 'Rhode Island', 45: 'South Carolina', 46: 'South Dakota',
-    47: 'Tennessee', 48: 'Texas', 49: 'Utah', 50: 'Vermont', 51: 'Virginia',
-    53: 'Washington', 54: 'West Virginia', 55: 'Wisconsin', 56: 'Wyoming'
-}
-
-# CONTINUE
-
-# Apply FIPS state code mapping to convert numeric codes to state names
-# Ensure inputstate is treated as int
+# Join the polls to the results on the integer state key of the state dimension (states.py)
 state_polls_all['inputstate'] = state_polls_all['inputstate'].astype(int)
 state_polls_likely['inputstate'] = state_polls_likely['inputstate'].astype(int)
 state_polls_validated['inputstate'] = state_polls_validated['inputstate'].astype(int)
 
-# Map FIPS codes to state names
-state_polls_all['state'] = state_polls_all['inputstate'].map(fips_to_state)
-state_polls_likely['state'] = state_polls_likely['inputstate'].map(fips_to_state)
-state_polls_validated['state'] = state_polls_validated['inputstate'].map(fips_to_state)
-
-# Normalize case for state names to ensure proper matching
-election_df['state'] = election_df['state'].str.title()
-state_polls_all['state'] = state_polls_all['state'].str.title()
-state_polls_likely['state'] = state_polls_likely['state'].str.title()
-state_polls_validated['state'] = state_polls_validated['state'].str.title()
+# Attach the classification (State, Pre-Election Classification) by state key
+election_keys = keys_from_names(election_df['state'])
+election_df = attach(election_df, election_keys, ['name', 'classification'],
+                     {'name': 'State', 'classification': 'Pre-Election Classification'})
 
-# Normalize case for state names
-classification_df['State'] = classification_df['State'].str.strip('"').str.title()
-
-# Merge election data with classification data
-election_df = election_df.merge(classification_df, left_on='state', right_on='State', how='left')
-
-# Now merge with poll data
-merged_all = election_df.merge(state_polls_all, on='state', how='inner')
-merged_likely = election_df.merge(state_polls_likely, on='state', how='inner')
-merged_validated = election_df.merge(state_polls_validated, on='state', how='inner')
+merged_all = inner_join(election_df, election_keys, state_polls_all, keys_from_fips(state_polls_all['inputstate']))
+merged_likely = inner_join(election_df, election_keys, state_polls_likely, keys_from_fips(state_polls_likely['inputstate']))
+merged_validated = inner_join(
+    election_df, election_keys, state_polls_validated, keys_from_fips(state_polls_validated['inputstate'])
+)
 
 # Save the merged DataFrames to CSV
 merged_all.to_csv("../data/merged_all_voters.csv", index=False)
@@ -7,7 +7,11 @@ import matplotlib.pyplot as plt
 from matplotlib.axes import Axes
 import numpy as np
 import os
-from typing import Dict, List, Optional, Union
+from typing import List
+
+from cces import encode_preferences, weighted_state_summary
+from data_defect import data_defect_metrics
+from states import attach, inner_join, keys_from_fips, keys_from_names
 
 # Set the current working directory to the script directory
 script_dir: str = os.path.dirname(os.path.abspath(__file__))
@@ -20,10 +24,6 @@ os.makedirs("../figures", exist_ok=True)
 election_results_path: str = "../data/2024_us_election_results_by_state.csv"
 election_df: pd.DataFrame = pd.read_csv(election_results_path)
 
-# Read state classification data
-classification_path: str = "../data/State-Pre-ElectionClassification.csv"
-classification_df: pd.DataFrame = pd.read_csv(classification_path)
-
 # Calculate the actual vote share for each candidate (including third parties)
 election_df["trump_share"] = election_df["trump_votes"] / election_df["total_votes"]
 election_df["harris_share"] = election_df["harris_votes"] / election_df["total_votes"]
@@ -39,42 +39,12 @@ likely_voter_codes: List[int] = [1, 2, 3, 4]
 poll_df['is_likely_voter'] = poll_df['CC24_363'].isin(likely_voter_codes)
 poll_df['is_validated_voter'] = (~poll_df['TS_g2024'].isna()) & (poll_df['TS_g2024'] < 7)
 
-def get_harris_preference(code: Optional[Union[int, float]]) -> Optional[float]:
-    if pd.isna(code):
-        return np.nan
-    if code == 1:
-        return 1.0
-    return 0.0
-
-def get_trump_preference(code: Optional[Union[int, float]]) -> Optional[float]:
-    if pd.isna(code):
-        return np.nan
-    if code == 2:
-        return 1.0
-    return 0.0
-
-poll_df['harris_preference'] = poll_df['CC24_364b'].apply(get_harris_preference)
-poll_df['trump_preference'] = poll_df['CC24_364b'].apply(get_trump_preference)
+poll_df = encode_preferences(poll_df)
 
 
 def weighted_state_agg(df: pd.DataFrame, weight_col: str) -> pd.DataFrame:
-    """Compute weighted mean of harris/trump preference per state."""
-    def agg_fn(group):
-        w = group[weight_col]
-        valid = w.notna() & (w > 0)
-        if valid.sum() == 0:
-            return pd.Series({
-                'harris_preference': np.nan,
-                'trump_preference': np.nan,
-                'caseid': len(group),
-            })
-        w = w[valid]
-        return pd.Series({
-            'harris_preference': np.average(group.loc[valid.index[valid], 'harris_preference'], weights=w),
-            'trump_preference': np.average(group.loc[valid.index[valid], 'trump_preference'], weights=w),
-            'caseid': len(group),
-        })
-    return df.groupby('inputstate').apply(agg_fn, include_groups=False).reset_index()
+    """Compute weighted mean of harris/trump preference per state, plus the Kish design effect."""
+    return weighted_state_summary(df, weight_col)
 
 
 # 1. All respondents — weighted by commonweight
@@ -93,59 +63,56 @@ state_polls_validated: pd.DataFrame = weighted_state_agg(validated_voters, 'vvwe
 state_polls_all.rename(columns={
     'harris_preference': 'harris_poll_all',
     'trump_preference': 'trump_poll_all',
-    'caseid': 'num_respondents_all'
+    'caseid': 'num_respondents_all',
+    'kish_deff': 'kish_deff_all',
+    'weight_effective_sample_size': 'weight_effective_sample_size_all'
 }, inplace=True)
 
 state_polls_likely.rename(columns={
     'harris_preference': 'harris_poll_likely',
     'trump_preference': 'trump_poll_likely',
-    'caseid': 'num_respondents_likely'
+    'caseid': 'num_respondents_likely',
+    'kish_deff': 'kish_deff_likely',
+    'weight_effective_sample_size': 'weight_effective_sample_size_likely'
 }, inplace=True)
 
 state_polls_validated.rename(columns={
     'harris_preference': 'harris_poll_validated',
     'trump_preference': 'trump_poll_validated',
-    'caseid': 'num_respondents_validated'
+    'caseid': 'num_respondents_validated',
+    'kish_deff': 'kish_deff_validated',
+    'weight_effective_sample_size': 'weight_effective_sample_size_validated'
 }, inplace=True)
 
-# Create a mapping from FIPS state codes to state names
-fips_to_state: Dict[int, str] = {
-    1: 'Alabama', 2: 'Alaska', 4: 'Arizona', 5: 'Arkansas', 6: 'California',
-    8: 'Colorado', 9: 'Connecticut', 10: 'Delaware', 11: 'District of Columbia',
-    12: 'Florida', 13: 'Georgia', 15: 'Hawaii', 16: 'Idaho', 17: 'Illinois',
-    18: 'Indiana', 19: 'Iowa', 20: 'Kansas', 21: 'Kentucky', 22: 'Louisiana',
-    23: 'Maine', 24: 'Maryland', 25: 'Massachusetts', 26: 'Michigan',
-    27: 'Minnesota', 28: 'Mississippi', 29: 'Missouri', 30: 'Montana',
-    31: 'Nebraska', 32: 'Nevada', 33: 'New Hampshire', 34: 'New Jersey',
-    35: 'New Mexico', 36: 'New York', 37: 'North Carolina', 38: 'North Dakota',
-    39: 'Ohio', 40: 'Oklahoma', 41: 'Oregon', 42: 'Pennsylvania',
-    44: 'Rhode Island', 45: 'South Carolina', 46: 'South Dakota',
-    47: 'Tennessee', 48: 'Texas', 49: 'Utah', 50: 'Vermont', 51: 'Virginia',
-    53: 'Washington', 54: 'West Virginia', 55: 'Wisconsin', 56: 'Wyoming'
-}
-
-# Apply FIPS state code mapping
+# Join the polls to the results on the integer state key of the state dimension (states.py)
 state_polls_all['inputstate'] = state_polls_all['inputstate'].astype(int)
 state_polls_likely['inputstate'] = state_polls_likely['inputstate'].astype(int)
 state_polls_validated['inputstate'] = state_polls_validated['inputstate'].astype(int)
 
-state_polls_all['state'] = state_polls_all['inputstate'].map(fips_to_state)
-state_polls_likely['state'] = state_polls_likely['inputstate'].map(fips_to_state)
-state_polls_validated['state'] = state_polls_validated['inputstate'].map(fips_to_state)
-
-# Normalize case
-election_df['state'] = election_df['state'].str.title()
-state_polls_all['state'] = state_polls_all['state'].str.title()
-state_polls_likely['state'] = state_polls_likely['state'].str.title()
-state_polls_validated['state'] = state_polls_validated['state'].str.title()
+# Attach the classification (State, Pre-Election Classification) by state key
+election_keys = keys_from_names(election_df['state'])
+election_df = attach(election_df, election_keys, ['name', 'classification'],
+                     {'name': 'State', 'classification': 'Pre-Election Classification'})
 
-classification_df['State'] = classification_df['State'].str.strip('"').str.title()
+merged_all = inner_join(election_df, election_keys, state_polls_all, keys_from_fips(state_polls_all['inputstate']))
+merged_likely = inner_join(election_df, election_keys, state_polls_likely, keys_from_fips(state_polls_likely['inputstate']))
+merged_validated = inner_join(
+    election_df, election_keys, state_polls_validated, keys_from_fips(state_polls_validated['inputstate'])
+)
 
-# Merge
-election_df = election_df.merge(classification_df, left_on='state', right_on='State', how='left')
-merged_all = election_df.merge(state_polls_all, on='state', how='inner')
-merged_likely = election_df.merge(state_polls_likely, on='state', how='inner')
-merged_validated = election_df.merge(state_polls_validated, on='state', how='inner')
+# Save the per-state design effect of the weights, used by effective_sample_size.py, with the effective
+# sample size of the weighted estimator itself (f / (1-f) / rho^2, rho of the weighted poll)
+design_effect = merged_all[['state']]
+for merged, population in [(merged_all, 'all'), (merged_likely, 'likely'), (merged_validated, 'validated')]:
+    columns = merged[['state', f'num_respondents_{population}', f'kish_deff_{population}',
+                      f'weight_effective_sample_size_{population}']].copy()
+    for candidate in ['trump', 'harris']:
+        columns[f'{candidate}_weighted_effective_sample_size_{population}'] = data_defect_metrics(
+            merged[f'{candidate}_poll_{population}'], merged[f'{candidate}_share'],
+            merged[f'num_respondents_{population}'], merged['total_votes'],
+        )['effective_sample_size']
+    design_effect = design_effect.merge(columns, on='state', how='outer')
+design_effect.to_csv("../data/design_effect.csv", index=False)
 
 # %%
 # Create 6 plots (2 rows x 3 columns)
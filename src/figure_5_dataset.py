@@ -15,52 +15,35 @@
 
 # the fourth quantity is the data_defect_correlation, which is error/(sigma_g * sqrt((1-f)/f))
 
+# all four come from one candidate_metrics call over (states x candidates) (candidates.py); the trump_* and
+# harris_* columns are read off its candidate axis
+
 import pandas as pd
-import numpy as np
+
+from candidates import candidate_columns, merged_metrics
 
 
 # Read the input data
 suffix = "validated"
-input_file = "data/merged_validated_voters.csv"
-output_file = "data/figure_5_validated.csv"
+estimator = ""  # "" for the direct state means from figure_4.py, "_mrp" for the MRP estimates from mrp.py
+input_file = f"data/merged_{suffix}_voters.csv"
+output_suffix = "" if suffix == "all" else f"_{suffix}"  # figure_5.csv for all respondents
+output_file = f"data/figure_5{output_suffix}{estimator}.csv"
 
 # Read the data
 df = pd.read_csv(input_file)
 
+# error = poll - actual share, sigma_g = sqrt(share * (1 - share)), f = num_respondents / total_votes,
+# data_defect_correlation = error / (sigma_g * sqrt((1-f)/f))
+metrics = merged_metrics(df, f"{{candidate}}_poll_{suffix}{estimator}", f"num_respondents_{suffix}{estimator}")
+
 # Create a new dataframe to store the results
-results = pd.DataFrame()
-results["state"] = df["state"]
-
-# Calculate the first quantity: trump_error and harris_error
-# error = poll - actual share
-results["trump_error"] = df[f"trump_poll_{suffix}"] - df["trump_share"]
-results["harris_error"] = df[f"harris_poll_{suffix}"] - df["harris_share"]
-
-# Calculate the second quantity: sigma_g (standard deviation of vote share)
-# For simplicity, we'll use the sample proportion as an estimate for sigma_g
-# sigma_g for binomial proportion = sqrt(p * (1-p))
-results["trump_sigma_g"] = np.sqrt(df["trump_share"] * (1 - df["trump_share"]))
-results["harris_sigma_g"] = np.sqrt(df["harris_share"] * (1 - df["harris_share"]))
-
-# Calculate the third quantity: sample_ratio (num_respondents_{all_or_likely} / total_votes)
-results["sample_ratio"] = df[f"num_respondents_{suffix}"] / df["total_votes"]
-
-# Calculate the fourth quantity: data_defect_correlation
-# error/(sigma_g * sqrt((1-f)/f)) where f is the sample_ratio
-# For Trump
-f_trump = results["sample_ratio"]
-results["trump_data_defect_correlation"] = results["trump_error"] / (
-    results["trump_sigma_g"] * np.sqrt((1 - f_trump) / f_trump)
-)
-
-# For Harris
-f_harris = results["sample_ratio"]
-results["harris_data_defect_correlation"] = results["harris_error"] / (
-    results["harris_sigma_g"] * np.sqrt((1 - f_harris) / f_harris)
-)
+results = pd.DataFrame({"state": df["state"], **candidate_columns(metrics, ["error", "sigma_g"])})
+results["sample_ratio"] = metrics["sample_ratio"][:, 0]
+results = results.assign(**candidate_columns(metrics, ["data_defect_correlation"]))
 
 # store the sample size
-results["sample_size"] = df[f"num_respondents_{suffix}"]
+results["sample_size"] = df[f"num_respondents_{suffix}{estimator}"]
 results["total_votes"] = df["total_votes"]
 
 # Save the output
@@ -0,0 +1,107 @@
+# the goal of this script is to compute the figure 5 quantities for every weighting of the poll at once
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv
+# input: ../data/merged_all_voters.csv (actual shares and total_votes per state)
+# output: ../data/figure_5_weights.csv
+
+# figure_5_dataset.py computes rho from the unweighted state means only.
+# here the poll is the weighted state mean under each weight column of the CCES file, plus the unweighted mean,
+# and for each we compute error, data defect correlation, Z_n, Z_n_N and effective sample size.
+
+# every per-state sum needed comes from one grouped reduction: the value matrix has, for each of the K weightings,
+# the columns w, w * harris, w * trump, so a single sparse product gives a (states x 3K) table.
+# respondents with a missing or non-positive weight get weight 0 under that weighting.
+
+# the output is a long table with one row per weight x state x candidate
+
+import os
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from cces import add_voter_flags, encode_preferences, group_index, grouped_sums, load_cces, population_masks
+from data_defect import data_defect_metrics
+
+WEIGHT_COLUMNS: List[str] = ["commonweight", "commonpostweight", "vvweight", "vvweight_post"]
+CANDIDATES: List[str] = ["harris", "trump"]
+population = "all"  # all, likely or validated
+
+
+def weight_matrix(poll_df: pd.DataFrame, weight_columns: List[str]) -> np.ndarray:
+    """(respondents x K) weights: a column of ones for the unweighted case, then each weight column."""
+    weights = poll_df[weight_columns].to_numpy(dtype=float)
+    weights = np.where(np.isfinite(weights) & (weights > 0), weights, 0.0)
+    return np.column_stack([np.ones(len(poll_df)), weights])
+
+
+def weighted_polls(state_index: np.ndarray, weights: np.ndarray, preferences: np.ndarray, n_states: int):
+    """
+    Weighted state means for every weighting and candidate, from one grouped reduction.
+
+    Args:
+        state_index: State index per respondent
+        weights: Array of shape (respondents, K)
+        preferences: Array of shape (respondents, C) of 0/1 preferences
+        n_states: Number of states
+
+    Returns:
+        (polls of shape (K, S, C), respondent counts of shape (S,))
+    """
+    n_weights = weights.shape[1]
+    values = np.concatenate(
+        [weights, (weights[:, :, None] * preferences[:, None, :]).reshape(len(weights), -1)], axis=1
+    )
+    sums = grouped_sums(state_index, values, n_states)
+    sum_w = sums[:, :n_weights]
+    sum_wp = sums[:, n_weights:].reshape(n_states, n_weights, -1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        polls = np.where(sum_w[:, :, None] > 0, sum_wp / sum_w[:, :, None], np.nan)
+    # the unweighted column is all ones, so its sum is the respondent count
+    return polls.transpose(1, 0, 2), sum_w[:, 0]
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    poll_df = load_cces(["inputstate", "CC24_364b", "CC24_363", "TS_g2024"] + WEIGHT_COLUMNS)
+    poll_df = encode_preferences(add_voter_flags(poll_df))
+    poll_df = poll_df[population_masks(poll_df)[population]].reset_index(drop=True)
+
+    states, state_index = group_index(poll_df["inputstate"].to_numpy())
+    weights = weight_matrix(poll_df, WEIGHT_COLUMNS)
+    preferences = poll_df[[f"{candidate}_preference" for candidate in CANDIDATES]].to_numpy(dtype=float)
+    polls, counts = weighted_polls(state_index, weights, preferences, len(states))
+
+    # actual results, aligned to the poll's states
+    merged = pd.read_csv("../data/merged_all_voters.csv").set_index("inputstate").reindex(states)
+    shares = merged[[f"{candidate}_share" for candidate in CANDIDATES]].to_numpy(dtype=float)
+    total_votes = merged["total_votes"].to_numpy(dtype=float)
+
+    # (K, S, C) for every metric
+    metrics = data_defect_metrics(polls, shares[None], counts[None, :, None], total_votes[None, :, None])
+
+    weight_names = ["unweighted"] + WEIGHT_COLUMNS
+    K, S, C = polls.shape
+    results = pd.DataFrame({
+        "weight": np.repeat(weight_names, S * C),
+        "state": np.tile(np.repeat(merged["state"].to_numpy(), C), K),
+        "candidate": np.tile(CANDIDATES, K * S),
+        "poll": polls.ravel(),
+        "share": np.broadcast_to(shares[None], polls.shape).ravel(),
+        "sample_size": np.broadcast_to(counts[None, :, None], polls.shape).ravel().astype(int),
+        "total_votes": np.broadcast_to(total_votes[None, :, None], polls.shape).ravel(),
+    })
+    for name in ["error", "data_defect_correlation", "Z_n", "Z_n_N", "effective_sample_size"]:
+        results[name] = metrics[name].ravel()
+    results = results.dropna(subset=["state"])
+
+    output_file = "../data/figure_5_weights.csv"
+    results.to_csv(output_file, index=False)
+    print(results.groupby(["weight", "candidate"])["data_defect_correlation"].mean().unstack())
+    print(f"Saved weighted figure 5 data to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
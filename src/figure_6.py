@@ -1,6 +1,6 @@
 # the goal of this file is to plot two plots
 # input: ../data/figure_6.csv
-# input: ../data/State-Pre-ElectionClassification.csv
+# input: ../data/State-Pre-ElectionClassification.csv (through states.py)
 
 # you, the AI assistant, should read the input files to understand the columns and the data types
 
@@ -18,6 +18,10 @@ import matplotlib.pyplot as plt
 from sklearn.linear_model import LinearRegression
 import os
 
+from regression_diagnostics import influence_diagnostics
+from robust_slopes import fit_lines
+from states import attach, keys_from_names
+
 # Set the current working directory to the script directory
 script_dir: str = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_dir)
@@ -25,11 +29,25 @@ os.chdir(script_dir)
 # Read the data files
 suffix = "_validated"
 # suffix = ""
+# suffix = "_county"  # one point per county, from county_dataset.py
 figure_data = pd.read_csv(f'../data/figure_6{suffix}.csv')
-classification = pd.read_csv('../data/State-Pre-ElectionClassification.csv')
 
-# Merge the datasets
-data = pd.merge(figure_data, classification, how='left', left_on='state', right_on='State')
+# Optionally draw a robust fit as a second, dashed line: None, "theil_sen" or "quantile"
+robust_fit = None
+
+# Optionally add the bootstrap percentile interval from figure_6_inference.py to the slope box
+show_bootstrap_ci = False
+if show_bootstrap_ci:
+    population = suffix.lstrip('_') or 'all'
+    inference = pd.read_csv('../data/figure_6_inference.csv')
+    inference = inference[inference['population'] == population].set_index('candidate')
+
+# Optionally label this many states with the largest Cook's distance on each panel (0 for none)
+annotate_influential = 0
+
+# Attach the classification and abbreviation by state key
+data = attach(figure_data, keys_from_names(figure_data['state']), ['classification', 'abbr'],
+              {'classification': 'Pre-Election Classification', 'abbr': 'state_abbr'})
 
 # Create a color map for the states based on classification
 color_map = {
@@ -72,6 +90,19 @@ def create_plot(ax, x, y, colors, candidate_name):
     x_line = np.array([min(x_clean), max(x_clean)])
     y_line = reg.predict(x_line.reshape(-1, 1))
     ax.plot(x_line, y_line, 'gray', linewidth=2)
+
+    # Plot robust regression line
+    if robust_fit is not None:
+        robust_slope, robust_intercept = fit_lines(x_clean.ravel(), y_clean.ravel()[None, :], robust_fit)
+        ax.plot(x_line.ravel(), robust_intercept[0] + robust_slope[0] * x_line.ravel(), 'k--', linewidth=1)
+
+    # Label the most influential states
+    if annotate_influential:
+        cooks_distance = influence_diagnostics(x_clean.ravel(), y_clean.ravel()[None, :])['cooks_distance'][0]
+        labels = data['state_abbr'][mask].values
+        for i in np.argsort(cooks_distance)[::-1][:annotate_influential]:
+            ax.annotate(labels[i], (x_clean[i, 0], y_clean[i, 0]),
+                        xytext=(4, 4), textcoords='offset points', fontsize=9)
     
     # Format slope and standard error to 2 significant figures
     # Format to exactly 2 sig figs
@@ -93,6 +124,10 @@ def create_plot(ax, x, y, colors, candidate_name):
         return formatted
     
     slope_text = f"{format_to_2sig(slope)}\n({format_to_2sig(se)})"
+    if show_bootstrap_ci:
+        ci_low = inference.loc[candidate_name.lower(), 'bootstrap_ci_low']
+        ci_high = inference.loc[candidate_name.lower(), 'bootstrap_ci_high']
+        slope_text += f"\n[{format_to_2sig(ci_low)}, {format_to_2sig(ci_high)}]"
     
     # Add textbox with slope and standard error
     props = dict(boxstyle='round', facecolor='white', alpha=0.7)
@@ -1,16 +1,20 @@
 #!/usr/bin/env python3
 import pandas as pd
-import numpy as np
 import os
 
+from candidates import candidate_columns, merged_metrics
+
 # Set the current working directory to the script directory
 script_dir: str = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_dir)
 
 # Read the input file
+# the metrics come from one candidate_metrics call over (states x candidates) on the merged table that
+# figure_5_dataset.py reads (candidates.py), with the same sample_size and total_votes
 suffix = "_validated"
 # suffix = ""
-input_file = f"../data/figure_5{suffix}.csv"
+population = suffix.lstrip("_") or "all"
+input_file = f"../data/merged_{population}_voters.csv"
 print(f"Reading input file: {input_file}")
 df = pd.read_csv(input_file)
 
@@ -22,18 +26,15 @@ print(df.head())
 
 # Compute the metrics as per instructions
 print("\nComputing required metrics...")
-
-# Step 1: Compute s_g_sq = N/(N-1)*sigma_g**2 where N is the total_votes
-df['trump_s_g_sq'] = df['total_votes'] / (df['total_votes'] - 1) * df['trump_sigma_g']**2
-df['harris_s_g_sq'] = df['total_votes'] / (df['total_votes'] - 1) * df['harris_sigma_g']**2
-
-# Step 2: Compute var_srs = (1-f)/n * s_g_sq where f is sample_ratio and n is sample_size
-df['trump_var_srs'] = (1 - df['sample_ratio']) / df['sample_size'] * df['trump_s_g_sq']
-df['harris_var_srs'] = (1 - df['sample_ratio']) / df['sample_size'] * df['harris_s_g_sq']
-
-# Step 3: Compute Z_n_N = data_defect_correlation/sqrt(var_srs)
-df['trump_Z_n_N'] = df['trump_error'] / np.sqrt(df['trump_var_srs'])
-df['harris_Z_n_N'] = df['harris_error'] / np.sqrt(df['harris_var_srs'])
+metrics = merged_metrics(df, f"{{candidate}}_poll_{population}", f"num_respondents_{population}")
+df["sample_ratio"] = metrics["sample_ratio"][:, 0]
+df["sample_size"] = df[f"num_respondents_{population}"]
+
+# sigma_g and error as in figure_5_dataset.py
+# Step 1: s_g_sq = N/(N-1)*sigma_g**2 where N is the total_votes
+# Step 2: var_srs = (1-f)/n * s_g_sq where f is sample_ratio and n is sample_size
+# Step 3: Z_n_N = error/sqrt(var_srs)
+df = df.assign(**candidate_columns(metrics, ["sigma_g", "error", "s_g_sq", "var_srs", "Z_n_N"]))
 
 # Step 4: Include total_votes as column (already included in original dataset)
 
@@ -0,0 +1,139 @@
+# resampling inference for the figure 6 slope
+# input: ../data/figure_6.csv, ../data/figure_6_likely.csv, ../data/figure_6_validated.csv
+# output: ../data/figure_6_inference.csv
+
+# figure_6.py fits log10|Z_n,N| = a + b log10(total_votes) and reports the textbook OLS SE of b.
+# with 50 heteroskedastic states that SE is shaky, so for every candidate x population series we also run
+# 1. a permutation test: shuffle y against x, p-value = share of |b*| >= |b|
+# 2. a pairs bootstrap: resample states with replacement, percentile interval of b*
+# each chunk of resamples is one batched matrix computation (resamples x states),
+# and chunks are spread over a process pool
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+POPULATIONS = {"all": "", "likely": "_likely", "validated": "_validated"}
+CANDIDATES = ["harris", "trump"]
+
+N_PERMUTATIONS = 20000
+N_BOOTSTRAP = 20000
+CHUNK_SIZE = 2500
+SEED = 2024
+
+
+def batched_slopes(X: np.ndarray, Y: np.ndarray) -> np.ndarray:
+    """
+    OLS slope of each row of Y on the matching row of X.
+
+    Args:
+        X: Array of shape (B, n), or (n,) to share one x across all rows
+        Y: Array of shape (B, n)
+
+    Returns:
+        Array of B slopes
+    """
+    X = np.broadcast_to(X, Y.shape)
+    xc = X - X.mean(axis=1, keepdims=True)
+    yc = Y - Y.mean(axis=1, keepdims=True)
+    return np.einsum("bn,bn->b", xc, yc) / np.einsum("bn,bn->b", xc, xc)
+
+
+def ols_slope_se(x: np.ndarray, y: np.ndarray) -> Tuple[float, float]:
+    """Slope and textbook standard error, as computed in figure_6.py."""
+    slope = batched_slopes(x, y[None, :])[0]
+    intercept = y.mean() - slope * x.mean()
+    residuals = y - intercept - slope * x
+    se = np.sqrt(np.sum(residuals ** 2) / (len(x) - 2) / np.sum((x - x.mean()) ** 2))
+    return slope, se
+
+
+def _resample_chunk(args: Tuple[np.ndarray, np.ndarray, str, int, np.random.SeedSequence]) -> np.ndarray:
+    """Slopes for one chunk of permutations or bootstrap resamples."""
+    x, y, kind, size, seed = args
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    if kind == "permutation":
+        idx = np.argsort(rng.random((size, n)), axis=1)
+        return batched_slopes(x, y[idx])
+    idx = rng.integers(0, n, size=(size, n))
+    slopes = batched_slopes(x[idx], y[idx])
+    # a resample that drew a single distinct x has no slope
+    return slopes[np.isfinite(slopes)]
+
+
+def resample_slopes(
+    x: np.ndarray, y: np.ndarray, kind: str, n_resamples: int, seed: np.random.SeedSequence,
+    executor: ProcessPoolExecutor,
+) -> np.ndarray:
+    """Run n_resamples permutations or bootstrap resamples in chunks over the pool."""
+    sizes = [CHUNK_SIZE] * (n_resamples // CHUNK_SIZE)
+    if n_resamples % CHUNK_SIZE:
+        sizes.append(n_resamples % CHUNK_SIZE)
+    seeds = seed.spawn(len(sizes))
+    tasks = [(x, y, kind, size, s) for size, s in zip(sizes, seeds)]
+    return np.concatenate(list(executor.map(_resample_chunk, tasks)))
+
+
+def load_series() -> List[Tuple[str, str, np.ndarray, np.ndarray]]:
+    """Load (population, candidate, log10 N, log10 |Z_n,N|) for every series."""
+    series = []
+    for population, suffix in POPULATIONS.items():
+        df = pd.read_csv(f"../data/figure_6{suffix}.csv")
+        x = np.log10(df["total_votes"].to_numpy(dtype=float))
+        for candidate in CANDIDATES:
+            y = np.log10(np.abs(df[f"{candidate}_Z_n_N"].to_numpy(dtype=float)))
+            mask = np.isfinite(x) & np.isfinite(y)
+            series.append((population, candidate, x[mask], y[mask]))
+    return series
+
+
+def slope_inference(
+    n_permutations: int = N_PERMUTATIONS, n_bootstrap: int = N_BOOTSTRAP, seed: int = SEED
+) -> pd.DataFrame:
+    """
+    Permutation p-values and bootstrap percentile intervals for every figure 6 slope.
+
+    Returns:
+        DataFrame with one row per population x candidate
+    """
+    series = load_series()
+    seeds = np.random.SeedSequence(seed).spawn(2 * len(series))
+    rows = []
+    with ProcessPoolExecutor() as executor:
+        for k, (population, candidate, x, y) in enumerate(series):
+            slope, se = ols_slope_se(x, y)
+            perm = resample_slopes(x, y, "permutation", n_permutations, seeds[2 * k], executor)
+            boot = resample_slopes(x, y, "bootstrap", n_bootstrap, seeds[2 * k + 1], executor)
+            rows.append({
+                "population": population,
+                "candidate": candidate,
+                "n_states": len(x),
+                "slope": slope,
+                "ols_se": se,
+                "permutation_p": (1 + np.sum(np.abs(perm) >= np.abs(slope))) / (1 + len(perm)),
+                "bootstrap_se": boot.std(ddof=1),
+                "bootstrap_ci_low": np.percentile(boot, 2.5),
+                "bootstrap_ci_high": np.percentile(boot, 97.5),
+            })
+    return pd.DataFrame(rows)
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    results = slope_inference()
+    print(results.to_string(index=False))
+
+    output_file = "../data/figure_6_inference.csv"
+    results.to_csv(output_file, index=False)
+    print(f"\nSaved slope inference to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 # the goal of this file is to compute a metric and plot it in two figures
 # input: ../data/merged_all_voters.csv
 # input: ../data/State-Pre-ElectionClassification.csv
-# input: ../data/state_abbr.csv
+# input: state abbreviations from states.py
 
 # you, the AI assistant, should read the input files to understand the columns and the data types
 
@@ -19,13 +19,15 @@
 # shade the y-axis range -2 to 2 in gray
 
 import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 import math
 import os
 from matplotlib.ticker import FixedLocator
 from adjustText import adjust_text  # Import the adjust_text method
 
+from candidates import candidate_columns, merged_metrics
+from states import attach, keys_from_fips
+
 # Set the current working directory to the script directory
 script_dir: str = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_dir)
@@ -38,9 +40,11 @@ all_or_likely = "likely"
 suffix = "_likely"
 # suffix = "_validated"
 
+estimator = ""  # "" for the direct state means from figure_4.py, "_mrp" for the MRP estimates from mrp.py
+
 # Customize
 # total_votes_or_sample_size = "total_votes"
-total_votes_or_sample_size = f"num_respondents{suffix}"
+total_votes_or_sample_size = f"num_respondents{suffix}{estimator}"
 
 
 def plot_z_scores(data, candidate, ax):
@@ -141,28 +145,16 @@ def plot_z_scores(data, candidate, ax):
 def main():
     # Read the input files
     merged_data = pd.read_csv(f"../data/merged_{all_or_likely}_voters.csv")
-    state_abbr = pd.read_csv("../data/state_abbr.csv")
-
-    # Merge state abbreviations with the main data
-    merged_data = pd.merge(merged_data, state_abbr, left_on="state", right_on="state")
-
-    # Compute Z_n for Harris
-    merged_data["harris_Z_n"] = (
-        merged_data[f"harris_poll_{all_or_likely}"] - merged_data["harris_share"]
-    ) / np.sqrt(
-        merged_data[f"harris_poll_{all_or_likely}"]
-        * (1 - merged_data[f"harris_poll_{all_or_likely}"])
-        / merged_data[f"num_respondents_{all_or_likely}"]
-    )
 
-    # Compute Z_n for Trump
-    merged_data["trump_Z_n"] = (
-        merged_data[f"trump_poll_{all_or_likely}"] - merged_data["trump_share"]
-    ) / np.sqrt(
-        merged_data[f"trump_poll_{all_or_likely}"]
-        * (1 - merged_data[f"trump_poll_{all_or_likely}"])
-        / merged_data[f"num_respondents_{all_or_likely}"]
+    # Attach state abbreviations by state key
+    state_keys = keys_from_fips(merged_data["inputstate"])
+    merged_data = attach(merged_data[state_keys >= 0], state_keys[state_keys >= 0], ["abbr"], {"abbr": "state_abbr"})
+
+    # Compute Z_n for Harris and Trump on the candidate axis
+    metrics = merged_metrics(
+        merged_data, f"{{candidate}}_poll_{all_or_likely}{estimator}", f"num_respondents_{all_or_likely}{estimator}"
     )
+    merged_data = merged_data.assign(**candidate_columns(metrics, ["Z_n"]))
 
     # Define color mapping for state classification
     color_map = {"Blue": "blue", "Likely Blue": "blue", "Red": "red", "Swing": "green"}
@@ -178,14 +170,14 @@ def main():
         "harris_Z_n",
         "trump_Z_n",
         "total_votes",
-        f"harris_poll_{all_or_likely}",
+        f"harris_poll_{all_or_likely}{estimator}",
         "harris_share",
-        f"trump_poll_{all_or_likely}",
+        f"trump_poll_{all_or_likely}{estimator}",
         "trump_share",
-        f"num_respondents_{all_or_likely}",
+        f"num_respondents_{all_or_likely}{estimator}",
         "Pre-Election Classification",
     ]
-    merged_data[output_columns].to_csv(f"../data/figure_7{suffix}.csv", index=False)
+    merged_data[output_columns].to_csv(f"../data/figure_7{suffix}{estimator}.csv", index=False)
 
     # Create figure and subplots side by side
     fig, axes = plt.subplots(1, 2, figsize=(8, 3))
@@ -197,7 +189,7 @@ def main():
     plot_z_scores(merged_data, "trump", axes[1])
 
     plt.tight_layout()
-    plt.savefig(f"../figures/figure_7{suffix}.png", dpi=300)
+    plt.savefig(f"../figures/figure_7{suffix}{estimator}.png", dpi=300)
 
 
 if __name__ == "__main__":
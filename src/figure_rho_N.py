@@ -1,6 +1,6 @@
 # the goal of this file is to plot two figures
 # input: ../data/figure_5.csv
-# input: ../data/State-Pre-ElectionClassification.csv
+# input: ../data/State-Pre-ElectionClassification.csv (through states.py)
 
 # you, the AI assistant, should read the input files to understand the columns and the data types
 
@@ -18,24 +18,24 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 
+from robust_slopes import fit_lines
+from states import attach, keys_from_names
+
 # Set the current working directory to the script directory
 script_dir: str = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_dir)
 
+# Optionally draw a robust fit line on each subplot: None, "theil_sen" or "quantile"
+robust_fit = None
+
 def load_data():
     """Load and prepare the data."""
     # Read input data
     figure_5_data = pd.read_csv('../data/figure_5_likely.csv')
-    state_classification = pd.read_csv('../data/State-Pre-ElectionClassification.csv')
-
-    # Merge the datasets
-    merged_data = pd.merge(
-        figure_5_data, 
-        state_classification, 
-        how='left', 
-        left_on='state', 
-        right_on='State'
-    )
+
+    # Attach the classification by state key
+    merged_data = attach(figure_5_data, keys_from_names(figure_5_data['state']), ['classification'],
+                         {'classification': 'Pre-Election Classification'})
 
     # Define color mapping for state classifications
     color_map = {
@@ -67,6 +67,14 @@ def create_subplot(ax, data, x_transform, candidate, x_label):
             alpha=0.7
         )
         ax.annotate(row['state'], (x_value, y_value), fontsize=8)
+
+    # Robust fit, so a few extreme states do not drive the line
+    if robust_fit is not None:
+        x_values = x_transform(data['total_votes']).to_numpy(dtype=float)
+        y_values = data[correlation_column].to_numpy(dtype=float)
+        slope, intercept = fit_lines(x_values, y_values[None, :], robust_fit)
+        x_line = np.array([x_values.min(), x_values.max()])
+        ax.plot(x_line, intercept[0] + slope[0] * x_line, 'k--', linewidth=1)
     
     ax.set_xlabel(x_label, fontsize=14)
     ax.set_ylabel('Data Defect Correlation', fontsize=14)
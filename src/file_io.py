@@ -0,0 +1,19 @@
+# file helpers shared by the fetcher and the data stores (fetch_ap_results.py, snapshots.py, live_tracker.py,
+# cycles.py), kept apart from the fetcher so the offline modules do not import requests / asyncio
+
+import os
+import tempfile
+
+
+def atomic_write(path: str, content: bytes) -> None:
+    """Write content to path through a temporary file in the same folder and os.replace."""
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,231 @@
+# multiple imputation of CC24_364b item non-response
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv
+# input: ../data/merged_all_voters.csv (actual shares and total_votes per state)
+# output: ../data/imputation.csv
+
+# figure_4.py drops respondents with a missing CC24_364b and keeps "not sure" as a non-Harris, non-Trump answer.
+# here both are treated as item non-response and imputed M times from a per-state model:
+# within each state x covariate cell, the answer (Harris, Trump, Other, Won't vote) is categorical with
+# a Dirichlet prior centred on the state's observed answer shares (prior_strength pseudo-respondents).
+# every draw takes a fresh set of cell probabilities from the posterior, then an answer for every
+# missing respondent, so the draws carry the model uncertainty (proper imputation).
+# respondents who already voted (CC24_363 = 3) are asked CC24_364a instead of CC24_364b, so only those with a
+# CC24_364b answer are kept; "Won't vote" is never imputed for them, and cells without any observed answer
+# (imputed from the state prior alone) are reported.
+
+# each draw is aggregated to state poll shares for the all/likely/validated populations with one bincount
+# on the integer code (draw, population, state, answer); chunks of draws run in a process pool.
+# the M estimates are combined with Rubin's rules:
+#   Q = mean_m Q_m, U = mean_m U_m, B = var_m Q_m, T = U + (1 + 1/M) B
+# with U_m = p(1-p)/n for a poll share, and the same rule for rho with U_m scaled by the rho identity.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cces import add_voter_flags, group_index, load_cces
+from data_defect import data_defect_metrics
+
+OBSERVED_CODES: List[int] = [1, 2, 3, 4]  # Harris, Trump, Other, Won't vote
+IMPUTED_CODES: List[int] = [5]  # Not sure; NaN is always imputed
+COVARIATES: List[str] = ["pid3", "CC24_363"]
+POPULATIONS: List[str] = ["all", "likely", "validated"]
+CANDIDATES: Dict[str, int] = {"harris": 0, "trump": 1}  # index into OBSERVED_CODES
+WONT_VOTE = 3  # index into OBSERVED_CODES
+ALREADY_VOTED_CODE = 3  # CC24_363, routed to CC24_364a
+
+N_IMPUTATIONS = 50
+CHUNK_SIZE = 10
+PRIOR_STRENGTH = 2.0
+SEED = 2024
+
+
+def encode_answers(poll_df: pd.DataFrame) -> np.ndarray:
+    """Answer index into OBSERVED_CODES, -1 for respondents to impute."""
+    code = poll_df["CC24_364b"].to_numpy(dtype=float)
+    answers = np.full(len(code), -1, dtype=np.int64)
+    for k, observed in enumerate(OBSERVED_CODES):
+        answers[code == observed] = k
+    return answers
+
+
+def encode_cells(poll_df: pd.DataFrame, state_index: np.ndarray) -> Tuple[np.ndarray, int]:
+    """Integer state x covariate cell per respondent; a missing covariate is a level of its own."""
+    cells = state_index.astype(np.int64)
+    for column in COVARIATES:
+        codes, levels = pd.factorize(poll_df[column], sort=True)
+        codes = np.where(codes < 0, len(levels), codes)
+        cells = cells * (len(levels) + 1) + codes
+    # compact to the cells that occur
+    _, cells = np.unique(cells, return_inverse=True)
+    return cells, int(cells.max()) + 1
+
+
+def posterior_parameters(
+    answers: np.ndarray, cells: np.ndarray, n_cells: int, cell_state: np.ndarray, n_states: int,
+    cell_already_voted: np.ndarray,
+) -> np.ndarray:
+    """Dirichlet posterior parameters per cell, shape (n_cells, K); zero for Won't vote in already-voted cells."""
+    K = len(OBSERVED_CODES)
+    observed = answers >= 0
+    cell_counts = np.bincount(cells[observed] * K + answers[observed], minlength=n_cells * K).reshape(n_cells, K)
+    state_counts = np.zeros((n_states, K))
+    np.add.at(state_counts, cell_state, cell_counts)
+    state_shares = (state_counts + 1) / (state_counts + 1).sum(axis=1, keepdims=True)
+    alpha = cell_counts + PRIOR_STRENGTH * state_shares[cell_state]
+    alpha[cell_already_voted, WONT_VOTE] = 0
+    return alpha
+
+
+def _impute_chunk(args) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Impute a chunk of draws and aggregate each to state counts.
+
+    Returns:
+        (answer counts of shape (draws, populations, states, K), respondent counts (populations, states))
+    """
+    answers, cells, alpha, state_index, population_index, n_states, size, seed = args
+    rng = np.random.default_rng(seed)
+    K = alpha.shape[1]
+    n_populations = len(population_index)
+    missing = np.flatnonzero(answers < 0)
+
+    # cell probabilities for every draw, then an answer for every missing respondent by inverse CDF
+    theta = rng.gamma(alpha[None], size=(size,) + alpha.shape)
+    theta /= theta.sum(axis=2, keepdims=True)
+    cdf = np.cumsum(theta[:, cells[missing]], axis=2)
+    u = rng.random((size, len(missing), 1))
+    imputed = np.minimum((u > cdf).sum(axis=2), K - 1)
+
+    completed = np.broadcast_to(answers, (size, len(answers))).copy()
+    completed[:, missing] = imputed
+
+    # one bincount over (draw, population, state, answer) for respondents in each population
+    draw_ids = np.arange(size)[:, None]
+    counts = np.zeros((size, n_populations, n_states, K))
+    for p in range(n_populations):
+        rows = population_index[p]
+        key = (draw_ids * n_states + state_index[rows]) * K + completed[:, rows]
+        counts[:, p] = np.bincount(key.ravel(), minlength=size * n_states * K).reshape(size, n_states, K)
+    return counts, counts[0].sum(axis=2)
+
+
+def rubin(estimates: np.ndarray, variances: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Combine M estimates (axis 0) and their within-imputation variances with Rubin's rules.
+
+    Returns:
+        Dict with estimate, within, between, total variance and fraction of missing information
+    """
+    M = estimates.shape[0]
+    estimate = estimates.mean(axis=0)
+    within = variances.mean(axis=0)
+    between = estimates.var(axis=0, ddof=1)
+    total = within + (1 + 1 / M) * between
+    with np.errstate(divide="ignore", invalid="ignore"):
+        missing_information = (1 + 1 / M) * between / total
+    return {"estimate": estimate, "within": within, "between": between, "total": total,
+            "missing_information": missing_information}
+
+
+def impute(poll_df: pd.DataFrame, n_imputations: int = N_IMPUTATIONS, seed: int = SEED):
+    """
+    Draw n_imputations completed datasets and aggregate each to state answer counts.
+
+    Returns:
+        (states, answer counts (M, populations, states, K), respondent counts (populations, states))
+    """
+    states, state_index = group_index(poll_df["inputstate"].to_numpy())
+    n_states = len(states)
+    answers = encode_answers(poll_df)
+    cells, n_cells = encode_cells(poll_df, state_index)
+    cell_state = np.zeros(n_cells, dtype=np.int64)
+    cell_state[cells] = state_index
+    cell_already_voted = np.zeros(n_cells, dtype=bool)
+    cell_already_voted[cells] = poll_df["CC24_363"].to_numpy() == ALREADY_VOTED_CODE
+    alpha = posterior_parameters(answers, cells, n_cells, cell_state, n_states, cell_already_voted)
+
+    # cells with respondents to impute but no observed answer fall back to the state prior
+    observed_per_cell = np.bincount(cells[answers >= 0], minlength=n_cells)
+    missing_per_cell = np.bincount(cells[answers < 0], minlength=n_cells)
+    prior_only = (observed_per_cell == 0) & (missing_per_cell > 0)
+    print(f"{prior_only.sum()} cells ({missing_per_cell[prior_only].sum()} respondents) have no observed answer "
+          f"and are imputed from the state prior")
+
+    masks = {
+        "all": np.ones(len(poll_df), dtype=bool),
+        "likely": poll_df["is_likely_voter"].to_numpy(),
+        "validated": poll_df["is_validated_voter"].to_numpy(),
+    }
+    population_index = [np.flatnonzero(masks[population]) for population in POPULATIONS]
+
+    sizes = [CHUNK_SIZE] * (n_imputations // CHUNK_SIZE)
+    if n_imputations % CHUNK_SIZE:
+        sizes.append(n_imputations % CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(answers, cells, alpha, state_index, population_index, n_states, size, s) for size, s in zip(sizes, seeds)]
+    with ProcessPoolExecutor() as executor:
+        chunks = list(executor.map(_impute_chunk, tasks))
+    counts = np.concatenate([c for c, _ in chunks])
+    return states, counts, chunks[0][1]
+
+
+def combine(states: np.ndarray, counts: np.ndarray, n: np.ndarray, merged: pd.DataFrame) -> pd.DataFrame:
+    """Rubin-combined poll shares and rho per population x state x candidate."""
+    merged = merged.set_index("inputstate").reindex(states)
+    total_votes = merged["total_votes"].to_numpy(dtype=float)
+    rows = []
+    for p, population in enumerate(POPULATIONS):
+        for candidate, k in CANDIDATES.items():
+            polls = counts[:, p, :, k] / n[p]
+            share = merged[f"{candidate}_share"].to_numpy(dtype=float)
+            metrics = data_defect_metrics(polls, share, n[p], total_votes)
+            poll_var = polls * (1 - polls) / n[p]
+            # rho = error / (sigma_g sqrt((1-f)/f)), so its variance is the poll variance over that scale squared
+            scale_sq = metrics["sigma_g"] ** 2 * (1 - metrics["sample_ratio"]) / metrics["sample_ratio"]
+            poll = rubin(polls, poll_var)
+            rho = rubin(metrics["data_defect_correlation"], poll_var / scale_sq)
+            rows.append(pd.DataFrame({
+                "population": population,
+                "state": merged["state"].to_numpy(),
+                "candidate": candidate,
+                "sample_size": n[p].astype(int),
+                "poll": poll["estimate"],
+                "poll_se": np.sqrt(poll["total"]),
+                "poll_between_variance": poll["between"],
+                "missing_information": poll["missing_information"],
+                "data_defect_correlation": rho["estimate"],
+                "data_defect_correlation_se": np.sqrt(rho["total"]),
+            }))
+    return pd.concat(rows, ignore_index=True).dropna(subset=["state"])
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    poll_df = load_cces(list(dict.fromkeys(["inputstate", "CC24_364b", "CC24_363", "TS_g2024"] + COVARIATES)))
+    poll_df = add_voter_flags(poll_df)
+    # respondents who already voted answer CC24_364a, so a missing CC24_364b is not item non-response for them
+    not_routed = (poll_df["CC24_363"] == ALREADY_VOTED_CODE) & poll_df["CC24_364b"].isna()
+    print(f"Dropping {not_routed.sum()} already-voted respondents not asked CC24_364b")
+    poll_df = poll_df[~not_routed].reset_index(drop=True)
+    # "not sure" answers are imputed along with the missing ones
+    poll_df.loc[poll_df["CC24_364b"].isin(IMPUTED_CODES), "CC24_364b"] = np.nan
+    print(f"Imputing {poll_df['CC24_364b'].isna().sum()} of {len(poll_df)} answers, {N_IMPUTATIONS} times")
+
+    states, counts, n = impute(poll_df)
+    results = combine(states, counts, n, pd.read_csv("../data/merged_all_voters.csv"))
+
+    output_file = "../data/imputation.csv"
+    results.to_csv(output_file, index=False)
+    print(results.groupby(["population", "candidate"])[["data_defect_correlation", "missing_information"]].mean())
+    print(f"Saved imputation results to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# election-night mode: rho and Z_n recomputed as the AP count comes in
+# input: state_json_files/{XX}.json (e.g. kept current by fetch_ap_results.py)
+# input: ../data/merged_{all,likely,validated}_voters.csv (poll columns)
+# output: ../data/live/merged_{population}_voters.csv, ../data/live/history.csv
+
+# the poll side (CCES shares and respondent counts) does not change on election night, only the count does.
+# the tracker loads the merged tables of figure_4.py once, then polls the folder's file sizes and modification
+# times every poll_seconds. Only the files that changed are re-read (just their summary, through
+# extract_ap_results.read_summary), and only those states' rows of the merged tables are updated: votes,
+# shares, eevp, precinctsReportingPct, rho (figure_5_dataset.py), Z_n (figure_7.py) and Z_n,N (figure_6_dataset.py).
+# after each update the live tables are written atomically and one row per state x population x candidate is
+# appended to the history, so the data defect picture can be followed over the night.
+
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_defect import data_defect_metrics
+from extract_ap_results import HARRIS_ID, STATE_NAMES, TRUMP_ID, read_summary
+from file_io import atomic_write
+
+CANDIDATES = {"harris": HARRIS_ID, "trump": TRUMP_ID}
+POPULATIONS = ["all", "likely", "validated"]
+
+watch_folder = "state_json_files"
+output_folder = "../data/live"
+poll_seconds = 5.0
+
+
+def scan(folder: str) -> Dict[str, Tuple[int, int]]:
+    """Size and modification time of every {XX}.json in folder."""
+    files = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".json") and not entry.name.startswith("."):
+                stat = entry.stat()
+                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def changed_files(previous: Dict[str, Tuple[int, int]], current: Dict[str, Tuple[int, int]]) -> List[str]:
+    """Paths that are new or whose size or modification time differs from the previous scan."""
+    return sorted(path for path, signature in current.items() if previous.get(path) != signature)
+
+
+def live_row(path: str) -> Dict[str, object]:
+    """Count and progress of one state from its summary."""
+    summary = read_summary(path)
+    votes = {candidate["candidateID"]: candidate["voteCount"] for candidate in summary.get("candidates", [])}
+    row = {
+        "state": STATE_NAMES.get(os.path.basename(path).split(".")[0]),
+        "total_votes": summary["parameters"]["vote"]["total"],
+        "eevp": summary.get("eevp", np.nan),
+        "precincts_reporting_pct": summary.get("precinctsReportingPct", np.nan),
+        "last_updated": summary.get("lastUpdated"),
+    }
+    for candidate, candidate_id in CANDIDATES.items():
+        row[f"{candidate}_votes"] = votes.get(candidate_id, 0)
+    return row
+
+
+def load_tables(populations: List[str] = POPULATIONS) -> Dict[str, pd.DataFrame]:
+    """Poll columns of the merged tables, indexed by state, with empty count columns."""
+    tables = {}
+    for population in populations:
+        poll_columns = [f"{c}_poll_{population}" for c in CANDIDATES] + [f"num_respondents_{population}"]
+        merged = pd.read_csv(f"../data/merged_{population}_voters.csv")
+        table = merged[["state", "inputstate", "Pre-Election Classification"] + poll_columns].set_index("state")
+        for column in ["total_votes", "eevp", "precincts_reporting_pct"] + [f"{c}_votes" for c in CANDIDATES]:
+            table[column] = np.nan
+        table["last_updated"] = None
+        tables[population] = table
+    return tables
+
+
+def update_tables(tables: Dict[str, pd.DataFrame], rows: List[Dict[str, object]]) -> None:
+    """Write the changed states' counts into every table and recompute their metrics in place."""
+    update = pd.DataFrame(rows).set_index("state")
+    for population, table in tables.items():
+        states = update.index.intersection(table.index)
+        for column in update.columns:
+            table.loc[states, column] = update.loc[states, column]
+        total_votes = table.loc[states, "total_votes"].to_numpy(dtype=float)
+        n = table.loc[states, f"num_respondents_{population}"].to_numpy(dtype=float)
+        for candidate in CANDIDATES:
+            share = table.loc[states, f"{candidate}_votes"].to_numpy(dtype=float) / total_votes
+            poll = table.loc[states, f"{candidate}_poll_{population}"].to_numpy(dtype=float)
+            metrics = data_defect_metrics(poll, share, n, total_votes)
+            table.loc[states, f"{candidate}_share"] = share
+            table.loc[states, f"{candidate}_data_defect_correlation"] = metrics["data_defect_correlation"]
+            table.loc[states, f"{candidate}_Z_n"] = metrics["Z_n"]
+            table.loc[states, f"{candidate}_Z_n_N"] = metrics["Z_n_N"]
+
+
+def history_rows(tables: Dict[str, pd.DataFrame], states: List[str], seen_at: pd.Timestamp) -> pd.DataFrame:
+    """One row per updated state x population x candidate."""
+    rows = []
+    for population, table in tables.items():
+        for candidate in CANDIDATES:
+            part = table.loc[states, ["eevp", "total_votes", f"{candidate}_share", f"{candidate}_data_defect_correlation",
+                                      f"{candidate}_Z_n", f"{candidate}_Z_n_N"]]
+            part.columns = ["eevp", "total_votes", "share", "data_defect_correlation", "Z_n", "Z_n_N"]
+            rows.append(part.reset_index().assign(seen_at=seen_at, population=population, candidate=candidate))
+    columns = ["seen_at", "state", "population", "candidate", "eevp", "total_votes", "share",
+               "data_defect_correlation", "Z_n", "Z_n_N"]
+    return pd.concat(rows, ignore_index=True)[columns]
+
+
+def watch(
+    folder: str,
+    tables: Dict[str, pd.DataFrame],
+    on_update: Callable[[List[str]], None],
+    interval: float = poll_seconds,
+    max_scans: Optional[int] = None,
+) -> None:
+    """
+    Poll folder and update the tables for every batch of changed files.
+
+    Args:
+        folder: Folder of AP detail files
+        tables: From load_tables, updated in place
+        on_update: Called with the updated state names after each update
+        interval: Seconds between scans
+        max_scans: Stop after this many scans (None runs until interrupted)
+    """
+    previous: Dict[str, Tuple[int, int]] = {}
+    scans = 0
+    while max_scans is None or scans < max_scans:
+        if scans:
+            time.sleep(interval)
+        scans += 1
+        current = scan(folder)
+        paths = changed_files(previous, current)
+        previous = current
+        if not paths:
+            continue
+        rows = []
+        for path in paths:
+            try:
+                rows.append(live_row(path))
+            except (ValueError, KeyError):
+                # caught mid-write by a non-atomic writer; retried on the next scan
+                previous.pop(path, None)
+        if rows:
+            update_tables(tables, rows)
+            on_update([row["state"] for row in rows if row["state"] is not None])
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    os.makedirs(output_folder, exist_ok=True)
+    history_path = os.path.join(output_folder, "history.csv")
+    tables = load_tables()
+
+    def on_update(states: List[str]) -> None:
+        seen_at = pd.Timestamp.now(tz="UTC")
+        for population, table in tables.items():
+            path = os.path.join(output_folder, f"merged_{population}_voters.csv")
+            atomic_write(path, table.reset_index().to_csv(index=False).encode())
+        history = history_rows(tables, states, seen_at)
+        history.to_csv(history_path, mode="a", header=not os.path.exists(history_path), index=False)
+
+        table = tables["all"]
+        weights = table["total_votes"].fillna(0).to_numpy()
+        summary = ", ".join(
+            f"{candidate} rho {np.nansum(weights * table[f'{candidate}_data_defect_correlation']) / weights.sum():.4f}"
+            for candidate in CANDIDATES
+        )
+        print(f"{seen_at:%H:%M:%S} updated {len(states)} states; "
+              f"mean eevp {table['eevp'].mean():.1f}; vote-weighted {summary}")
+
+    print(f"Watching {watch_folder} every {poll_seconds:g}s (Ctrl-C to stop)")
+    try:
+        watch(watch_folder, tables, on_update)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# leave-one-state-out (LOSO) evaluation of the bias correction
+# input: ../data/merged_{population}_voters.csv
+# Turnout data: ../data/Turnout_2016G_v1.0.csv
+# VEP data: ../data/Turnout_2024G_v0.3.csv
+# output: ../data/loso_prediction.csv
+
+# bias_correction.py corrects every state with one rho that was itself estimated using that state's result.
+# here, for each held-out state s, rho is estimated from the other states only, and the held-out poll is corrected
+#     poll_corrected_s = poll_s - rho_(-s) * sqrt((1-f_s)/f_s) * sigma_s
+# with f and sigma from correction_cache.py (f uses estimated_votes, as in bias_correction.py).
+
+# the per-state rho is the in-sample data defect correlation (figure_5_dataset.py, f = n / total_votes).
+# all folds come from leave-one-out sums rather than re-runs:
+#     mean:          (sum(rho) - rho_s) / (S - 1)
+#     weighted mean: (sum(w rho) - w_s rho_s) / (sum(w) - w_s), with w = total_votes
+#     median:        a gather from the sorted rho, skipping the held-out position
+# so the whole evaluation is a few array operations and can be nested in bootstrap or rho sweeps.
+
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from correction_cache import correction_terms, load_inputs
+from data_defect import data_defect_metrics
+
+POPULATIONS = ["all", "likely", "validated"]
+CANDIDATES = ["harris", "trump"]
+METHODS = ["mean", "weighted_mean", "median"]
+
+
+def loso_rho(rho: np.ndarray, method: str = "mean", weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Leave-one-out estimate of rho for every state, along the last axis.
+
+    Args:
+        rho: Array of shape (..., S)
+        method: "mean", "weighted_mean" or "median"
+        weights: Array broadcastable to rho, for "weighted_mean"
+
+    Returns:
+        Array of the same shape; entry s is estimated without state s
+    """
+    rho = np.asarray(rho, dtype=float)
+    S = rho.shape[-1]
+    if method == "mean":
+        return (rho.sum(axis=-1, keepdims=True) - rho) / (S - 1)
+    if method == "weighted_mean":
+        w = np.broadcast_to(np.asarray(weights, dtype=float), rho.shape)
+        return ((w * rho).sum(axis=-1, keepdims=True) - w * rho) / (w.sum(axis=-1, keepdims=True) - w)
+    if method == "median":
+        order = np.argsort(rho, axis=-1)
+        sorted_rho = np.take_along_axis(rho, order, axis=-1)
+        position = np.argsort(order, axis=-1)  # sorted position of each state
+
+        def kth_without(k: int) -> np.ndarray:
+            # k-th smallest of the other S-1 values: skip the held-out state's sorted position
+            index = np.where(k < position, k, k + 1)
+            return np.take_along_axis(sorted_rho, index, axis=-1)
+
+        if (S - 1) % 2:
+            return kth_without((S - 2) // 2)
+        return (kth_without((S - 1) // 2 - 1) + kth_without((S - 1) // 2)) / 2
+    raise ValueError(f"Unknown leave-one-out method: {method}")
+
+
+def rmse(prediction: np.ndarray, actual: np.ndarray) -> np.ndarray:
+    """Root mean squared error along the last axis."""
+    return np.sqrt(np.mean((prediction - actual) ** 2, axis=-1))
+
+
+def evaluate(population: str = "all") -> Dict[str, pd.DataFrame]:
+    """
+    Out-of-sample corrected polls for one population, for every candidate and method.
+
+    Returns:
+        Dict with "states" (one row per state x candidate x method) and "rmse" (one row per candidate x method)
+    """
+    df = load_inputs(population)
+    n = df[f"num_respondents_{population}"].to_numpy(dtype=float)
+    total_votes = df["total_votes"].to_numpy(dtype=float)
+
+    states, summary = [], []
+    for candidate in CANDIDATES:
+        poll = df[f"{candidate}_poll_{population}"].to_numpy(dtype=float)
+        share = df[f"{candidate}_share"].to_numpy(dtype=float)
+        rho = data_defect_metrics(poll, share, n, total_votes)["data_defect_correlation"]
+        scale = correction_terms(n, df["estimated_votes"].to_numpy(dtype=float), poll)["scale"]
+
+        # in-sample reference: one pooled rho for every state, as bias_correction.py does
+        in_sample = poll - rho.mean() * scale
+        summary.append({"population": population, "candidate": candidate, "method": "uncorrected",
+                        "rmse": rmse(poll, share)})
+        summary.append({"population": population, "candidate": candidate, "method": "in_sample_mean",
+                        "rmse": rmse(in_sample, share)})
+
+        for method in METHODS:
+            held_out_rho = loso_rho(rho, method, total_votes)
+            corrected = poll - held_out_rho * scale
+            summary.append({"population": population, "candidate": candidate, "method": f"loso_{method}",
+                            "rmse": rmse(corrected, share)})
+            states.append(pd.DataFrame({
+                "population": population,
+                "state": df["state"],
+                "candidate": candidate,
+                "method": method,
+                "poll": poll,
+                "share": share,
+                "rho": rho,
+                "loso_rho": held_out_rho,
+                "poll_corrected": corrected,
+                "error_corrected": corrected - share,
+            }))
+    return {"states": pd.concat(states, ignore_index=True), "rmse": pd.DataFrame(summary)}
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    results = [evaluate(population) for population in POPULATIONS]
+    summary = pd.concat([r["rmse"] for r in results], ignore_index=True)
+    print(summary.pivot_table(index=["population", "candidate"], columns="method", values="rmse").to_string())
+
+    output_file = "../data/loso_prediction.csv"
+    pd.concat([r["states"] for r in results], ignore_index=True).to_csv(output_file, index=False)
+    print(f"\nSaved leave-one-state-out predictions to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
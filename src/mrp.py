@@ -0,0 +1,156 @@
+# multilevel regression and poststratification (MRP) estimate of the state polls
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv
+# input/output: ../data/merged_all_voters.csv, ../data/merged_likely_voters.csv, ../data/merged_validated_voters.csv
+# run after figure_4.py, which rewrites the merged files
+
+# the figure_4 family uses direct state means, which are noisy for small states (Wyoming, Vermont, ...).
+# here, for each population and candidate, a logistic model of the preference is fitted on
+#     intercept + state + gender + age group + education + race (one-hot, L2-penalized)
+# and the fitted cell probabilities are poststratified to each state's cell composition.
+# the L2 penalty plays the role of the random-effect variances of a multilevel model: sparse states and
+# cells are pulled toward the overall intercept, large ones are left to their data.
+
+# respondents are first collapsed to unique cells (successes, trials), the design matrix is a scipy.sparse one-hot
+# matrix over those cells, and the penalized likelihood is minimized with L-BFGS using its analytic gradient.
+
+# the poststratification frame is the CCES itself: cell sizes are the sum of commonweight (vvweight for
+# validated voters) within each state, so the frame matches the weighted survey composition of each state.
+
+# the merged files get harris_poll_{population}_mrp, trump_poll_{population}_mrp and num_respondents_{population}_mrp,
+# so figure_5_dataset.py and figure_7.py can select them with estimator = "_mrp"
+
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.optimize import minimize
+from scipy.special import expit
+
+from cces import add_voter_flags, encode_preferences, load_cces, population_masks
+
+DEMOGRAPHICS: List[str] = ["gender4", "age_group", "educ", "race"]
+AGE_BINS = [18, 30, 45, 65, 200]
+POPULATION_WEIGHTS: Dict[str, str] = {"all": "commonweight", "likely": "commonweight", "validated": "vvweight"}
+CANDIDATES: List[str] = ["harris", "trump"]
+PENALTY = 2.0
+
+
+def cell_codes(poll_df: pd.DataFrame) -> pd.DataFrame:
+    """Integer codes for state and every demographic, a missing value being a level of its own."""
+    codes = pd.DataFrame(index=poll_df.index)
+    for column in ["inputstate"] + DEMOGRAPHICS:
+        values, levels = pd.factorize(poll_df[column], sort=True)
+        codes[column] = np.where(values < 0, len(levels), values)
+    return codes
+
+
+def one_hot_design(cells: pd.DataFrame) -> sp.csr_matrix:
+    """Sparse design matrix: an intercept column, then one block of indicator columns per variable."""
+    blocks = [sp.csr_matrix(np.ones((len(cells), 1)))]
+    for column in cells.columns:
+        codes = cells[column].to_numpy()
+        blocks.append(sp.csr_matrix(
+            (np.ones(len(codes)), (np.arange(len(codes)), codes)), shape=(len(codes), int(codes.max()) + 1)
+        ))
+    return sp.hstack(blocks, format="csr")
+
+
+def fit_logistic(X: sp.csr_matrix, successes: np.ndarray, trials: np.ndarray, penalty: float = PENALTY) -> np.ndarray:
+    """
+    L2-penalized binomial logistic regression on collapsed cells.
+
+    Args:
+        X: Sparse design matrix, first column the (unpenalized) intercept
+        successes: Number of respondents preferring the candidate per cell
+        trials: Number of respondents per cell
+        penalty: L2 penalty on every coefficient but the intercept
+
+    Returns:
+        Coefficients
+    """
+    XT = X.T.tocsr()
+    mask = np.ones(X.shape[1])
+    mask[0] = 0.0
+
+    def objective(beta: np.ndarray) -> Tuple[float, np.ndarray]:
+        eta = X @ beta
+        # sum of trials * log(1 + e^eta) - successes * eta, computed stably
+        loss = np.sum(trials * np.logaddexp(0, eta) - successes * eta) + 0.5 * penalty * np.sum(mask * beta ** 2)
+        gradient = XT @ (trials * expit(eta) - successes) + penalty * mask * beta
+        return loss, gradient
+
+    beta0 = np.zeros(X.shape[1])
+    overall = successes.sum() / trials.sum()
+    beta0[0] = np.log(overall / (1 - overall))
+    return minimize(objective, beta0, jac=True, method="L-BFGS-B").x
+
+
+def mrp_state_estimates(poll_df: pd.DataFrame, population: str) -> pd.DataFrame:
+    """
+    MRP poll shares per state for one population.
+
+    Returns:
+        DataFrame with inputstate, harris_poll, trump_poll and num_respondents
+    """
+    mask = population_masks(poll_df)[population]
+    df = poll_df[mask]
+    codes = cell_codes(df)
+
+    # collapse respondents to unique cells, with trials, successes and the poststratification weight
+    weight = df[POPULATION_WEIGHTS[population]].fillna(0).to_numpy(dtype=float)
+    cells, cell_index = np.unique(codes.to_numpy(), axis=0, return_inverse=True)
+    cell_index = cell_index.ravel()
+    n_cells = len(cells)
+    trials = np.bincount(cell_index, minlength=n_cells).astype(float)
+    frame = np.bincount(cell_index, weights=weight, minlength=n_cells)
+    X = one_hot_design(pd.DataFrame(cells, columns=codes.columns))
+
+    state_codes = cells[:, 0]
+    n_states = int(state_codes.max()) + 1
+    state_frame = np.bincount(state_codes, weights=frame, minlength=n_states)
+    state_keys = np.unique(df["inputstate"].to_numpy())
+
+    result = pd.DataFrame({
+        "inputstate": state_keys,
+        "num_respondents": np.bincount(state_codes, weights=trials, minlength=n_states)[: len(state_keys)].astype(int),
+    })
+    for candidate in CANDIDATES:
+        successes = np.bincount(cell_index, weights=df[f"{candidate}_preference"].to_numpy(dtype=float), minlength=n_cells)
+        beta = fit_logistic(X, successes, trials)
+        probabilities = expit(X @ beta)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            poll = np.bincount(state_codes, weights=frame * probabilities, minlength=n_states) / state_frame
+        result[f"{candidate}_poll"] = poll[: len(state_keys)]
+    return result
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    columns = ["inputstate", "CC24_364b", "CC24_363", "TS_g2024", "commonweight", "vvweight",
+               "gender4", "birthyr", "educ", "race"]
+    poll_df = encode_preferences(add_voter_flags(load_cces(columns)))
+    poll_df["age_group"] = pd.cut(2024 - poll_df["birthyr"], AGE_BINS, right=False, labels=False)
+
+    for population in POPULATION_WEIGHTS:
+        estimates = mrp_state_estimates(poll_df, population)
+        estimates = estimates.rename(columns={
+            "harris_poll": f"harris_poll_{population}_mrp",
+            "trump_poll": f"trump_poll_{population}_mrp",
+            "num_respondents": f"num_respondents_{population}_mrp",
+        })
+
+        merged_path = f"../data/merged_{population}_voters.csv"
+        merged = pd.read_csv(merged_path)
+        merged = merged.drop(columns=[c for c in estimates.columns if c != "inputstate" and c in merged.columns])
+        merged = merged.merge(estimates, on="inputstate", how="left")
+        merged.to_csv(merged_path, index=False)
+        print(f"Added MRP estimates to {merged_path}")
+
+
+if __name__ == "__main__":
+    main()
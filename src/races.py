@@ -0,0 +1,234 @@
+# race-agnostic version of the data defect pipeline: president, Senate, governor and House races in one pass
+# input: state_json_files/{XX}.json (president), race_json_files/{race_id}.json (other races)
+# input: ../data/races.csv (optional registry of the down-ballot races, see below)
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv
+# output: ../data/race_metrics.csv (or _likely / _validated)
+
+# a race is identified by AP's race ID, {yyyymmdd}{state}{race number} (20241105KS0 is the Kansas presidential
+# race). The registry has one row per race x option:
+#   race_id, office (P, S, G or H), state, district (0 for statewide races), option, cces_item, cces_code,
+#   ap_candidate_ids
+# cces_item is the CCES vote choice item of the race (optional in races.csv, default OFFICE_ITEMS[office]; a
+# special election, e.g. Nebraska's 2024 Senate special, has its own item), cces_code the answer code of the
+# option in that item, ap_candidate_ids the AP candidate IDs the option stands for, "|"-separated, or "*" for
+# every AP candidate of the race not listed under another option.
+# a respondent is matched to the race of each item by (state, district), so two races may not share an item
+# in the same state and district.
+# the presidential rows are built here (Harris, Trump, other); the down-ballot rows come from ../data/races.csv,
+# since matching the CCES candidate codes (SenCand1Name, ...) to AP candidate IDs is race-specific.
+
+# all races are computed together as arrays over races: the actual shares are a (races x options) matrix
+# filled with one np.add.at over the registry, the poll shares come from one grouped reduction over
+# (respondent, race) pairs stacked across offices, and the metrics from one data_defect_metrics call.
+# each race is measured against its own electorate (N = the race's total votes).
+
+import asyncio
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cces import add_voter_flags, grouped_sums, load_cces
+from data_defect import data_defect_metrics
+from extract_ap_results import HARRIS_ID, TRUMP_ID, candidate_votes
+from fetch_ap_results import ELECTION_DATE, fetch_all, get_race_url
+from states import keys_from_abbr, keys_from_fips, state_abbreviations
+
+REGISTRY_COLUMNS = ["race_id", "office", "state", "district", "option", "cces_item", "cces_code", "ap_candidate_ids"]
+# CCES pre-election vote choice item per office; check against the CES 2024 codebook before use
+OFFICE_ITEMS: Dict[str, str] = {"P": "CC24_364b", "S": "CC24_365", "G": "CC24_366", "H": "CC24_367"}
+DISTRICT_COLUMN = "cdid119"  # respondent's congressional district, for House races
+
+registry_file = "../data/races.csv"
+race_folder = "race_json_files"
+presidential_folder = "state_json_files"
+fetch_races = False  # fetch the down-ballot races of the registry into race_folder first
+population = "all"  # all, likely or validated
+
+
+def presidential_registry(states: List[str] = state_abbreviations(), date: str = ELECTION_DATE) -> pd.DataFrame:
+    """Registry rows of the presidential race in every state."""
+    compressed_date = date.replace("-", "")
+    options = [("harris", 1, HARRIS_ID), ("trump", 2, TRUMP_ID), ("other", 3, "*")]
+    return pd.DataFrame([
+        (f"{compressed_date}{state}0", "P", state, 0, option, OFFICE_ITEMS["P"], code, ids)
+        for state in states for option, code, ids in options
+    ], columns=REGISTRY_COLUMNS)
+
+
+def load_registry(path: str = registry_file) -> pd.DataFrame:
+    """Presidential rows plus the rows in path, if it exists (cces_item defaults to the office's item)."""
+    registry = presidential_registry()
+    if os.path.exists(path):
+        races = pd.read_csv(path, dtype={"ap_candidate_ids": str})
+        default_items = races["office"].map(OFFICE_ITEMS)
+        races["cces_item"] = races["cces_item"].fillna(default_items) if "cces_item" in races else default_items
+        registry = pd.concat([registry, races[REGISTRY_COLUMNS]])
+    return registry.reset_index(drop=True)
+
+
+def race_path(race_id: str) -> str:
+    """Where a race's detail.json is saved."""
+    if race_id.endswith("0") and len(race_id) == 11:
+        return os.path.join(presidential_folder, f"{race_id[8:10]}.json")
+    return os.path.join(race_folder, f"{race_id}.json")
+
+
+def race_shares(
+    registry: pd.DataFrame, race_ids: np.ndarray, candidate_ids: np.ndarray, votes: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Actual vote counts of every option of every race.
+
+    Args:
+        registry: Rows for the races in race_ids
+        race_ids: Races, one per row of votes
+        candidate_ids: Columns of votes
+        votes: (races x AP candidates) vote counts
+
+    Returns:
+        (race index per registry row, option index per registry row, option votes of shape (races x options))
+    """
+    race_index = pd.Index(race_ids).get_indexer(registry["race_id"])
+    option_index = registry.groupby("race_id").cumcount().to_numpy()
+    option_votes = np.zeros((len(race_ids), option_index.max() + 1))
+
+    # one (registry row, AP candidate) pair per listed candidate
+    ids = registry["ap_candidate_ids"].astype(str)
+    listed = ids.str.split("|").explode()
+    listed = listed[listed != "*"]
+    rows = listed.index.to_numpy()
+    columns = np.searchsorted(candidate_ids, listed.astype(np.int64).to_numpy())
+    found = columns < len(candidate_ids)
+    found[found] = candidate_ids[columns[found]] == listed.astype(np.int64).to_numpy()[found]
+    rows, columns = rows[found], columns[found]
+    np.add.at(option_votes, (race_index[rows], option_index[rows]), votes[race_index[rows], columns])
+
+    # "*" options take every AP candidate not listed under another option of the race
+    remainder = np.flatnonzero((ids == "*").to_numpy())
+    unlisted = votes.sum(axis=1) - option_votes.sum(axis=1)
+    np.add.at(option_votes, (race_index[remainder], option_index[remainder]), unlisted[race_index[remainder]])
+    return race_index, option_index, option_votes
+
+
+def race_polls(
+    poll_df: pd.DataFrame, registry: pd.DataFrame, race_ids: np.ndarray, race_index: np.ndarray,
+    option_index: np.ndarray, n_options: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Respondent counts and poll shares of every option of every race, in one grouped reduction.
+
+    Every respondent is paired with the race of each CCES item in their state (and district, for House races)
+    and their answer to that item; answers not listed for the race count as "none of the options".
+
+    Returns:
+        (n of shape (races,), polls of shape (races x options))
+    """
+    races = registry.drop_duplicates("race_id").set_index("race_id").loc[race_ids]
+    race_state = keys_from_abbr(races["state"])
+    respondent_state = keys_from_fips(poll_df["inputstate"])
+
+    # option per (race, answer code)
+    codes = registry["cces_code"].to_numpy(dtype=int)
+    code_table = np.full((len(race_ids), codes.max() + 1), -1)
+    code_table[race_index, codes] = option_index
+
+    pair_race, pair_option = [], []
+    for item in races["cces_item"].unique():
+        item_races = np.flatnonzero(races["cces_item"].to_numpy() == item)
+        if item not in poll_df:
+            continue
+        by_district = (races["office"].to_numpy()[item_races] == "H").any()
+        district = poll_df[DISTRICT_COLUMN].to_numpy(dtype=float) if by_district else np.zeros(len(poll_df))
+        # race of every respondent for this item, by (state key, district)
+        race_key = pd.Index(race_state[item_races] * 1000 + races["district"].to_numpy()[item_races])
+        if not race_key.is_unique:
+            shared = races.index[item_races][race_key.duplicated(keep=False)]
+            raise ValueError(
+                f"Races {', '.join(shared)} share the CCES item {item} in the same state and district; "
+                f"give each its own cces_item in {registry_file}"
+            )
+        respondent_key = respondent_state * 1000 + np.nan_to_num(district, nan=-1).astype(int)
+        race = race_key.get_indexer(respondent_key)
+        answer = poll_df[item].to_numpy(dtype=float)
+        keep = (race >= 0) & (respondent_state >= 0) & np.isfinite(answer)
+        race = item_races[race[keep]]
+        answer = answer[keep].astype(int)
+        in_table = answer < code_table.shape[1]
+        option = np.full(len(answer), -1)
+        option[in_table] = code_table[race[in_table], answer[in_table]]
+        pair_race.append(race)
+        pair_option.append(option)
+
+    pair_race = np.concatenate(pair_race) if pair_race else np.zeros(0, dtype=int)
+    pair_option = np.concatenate(pair_option) if pair_option else np.zeros(0, dtype=int)
+    one_hot = pair_option[:, None] == np.arange(n_options)[None, :]
+    sums = grouped_sums(pair_race, np.column_stack([np.ones(len(pair_race)), one_hot]), len(race_ids))
+    n = sums[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return n, sums[:, 1:] / n[:, None]
+
+
+def race_metrics(registry: pd.DataFrame, poll_df: pd.DataFrame) -> pd.DataFrame:
+    """Poll, share, error, rho, Z_n,N and Z_n for every race x option with a results file."""
+    race_ids = registry["race_id"].drop_duplicates().to_numpy()
+    race_ids = np.array([race_id for race_id in race_ids if os.path.exists(race_path(race_id))])
+    if len(race_ids) == 0:
+        raise FileNotFoundError(
+            f"No race of the registry has a results file in {presidential_folder} or {race_folder}; "
+            "fetch them first (fetch_ap_results.py, or fetch_races = True)"
+        )
+    registry = registry[registry["race_id"].isin(race_ids)].reset_index(drop=True)
+
+    candidate_ids, votes, total_votes = candidate_votes([race_path(race_id) for race_id in race_ids])
+    race_index, option_index, option_votes = race_shares(registry, race_ids, candidate_ids, votes)
+    n_options = option_votes.shape[1]
+    n, polls = race_polls(poll_df, registry, race_ids, race_index, option_index, n_options)
+
+    total_votes = total_votes.astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = option_votes / total_votes[:, None]
+    metrics = data_defect_metrics(polls, shares, n[:, None], total_votes[:, None])
+
+    result = registry[["race_id", "office", "state", "district", "option"]].copy()
+    result["sample_size"] = n[race_index]
+    result["total_votes"] = total_votes[race_index]
+    result["poll"] = polls[race_index, option_index]
+    result["share"] = shares[race_index, option_index]
+    for name in ["error", "sigma_g", "sample_ratio", "data_defect_correlation", "Z_n_N", "Z_n"]:
+        result[name] = np.broadcast_to(metrics[name], shares.shape)[race_index, option_index]
+    return result
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    registry = load_registry()
+    print(f"{registry['race_id'].nunique()} races in the registry")
+
+    if fetch_races:
+        down_ballot = registry.loc[registry["office"] != "P", "race_id"].drop_duplicates()
+        statuses = asyncio.run(fetch_all([], race_folder, urls={race_id: get_race_url(race_id) for race_id in down_ballot}))
+        print(f"Fetched {sum(status != 'unchanged' and not status.startswith('failed') for status in statuses.values())} races")
+
+    columns = ["inputstate", DISTRICT_COLUMN, "CC24_363", "TS_g2024"] + list(registry["cces_item"].unique())
+    poll_df = add_voter_flags(load_cces(columns))
+    masks = {
+        "all": np.ones(len(poll_df), dtype=bool),
+        "likely": poll_df["is_likely_voter"].to_numpy(),
+        "validated": poll_df["is_validated_voter"].to_numpy(),
+    }
+    poll_df = poll_df[masks[population]].reset_index(drop=True)
+
+    result = race_metrics(registry, poll_df)
+    suffix = "" if population == "all" else f"_{population}"
+    output_file = f"../data/race_metrics{suffix}.csv"
+    result.to_csv(output_file, index=False)
+    print(f"Saved {result['race_id'].nunique()} races to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
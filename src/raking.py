@@ -0,0 +1,188 @@
+# raking (iterative proportional fitting) of survey weights within each state
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv
+# input: ../data/merged_all_voters.csv
+# Turnout data: ../data/Turnout_2024G_v0.3.csv
+# output: ../data/raking.csv
+
+# the only weights in the CCES file are the precomputed commonweight and vvweight.
+# this engine calibrates our own weights to our own targets, to see whether reweighting shrinks rho.
+
+# respondents are compact arrays: a state index and one integer code per margin (-1 = missing).
+# targets are per state x level totals. Every raking step adjusts all states at once:
+#     totals = bincount(state * L + code, weights=w), w *= (target / totals)[state * L + code]
+# after each sweep weights are trimmed to [trim_low, trim_high] times the state's mean weight.
+
+# the demo calibrates, within each state, to
+# 1. the 2024 VEP (state total)
+# 2. turnout: likely voter vs not, split by the 2024 VEP turnout rate
+# 3. gender, age group, education and race, using the commonweight-weighted shares as stand-in targets
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cces import add_voter_flags, encode_preferences, grouped_sums, group_index, load_cces
+from data_defect import data_defect_metrics
+from states import gather, keys_from_fips
+
+AGE_BINS = [18, 30, 45, 65, 200]
+
+
+def rake(
+    state_index: np.ndarray,
+    margins: List[np.ndarray],
+    targets: List[np.ndarray],
+    base_weights: Optional[np.ndarray] = None,
+    max_iter: int = 100,
+    tol: float = 1e-6,
+    trim_low: float = 0.2,
+    trim_high: float = 5.0,
+) -> Tuple[np.ndarray, Dict[str, float]]:
+    """
+    Calibrate weights within each state so weighted totals match every margin's targets.
+
+    Args:
+        state_index: State index per respondent, in 0..S-1
+        margins: One integer code array per margin, codes in 0..L_m-1, -1 for missing
+        targets: One (S, L_m) array of target totals per margin; for a margin with missing codes
+            the targets cover only the respondents with a code. Cells with a zero or non-finite target
+            (e.g. NaN for a state without targets) are not adjusted, so their respondents keep their weights
+        base_weights: Starting weights, ones if None
+        max_iter: Maximum number of sweeps over all margins
+        tol: Stop when every weighted margin total is within tol (relative) of its target
+        trim_low: Lower weight bound, relative to the state mean weight
+        trim_high: Upper weight bound, relative to the state mean weight
+
+    Returns:
+        (weights, info) where info has "iterations" and "max_relative_error"
+    """
+    n_states = int(state_index.max()) + 1
+    w = np.ones(len(state_index)) if base_weights is None else np.asarray(base_weights, dtype=float).copy()
+    state_count = np.bincount(state_index, minlength=n_states)
+
+    # flat cell index per margin, and a mask of respondents with a code
+    cells = []
+    for codes, target in zip(margins, targets):
+        n_levels = target.shape[1]
+        present = codes >= 0
+        cells.append((np.where(present, state_index * n_levels + codes, 0), present, np.asarray(target, dtype=float).ravel()))
+
+    max_error = np.inf
+    iteration = 0
+    for iteration in range(1, max_iter + 1):
+        for cell, present, target in cells:
+            totals = np.bincount(cell, weights=np.where(present, w, 0.0), minlength=len(target))
+            # empty cells, and cells without a usable target, cannot be matched; leave those respondents untouched
+            ratio = np.divide(target, totals, out=np.ones_like(target), where=(totals > 0) & (target > 0))
+            w = np.where(present, w * ratio[cell], w)
+
+        # trim relative to the state mean weight
+        mean_w = np.bincount(state_index, weights=w, minlength=n_states) / np.maximum(state_count, 1)
+        w = np.clip(w, trim_low * mean_w[state_index], trim_high * mean_w[state_index])
+
+        max_error = 0.0
+        for cell, present, target in cells:
+            totals = np.bincount(cell, weights=np.where(present, w, 0.0), minlength=len(target))
+            matchable = (target > 0) & (totals > 0)
+            if np.any(matchable):
+                max_error = max(max_error, np.max(np.abs(totals[matchable] / target[matchable] - 1)))
+        if max_error < tol:
+            break
+
+    return w, {"iterations": iteration, "max_relative_error": max_error}
+
+
+def weighted_level_shares(state_index: np.ndarray, codes: np.ndarray, weights: np.ndarray, n_states: int, n_levels: int) -> np.ndarray:
+    """Weighted share of each level within each state, ignoring missing codes."""
+    present = (codes >= 0) & ~np.isnan(weights)
+    totals = np.bincount(
+        state_index[present] * n_levels + codes[present], weights=weights[present], minlength=n_states * n_levels
+    ).reshape(n_states, n_levels)
+    return totals / np.maximum(totals.sum(axis=1, keepdims=True), 1e-300)
+
+
+def integer_codes(values: pd.Series) -> Tuple[np.ndarray, int]:
+    """Code a categorical column as 0..L-1, -1 for missing; returns (codes, L)."""
+    codes, levels = pd.factorize(values, sort=True)
+    return codes.astype(np.int64), len(levels)
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    columns = ["inputstate", "CC24_364b", "CC24_363", "TS_g2024", "commonweight",
+               "gender4", "birthyr", "educ", "race"]
+    poll_df = load_cces(columns)
+    poll_df = encode_preferences(add_voter_flags(poll_df))
+    poll_df = poll_df[poll_df["CC24_364b"].notna()].reset_index(drop=True)
+
+    states, state_index = group_index(poll_df["inputstate"].to_numpy())
+    n_states = len(states)
+
+    merged = pd.read_csv("../data/merged_all_voters.csv").set_index("inputstate").reindex(states)
+
+    # state totals and turnout rates from the 2024 turnout file, gathered by state key
+    state_keys = keys_from_fips(states)
+    vep = gather("VEP_2024", state_keys).astype(float)
+    turnout_rate = gather("VEP_TURNOUT_RATE_2024", state_keys).astype(float)
+
+    # margins: turnout (is_likely_voter) and demographics
+    age = 2024 - poll_df["birthyr"]
+    age_group = pd.cut(age, AGE_BINS, right=False, labels=False)
+    margins = [poll_df["is_likely_voter"].astype(int).to_numpy()]
+    targets = [vep[:, None] * np.column_stack([1 - turnout_rate, turnout_rate])]
+    commonweight = poll_df["commonweight"].to_numpy(dtype=float)
+    for column in [poll_df["gender4"], age_group, poll_df["educ"], poll_df["race"]]:
+        codes, n_levels = integer_codes(column)
+        shares = weighted_level_shares(state_index, codes, commonweight, n_states, n_levels)
+        # respondents without a code are not raked on this margin, so its targets only cover the rest
+        coverage = grouped_sums(state_index, (codes >= 0).astype(float), n_states) / np.bincount(state_index)
+        margins.append(codes)
+        targets.append((vep * coverage)[:, None] * shares)
+
+    # states missing turnout data get no targets (NaN), so rake leaves them at their unit weights
+    usable = np.isfinite(vep) & np.isfinite(turnout_rate)
+    targets = [np.where(usable[:, None], t, np.nan) for t in targets]
+
+    weights, info = rake(state_index, margins, targets)
+    print(f"Raking finished after {info['iterations']} sweeps, max relative error {info['max_relative_error']:.2e}")
+
+    # weighted state means with the raked weights, and the unweighted means for comparison
+    harris = poll_df["harris_preference"].to_numpy(dtype=float)
+    trump = poll_df["trump_preference"].to_numpy(dtype=float)
+    sums = grouped_sums(
+        state_index, np.column_stack([np.ones(len(weights)), weights, weights * harris, weights * trump, harris, trump]),
+        n_states,
+    )
+    count, sum_w, sum_wh, sum_wt, sum_h, sum_t = sums.T
+
+    results = pd.DataFrame({
+        "state": merged["state"].to_numpy(),
+        "inputstate": states,
+        "sample_size": count.astype(int),
+        "total_votes": merged["total_votes"].to_numpy(),
+    })
+    for candidate, raked_poll, raw_poll in [("harris", sum_wh / sum_w, sum_h / count), ("trump", sum_wt / sum_w, sum_t / count)]:
+        share = merged[f"{candidate}_share"].to_numpy(dtype=float)
+        raw = data_defect_metrics(raw_poll, share, count, results["total_votes"])
+        raked = data_defect_metrics(raked_poll, share, count, results["total_votes"])
+        results[f"{candidate}_poll_unweighted"] = raw_poll
+        results[f"{candidate}_poll_raked"] = raked_poll
+        results[f"{candidate}_data_defect_correlation_unweighted"] = raw["data_defect_correlation"]
+        results[f"{candidate}_data_defect_correlation_raked"] = raked["data_defect_correlation"]
+        print(
+            f"{candidate.capitalize()} mean rho: unweighted {np.nanmean(raw['data_defect_correlation']):.5f}, "
+            f"raked {np.nanmean(raked['data_defect_correlation']):.5f}"
+        )
+
+    results = results.dropna(subset=["state"])
+    results.to_csv("../data/raking.csv", index=False)
+    print("Raking results saved to ../data/raking.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# influence diagnostics for the figure 6 regressions, log10|Z_n,N| = a + b log10(total_votes)
+# input: ../data/figure_6.csv, ../data/figure_6_likely.csv, ../data/figure_6_validated.csv
+# output: ../data/figure_6_diagnostics.csv
+
+# for a simple regression every deletion diagnostic has a closed form, so no refit per deleted state is needed:
+#   leverage            h_i = 1/n + (x_i - xbar)^2 / Sxx
+#   studentized         t_i = e_i / (s_(i) sqrt(1 - h_i)), s_(i)^2 = (SSE - e_i^2 / (1 - h_i)) / (n - 3)
+#   Cook's distance     D_i = e_i^2 h_i / (2 s^2 (1 - h_i)^2)
+#   DFBETA (slope)      b - b_(i) = (x_i - xbar) e_i / (Sxx (1 - h_i))
+#   DFBETA (intercept)  a - a_(i) = e_i / (1 - h_i) * (1/n - xbar (x_i - xbar) / Sxx)
+# DFBETAS divide DFBETA by s_(i) sqrt((X'X)^-1_jj). Every function works on (B, n) arrays of B series.
+
+import os
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from figure_6_inference import CANDIDATES, POPULATIONS
+
+
+def influence_diagnostics(X: np.ndarray, Y: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Closed-form deletion diagnostics for the simple regression of each row of Y on X.
+
+    Args:
+        X: Array of shape (B, n), or (n,) to share one x across all rows
+        Y: Array of shape (B, n)
+
+    Returns:
+        Dict of (B, n) arrays: leverage, residual, studentized_residual, cooks_distance,
+        dfbeta_slope, dfbeta_intercept, dfbetas_slope, dfbetas_intercept
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    X = np.broadcast_to(np.asarray(X, dtype=float), Y.shape)
+    n = Y.shape[1]
+
+    x_mean = X.mean(axis=1, keepdims=True)
+    xc = X - x_mean
+    Sxx = np.sum(xc ** 2, axis=1, keepdims=True)
+    slope = np.sum(xc * (Y - Y.mean(axis=1, keepdims=True)), axis=1, keepdims=True) / Sxx
+    intercept = Y.mean(axis=1, keepdims=True) - slope * x_mean
+
+    residual = Y - intercept - slope * X
+    leverage = 1 / n + xc ** 2 / Sxx
+    sse = np.sum(residual ** 2, axis=1, keepdims=True)
+    s_sq = sse / (n - 2)
+    s_deleted = np.sqrt((sse - residual ** 2 / (1 - leverage)) / (n - 3))
+
+    dfbeta_slope = xc * residual / (Sxx * (1 - leverage))
+    dfbeta_intercept = residual / (1 - leverage) * (1 / n - x_mean * xc / Sxx)
+    return {
+        "leverage": leverage,
+        "residual": residual,
+        "studentized_residual": residual / (s_deleted * np.sqrt(1 - leverage)),
+        "cooks_distance": residual ** 2 * leverage / (2 * s_sq * (1 - leverage) ** 2),
+        "dfbeta_slope": dfbeta_slope,
+        "dfbeta_intercept": dfbeta_intercept,
+        "dfbetas_slope": dfbeta_slope / (s_deleted * np.sqrt(1 / Sxx)),
+        "dfbetas_intercept": dfbeta_intercept / (s_deleted * np.sqrt(1 / n + x_mean ** 2 / Sxx)),
+    }
+
+
+def figure_6_diagnostics(figure_data: pd.DataFrame, candidate: str) -> pd.DataFrame:
+    """Diagnostics for one figure 6 panel, one row per state used in the fit."""
+    x = np.log10(figure_data["total_votes"].to_numpy(dtype=float))
+    y = np.log10(np.abs(figure_data[f"{candidate}_Z_n_N"].to_numpy(dtype=float)))
+    mask = np.isfinite(x) & np.isfinite(y)
+    diagnostics = influence_diagnostics(x[mask], y[mask][None, :])
+    result = pd.DataFrame({"state": figure_data["state"].to_numpy()[mask], "candidate": candidate})
+    for name, values in diagnostics.items():
+        result[name] = values[0]
+    return result
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    results = []
+    for population, suffix in POPULATIONS.items():
+        figure_data = pd.read_csv(f"../data/figure_6{suffix}.csv")
+        for candidate in CANDIDATES:
+            diagnostics = figure_6_diagnostics(figure_data, candidate)
+            diagnostics.insert(0, "population", population)
+            results.append(diagnostics)
+            top = diagnostics.nlargest(3, "cooks_distance")
+            print(f"{population} {candidate}: most influential " +
+                  ", ".join(f"{s} ({d:.2f})" for s, d in zip(top["state"], top["cooks_distance"])))
+
+    output_file = "../data/figure_6_diagnostics.csv"
+    pd.concat(results, ignore_index=True).to_csv(output_file, index=False)
+    print(f"\nSaved regression diagnostics to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
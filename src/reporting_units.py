@@ -0,0 +1,200 @@
+# columnar store of the reporting-unit (county / town) results in the AP detail files
+# input: state_json_files/{XX}.json
+# cache: ../data/.cache/reporting_units.npz
+
+# every AP state file holds, next to the summary, one object per reporting unit with its fipsCode, eevp,
+# precinctsReportingPct, lastUpdated and a candidates list of candidateID / voteCount.
+# the store flattens them once into integer-coded NumPy arrays:
+#   units:  state (index into states), unit_id, name, fips, eevp, precincts_reporting_pct, last_updated, total_votes
+#   votes:  unit (index into units), candidate (index into candidates), vote_count, one row per unit x candidate
+# units are sorted by (fips, unit_id), so the units of one FIPS code are one contiguous slice.
+# the FIPS index is a direct-address array over all 5-digit codes, so per-FIPS lookups are O(1):
+#   fips_position[fips] -> row in fips_codes (-1 if absent), with fips_votes (FIPS x candidates), fips_table
+#   (the same votes with the total as a last column, as float) and fips_start / fips_stop (the slice of units)
+#   precomputed.
+# New England files report towns, so several units share one county fipsCode; their votes add up per FIPS.
+
+# the store is rebuilt only when a JSON file changes (keyed by the files' sizes and modification times)
+# or when STORE_VERSION is bumped after a change to its layout.
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from extract_ap_results import json_files
+
+DATA_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+JSON_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "state_json_files")
+STORE_PATH: str = os.path.join(DATA_DIR, ".cache", "reporting_units.npz")
+MAX_FIPS = 100000
+STORE_VERSION = 2
+
+_store_cache: Dict[str, Dict[str, np.ndarray]] = {}
+
+
+def folder_fingerprint(folder: str) -> str:
+    """Hash of the names, sizes and modification times of the JSON files in folder."""
+    digest = hashlib.sha1(f"v{STORE_VERSION};".encode())
+    for name in json_files(folder):
+        stat = os.stat(os.path.join(folder, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def build_store(folder: str = JSON_DIR) -> Dict[str, np.ndarray]:
+    """Parse every state file into the columnar arrays described above."""
+    states: List[str] = []
+    unit_rows = []
+    vote_rows = []
+    for name in json_files(folder):
+        with open(os.path.join(folder, name)) as file:
+            data = json.load(file)
+        state_code = len(states)
+        states.append(name.split(".")[0])
+        for key, unit in data.items():
+            if key == "summary":
+                continue
+            unit_rows.append((
+                state_code, int(unit["reportingunitID"]), unit.get("reportingunitName", ""),
+                int(unit.get("fipsCode") or -1), unit.get("eevp", np.nan), unit.get("precinctsReportingPct", np.nan),
+                unit.get("lastUpdated", "").rstrip("Z"), unit["parameters"]["vote"]["total"],
+            ))
+            for candidate in unit.get("candidates", []):
+                vote_rows.append((len(unit_rows) - 1, int(candidate["candidateID"]), candidate["voteCount"]))
+
+    state, unit_id, unit_name, fips, eevp, reporting_pct, last_updated, total_votes = zip(*unit_rows)
+    vote_unit, vote_candidate_id, vote_count = (np.array(column) for column in zip(*vote_rows))
+
+    # sort units by (fips, unit_id) and renumber the vote rows to match
+    fips = np.array(fips, dtype=np.int32)
+    unit_id = np.array(unit_id, dtype=np.int64)
+    order = np.lexsort((unit_id, fips))
+    new_position = np.empty_like(order)
+    new_position[order] = np.arange(len(order))
+    candidates, vote_candidate = np.unique(vote_candidate_id, return_inverse=True)
+
+    store = {
+        "states": np.array(states),
+        "candidates": candidates.astype(np.int64),
+        "unit_state": np.array(state, dtype=np.int16)[order],
+        "unit_id": unit_id[order],
+        "unit_name": np.array(unit_name)[order],
+        "unit_fips": fips[order],
+        "unit_eevp": np.array(eevp, dtype=np.float32)[order],
+        "unit_precincts_reporting_pct": np.array(reporting_pct, dtype=np.float32)[order],
+        "unit_last_updated": np.array(last_updated, dtype="datetime64[ms]")[order],
+        "unit_total_votes": np.array(total_votes, dtype=np.int64)[order],
+        "vote_unit": new_position[vote_unit].astype(np.int32),
+        "vote_candidate": vote_candidate.astype(np.int16),
+        "vote_count": vote_count.astype(np.int64),
+    }
+    store.update(fips_index(store))
+    return store
+
+
+def unit_votes(store: Dict[str, np.ndarray]) -> np.ndarray:
+    """Dense (units x candidates) vote counts."""
+    n_units, n_candidates = len(store["unit_id"]), len(store["candidates"])
+    key = store["vote_unit"].astype(np.int64) * n_candidates + store["vote_candidate"]
+    return np.bincount(key, weights=store["vote_count"], minlength=n_units * n_candidates).reshape(
+        n_units, n_candidates
+    ).astype(np.int64)
+
+
+def fips_index(store: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """FIPS codes, their unit slices, summed votes (alone and with the total) and the direct-address position array."""
+    fips_codes, fips_start, fips_count = np.unique(store["unit_fips"], return_index=True, return_counts=True)
+    group = np.repeat(np.arange(len(fips_codes)), fips_count)
+    votes = unit_votes(store)
+    fips_votes = np.zeros((len(fips_codes), votes.shape[1]), dtype=np.int64)
+    np.add.at(fips_votes, group, votes)
+    fips_position = np.full(MAX_FIPS, -1, dtype=np.int32)
+    valid = (fips_codes >= 0) & (fips_codes < MAX_FIPS)
+    fips_position[fips_codes[valid]] = np.flatnonzero(valid)
+    fips_total_votes = np.bincount(group, weights=store["unit_total_votes"]).astype(np.int64)
+    return {
+        "fips_codes": fips_codes,
+        "fips_start": fips_start,
+        "fips_stop": fips_start + fips_count,
+        "fips_votes": fips_votes,
+        "fips_total_votes": fips_total_votes,
+        "fips_table": np.column_stack([fips_votes, fips_total_votes]).astype(float),
+        "fips_position": fips_position,
+    }
+
+
+def load_store(folder: str = JSON_DIR, path: Optional[str] = STORE_PATH) -> Dict[str, np.ndarray]:
+    """
+    The store for folder, from memory or disk when the JSON files have not changed, else rebuilt.
+
+    Args:
+        folder: Folder of AP detail files
+        path: Where to cache the store on disk, or None to keep it in memory only
+    """
+    key = folder_fingerprint(folder)
+    if key in _store_cache:
+        return _store_cache[key]
+    if path and os.path.exists(path):
+        with np.load(path) as stored:
+            if str(stored["fingerprint"]) == key:
+                store = {name: stored[name] for name in stored.files if name != "fingerprint"}
+                _store_cache[key] = store
+                return store
+    store = build_store(folder)
+    if path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, fingerprint=np.array(key), **store)
+    _store_cache[key] = store
+    return store
+
+
+def candidate_column(store: Dict[str, np.ndarray], candidate_id) -> int:
+    """Column of a candidate ID (e.g. "8639") in the vote matrices."""
+    column = np.searchsorted(store["candidates"], int(candidate_id))
+    if column >= len(store["candidates"]) or store["candidates"][column] != int(candidate_id):
+        raise KeyError(f"Unknown candidate ID: {candidate_id}")
+    return int(column)
+
+
+def fips_votes(store: Dict[str, np.ndarray], fips) -> np.ndarray:
+    """
+    Votes per candidate and total votes for one or many FIPS codes, O(1) each.
+
+    Args:
+        store: From load_store
+        fips: FIPS code or array of codes (int or 5-digit string)
+
+    Returns:
+        Array of shape (..., candidates + 1): votes per candidate, then the total; NaN rows for unknown codes
+    """
+    fips = np.asarray(fips).astype(np.int64)
+    position = np.where((fips >= 0) & (fips < MAX_FIPS), store["fips_position"][np.clip(fips, 0, MAX_FIPS - 1)], -1)
+    return np.where((position >= 0)[..., None], store["fips_table"][np.maximum(position, 0)], np.nan)
+
+
+def fips_units(store: Dict[str, np.ndarray], fips) -> slice:
+    """Slice of the unit arrays belonging to one FIPS code (empty if absent)."""
+    fips = int(fips)
+    position = store["fips_position"][fips] if 0 <= fips < MAX_FIPS else -1
+    if position < 0:
+        return slice(0, 0)
+    return slice(int(store["fips_start"][position]), int(store["fips_stop"][position]))
+
+
+def main():
+    store = load_store()
+    n_units = len(store["unit_id"])
+    print(f"{n_units} reporting units, {len(store['fips_codes'])} FIPS codes, {len(store['candidates'])} candidates")
+    trump = candidate_column(store, "8639")
+    harris = candidate_column(store, "64984")
+    for fips in ["20001", "23031"]:
+        votes = fips_votes(store, fips)
+        print(f"FIPS {fips}: {fips_units(store, fips).stop - fips_units(store, fips).start} units, "
+              f"Trump {votes[trump]:.0f}, Harris {votes[harris]:.0f}, total {votes[-1]:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# empirical-Bayes shrinkage of the state data defect correlations
+# input: ../data/figure_5.csv, ../data/figure_5_likely.csv, ../data/figure_5_validated.csv
+# input: ../data/State-Pre-ElectionClassification.csv (through states.py)
+# output: the same figure_5 files, with {candidate}_data_defect_correlation_shrunk and
+#         {candidate}_data_defect_correlation_posterior_sd columns added
+
+# model: rho_s ~ N(theta_s, v_s), theta_s ~ N(mu_g, tau^2), g the group of state s (one national group,
+# or the pre-election classification). Under simple random sampling the error has variance (1-f) sigma_g^2 / n,
+# so rho has sampling variance f / n = 1 / N; we use v_s = 1 / (N_s - 1).
+# tau^2 is the DerSimonian-Laird moment estimate, generalized to one mean per group:
+#   w = 1/v, mu_g = sum_g(w rho) / sum_g(w), Q = sum w (rho - mu_g)^2,
+#   tau^2 = max(0, (Q - (S - G)) / (sum w - sum_g (sum_g w^2 / sum_g w)))
+# the posterior mean is mu_g + (1 - B_s)(rho_s - mu_g), with B_s = v_s / (v_s + tau^2).
+
+# everything is closed form and vectorized over series (candidates x populations x resamples),
+# so a refit takes well under a millisecond and can sit inside a bootstrap loop.
+
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from states import gather, keys_from_names
+
+POPULATIONS = {"all": "", "likely": "_likely", "validated": "_validated"}
+CANDIDATES = ["harris", "trump"]
+CLASSIFICATION_GROUPS = {"Blue": "blue", "Likely Blue": "blue", "Swing": "swing", "Red": "red"}
+
+pool_toward = "classification"  # "national" or "classification"
+
+
+def shrink(rho: np.ndarray, variance: np.ndarray, groups: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Empirical-Bayes posterior means and SDs of rho, for every series at once.
+
+    Args:
+        rho: Array of shape (B, S), B series of S state estimates
+        variance: Sampling variance of each estimate, broadcastable to (B, S)
+        groups: Integer group per state, shape (S,); None pools every state toward one mean
+
+    Returns:
+        Dict with shrunk and posterior_sd of shape (B, S), and mu (B, G) and tau_sq (B,)
+    """
+    rho = np.atleast_2d(np.asarray(rho, dtype=float))
+    variance = np.broadcast_to(np.asarray(variance, dtype=float), rho.shape)
+    n_series, n_states = rho.shape
+    groups = np.zeros(n_states, dtype=np.int64) if groups is None else np.asarray(groups)
+    n_groups = int(groups.max()) + 1
+    indicator = np.eye(n_groups)[groups]  # (S, G)
+
+    w = 1 / variance
+    sum_w = w @ indicator
+    mu = (w * rho) @ indicator / sum_w
+    Q = np.sum(w * (rho - mu[:, groups]) ** 2, axis=1)
+    C = sum_w.sum(axis=1) - np.sum((w ** 2 @ indicator) / sum_w, axis=1)
+    tau_sq = np.maximum(0.0, (Q - (n_states - n_groups)) / C)
+
+    # re-estimate the group means with the random-effects weights
+    w_star = 1 / (variance + tau_sq[:, None])
+    sum_w_star = w_star @ indicator
+    mu = (w_star * rho) @ indicator / sum_w_star
+    B = variance / (variance + tau_sq[:, None])
+    shrunk = mu[:, groups] + (1 - B) * (rho - mu[:, groups])
+    # conditional posterior variance plus the uncertainty of the estimated group mean
+    posterior_var = (1 - B) * variance + B ** 2 / sum_w_star[:, groups]
+    return {"shrunk": shrunk, "posterior_sd": np.sqrt(posterior_var), "mu": mu, "tau_sq": tau_sq}
+
+
+def classification_groups(states: pd.Series) -> np.ndarray:
+    """Integer group per state from the pre-election classification (blue, swing, red)."""
+    classification = pd.Series(gather("classification", keys_from_names(states))).map(CLASSIFICATION_GROUPS)
+    _, groups = np.unique(classification.fillna("unknown").to_numpy(), return_inverse=True)
+    return groups
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    for population, suffix in POPULATIONS.items():
+        path = f"../data/figure_5{suffix}.csv"
+        df = pd.read_csv(path)
+        groups = classification_groups(df["state"]) if pool_toward == "classification" else None
+        rho = df[[f"{candidate}_data_defect_correlation" for candidate in CANDIDATES]].to_numpy(dtype=float).T
+        variance = 1 / (df["total_votes"].to_numpy(dtype=float) - 1)
+
+        result = shrink(rho, variance, groups)
+        for b, candidate in enumerate(CANDIDATES):
+            df[f"{candidate}_data_defect_correlation_shrunk"] = result["shrunk"][b]
+            df[f"{candidate}_data_defect_correlation_posterior_sd"] = result["posterior_sd"][b]
+            print(
+                f"{population} {candidate}: tau = {np.sqrt(result['tau_sq'][b]):.5f}, "
+                f"sd of rho {np.std(rho[b]):.5f} -> {np.std(result['shrunk'][b]):.5f}"
+            )
+
+        df.to_csv(path, index=False)
+        print(f"Saved shrunk rho to {path}")
+
+
+if __name__ == "__main__":
+    main()
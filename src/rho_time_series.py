@@ -0,0 +1,151 @@
+# field-period time series of the data defect correlation
+# input: ../data/CCES24_Common_OUTPUT_vv_topost_final.csv (starttime is the interview start)
+# input: ../data/merged_all_voters.csv (actual shares and total_votes per state)
+# output: ../data/rho_time_series.csv
+# output: ../figures/rho_time_series.png
+
+# respondents are binned by state and interview day. One bincount gives a (states x days) table of counts and
+# preference sums, and a cumulative sum along days turns it into prefix sums, so the sums over any window
+# [d - w + 1, d] are P[:, d + 1] - P[:, d + 1 - w], O(1) per state and window whatever the window length.
+# for every rolling window we compute the state poll shares, Z_n (figure_7.py) and rho (figure_5_dataset.py).
+
+# the figure plots the vote-weighted mean rho across states per window, against the window's last day,
+# to show whether the defect grew as the election approached.
+
+import os
+from typing import Dict
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from cces import add_voter_flags, encode_preferences, group_index, load_cces, population_masks
+from data_defect import data_defect_metrics
+
+CANDIDATES = ["harris", "trump"]
+ELECTION_DAY = pd.Timestamp("2024-11-05")
+
+population = "all"  # all, likely or validated
+window_days = 7
+min_respondents = 30  # windows with fewer respondents in a state are left empty
+
+
+def prefix_sums(state_index: np.ndarray, day_index: np.ndarray, values: np.ndarray, n_states: int, n_days: int) -> np.ndarray:
+    """
+    Prefix sums over days of per (state, day) sums.
+
+    Args:
+        state_index: State index per respondent
+        day_index: Day index per respondent, in 0..n_days-1
+        values: Array of shape (respondents, k)
+        n_states, n_days: Table size
+
+    Returns:
+        Array of shape (k, n_states, n_days + 1); [:, :, d] is the sum over days before d
+    """
+    key = state_index * n_days + day_index
+    table = np.stack([
+        np.bincount(key, weights=values[:, j], minlength=n_states * n_days).reshape(n_states, n_days)
+        for j in range(values.shape[1])
+    ])
+    prefix = np.zeros(table.shape[:2] + (n_days + 1,))
+    np.cumsum(table, axis=2, out=prefix[:, :, 1:])
+    return prefix
+
+
+def window_sums(prefix: np.ndarray, window: int) -> np.ndarray:
+    """Sums over the trailing window ending on each day, shape (k, n_states, n_days - window + 1)."""
+    return prefix[:, :, window:] - prefix[:, :, :-window]
+
+
+def rolling_metrics(
+    prefix: np.ndarray, window: int, shares: np.ndarray, total_votes: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    Poll shares, Z_n and rho for every state and trailing window.
+
+    Args:
+        prefix: From prefix_sums with values (1, harris, trump)
+        window: Window length in days
+        shares: Actual shares of shape (n_states, candidates)
+        total_votes: Shape (n_states,)
+
+    Returns:
+        Dict of (candidates, n_states, n_windows) arrays, plus n of shape (n_states, n_windows)
+    """
+    sums = window_sums(prefix, window)
+    n = sums[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        polls = np.where(n >= min_respondents, sums[1:] / n, np.nan)
+    metrics = data_defect_metrics(polls, shares.T[:, :, None], n[None], total_votes[None, :, None])
+    return {"n": n, "poll": polls, "Z_n": metrics["Z_n"], "rho": metrics["data_defect_correlation"]}
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    poll_df = load_cces(["inputstate", "starttime", "CC24_364b", "CC24_363", "TS_g2024"])
+    poll_df = encode_preferences(add_voter_flags(poll_df))
+    poll_df = poll_df[population_masks(poll_df)[population]].reset_index(drop=True)
+
+    days = pd.to_datetime(poll_df["starttime"]).dt.normalize()
+    first_day = days.min()
+    day_index = (days - first_day).dt.days.to_numpy()
+    n_days = int(day_index.max()) + 1
+    states, state_index = group_index(poll_df["inputstate"].to_numpy())
+
+    values = np.column_stack([np.ones(len(poll_df))] + [poll_df[f"{c}_preference"].to_numpy(dtype=float) for c in CANDIDATES])
+    prefix = prefix_sums(state_index, day_index, values, len(states), n_days)
+
+    merged = pd.read_csv("../data/merged_all_voters.csv").set_index("inputstate").reindex(states)
+    shares = merged[[f"{c}_share" for c in CANDIDATES]].to_numpy(dtype=float)
+    total_votes = merged["total_votes"].to_numpy(dtype=float)
+    metrics = rolling_metrics(prefix, window_days, shares, total_votes)
+
+    window_end = first_day + pd.to_timedelta(np.arange(window_days - 1, n_days), unit="D")
+    n_windows = len(window_end)
+    rows = []
+    for k, candidate in enumerate(CANDIDATES):
+        rows.append(pd.DataFrame({
+            "window_end": np.tile(window_end, len(states)),
+            "state": np.repeat(merged["state"].to_numpy(), n_windows),
+            "candidate": candidate,
+            "n": metrics["n"].ravel().astype(int),
+            "poll": metrics["poll"][k].ravel(),
+            "Z_n": metrics["Z_n"][k].ravel(),
+            "data_defect_correlation": metrics["rho"][k].ravel(),
+        }))
+    results = pd.concat(rows, ignore_index=True).dropna(subset=["state", "data_defect_correlation"])
+    output_file = "../data/rho_time_series.csv"
+    results.to_csv(output_file, index=False)
+    print(f"Saved rho time series to {output_file}")
+
+    # vote-weighted mean rho across states per window
+    fig, ax = plt.subplots(figsize=(6, 3))
+    for k, candidate in enumerate(CANDIDATES):
+        rho = metrics["rho"][k]
+        weights = np.where(np.isfinite(rho), total_votes[:, None], 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_rho = np.nansum(weights * rho, axis=0) / weights.sum(axis=0)
+        days_to_election = (ELECTION_DAY - window_end).days.to_numpy()
+        # windows where no state reaches min_respondents have no mean
+        fitted = np.isfinite(mean_rho)
+        if fitted.sum() >= 2:
+            slope = np.polyfit(days_to_election[fitted], mean_rho[fitted], 1)[0]
+            print(f"{candidate.capitalize()}: mean rho changes by {slope:.2e} per day further from the election")
+        else:
+            print(f"{candidate.capitalize()}: fewer than two windows with a mean rho, no trend")
+        ax.plot(window_end, mean_rho, label=candidate.capitalize(), color="blue" if candidate == "harris" else "red")
+    ax.axhline(0, color="gray", linewidth=1)
+    ax.set_ylabel(r"Mean $\rho$ (" + f"{window_days}-day window)")
+    ax.grid(True, linestyle="--", alpha=0.6)
+    ax.legend()
+    fig.autofmt_xdate()
+    os.makedirs("../figures", exist_ok=True)
+    plt.savefig("../figures/rho_time_series.png", dpi=300, bbox_inches="tight")
+
+
+if __name__ == "__main__":
+    main()
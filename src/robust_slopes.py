@@ -0,0 +1,278 @@
+# robust slope estimators used as an alternative fitting backend for figure_6.py and figure_rho_N.py
+# a few extreme states drive the OLS fits, so we also offer
+# 1. Theil-Sen: the median of all pairwise slopes, with intercept median(y - b x)
+# 2. quantile regression: the line minimizing the check loss (median regression by default)
+
+# every function takes arrays of shape (B, n): B series (candidates, populations, resamples, ...)
+# of n points each, and fits all series at once.
+
+# Theil-Sen without forming the n(n-1)/2 pairwise slopes: with points sorted by x, the number of
+# pairwise slopes below t equals the number of inversions of r = y - t x, which a merge sort counts
+# in O(n log n). Bisection on t, started from a bracket taken from a small sample of pairwise slopes,
+# then converges to the k-th smallest slope. Short series (up to PAIRWISE_MAX_N points, e.g. the 50 states)
+# are cheaper to handle by forming their pairwise slopes directly.
+
+# quantile regression: for a fixed slope b, the best intercept is the q-quantile of y - b x, and the resulting
+# profile loss is convex and piecewise linear in b, with its minimum at a pairwise slope. Short series (up to
+# PAIRWISE_MAX_N points) are solved exactly by a binary search over their sorted pairwise slopes, for all
+# series at once (about log2(n^2 / 2) loss evaluations); longer series by a golden-section search on b, whose
+# number of steps to reach the tolerance is fixed in advance.
+
+from typing import Tuple
+
+import numpy as np
+
+# below this many points per series, forming all pairwise slopes is cheaper than bisection
+PAIRWISE_MAX_N = 64
+
+
+def count_inversions(values: np.ndarray) -> np.ndarray:
+    """
+    Count pairs i < j with values[b, j] < values[b, i] for each row b, in O(n log n) per row.
+
+    A bottom-up merge sort over all rows at once: at each level, every element of a right block
+    counts the elements of its left block that are larger, via one searchsorted on offset keys.
+
+    Args:
+        values: Array of shape (B, n)
+
+    Returns:
+        Array of B inversion counts
+    """
+    B, n = values.shape
+    ranks = np.argsort(np.argsort(values, axis=1, kind="stable"), axis=1, kind="stable")
+    # pad to a power of two with a rank above every real one, which adds no inversions at the end
+    size = 1 << max(0, int(np.ceil(np.log2(max(n, 1)))))
+    merged = np.full((B, size), n, dtype=np.int64)
+    merged[:, :n] = ranks
+    inversions = np.zeros(B, dtype=np.int64)
+    width = 1
+    while width < size:
+        n_blocks = size // (2 * width)
+        blocks = merged.reshape(B, n_blocks, 2, width)
+        # offsetting each block pair by a multiple of n + 1 makes the left halves one sorted array
+        offsets = (np.arange(B * n_blocks, dtype=np.int64) * (n + 1)).reshape(B, n_blocks, 1)
+        left = (blocks[:, :, 0, :] + offsets).ravel()
+        right = blocks[:, :, 1, :] + offsets
+        block_end = np.searchsorted(left, offsets + n + 1, side="left")
+        at_most = np.searchsorted(left, right.ravel(), side="right").reshape(right.shape)
+        inversions += (block_end - at_most).sum(axis=(1, 2))
+        merged = np.sort(blocks.reshape(B, n_blocks, 2 * width), axis=2).reshape(B, size)
+        width *= 2
+    return inversions
+
+
+def _kth_pairwise_slope(
+    Xs: np.ndarray, Ys: np.ndarray, k: np.ndarray, n_pairs: np.ndarray, max_iter: int, rtol: float, seed: int
+) -> np.ndarray:
+    """Bisection for the k-th smallest (0-indexed) pairwise slope of each row of x-sorted data."""
+    B, n = Xs.shape
+    rows = np.arange(B)[:, None]
+
+    # a bracket that surely contains every pairwise slope
+    gaps = np.diff(Xs, axis=1)
+    min_gap = np.min(np.where(gaps > 0, gaps, np.inf), axis=1)
+    bound = (np.ptp(Ys, axis=1) / min_gap) * (1 + 1e-9) + 1e-12
+    lo, hi = -bound, bound
+
+    # narrow it with quantiles of a random sample of pairwise slopes, kept only where the counts confirm it
+    rng = np.random.default_rng(seed)
+    m = 20 * n
+    i = rng.integers(0, n, size=(B, m))
+    j = rng.integers(0, n, size=(B, m))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sample = (Ys[rows, j] - Ys[rows, i]) / (Xs[rows, j] - Xs[rows, i])
+    sample[~np.isfinite(sample)] = np.nan
+    p = (k + 0.5) / n_pairs
+    margin = 4 * np.sqrt(p * (1 - p) / m) + 1 / m
+    with np.errstate(all="ignore"):
+        sample_lo = np.array([np.nanquantile(r, q) if np.any(np.isfinite(r)) else np.nan
+                              for r, q in zip(sample, np.clip(p - margin, 0, 1))])
+        sample_hi = np.array([np.nanquantile(r, q) if np.any(np.isfinite(r)) else np.nan
+                              for r, q in zip(sample, np.clip(p + margin, 0, 1))])
+    sample_lo = np.where(np.isfinite(sample_lo), np.nextafter(sample_lo, -np.inf), lo)
+    sample_hi = np.where(np.isfinite(sample_hi), np.nextafter(sample_hi, np.inf), hi)
+    lo = np.where(count_inversions(Ys - sample_lo[:, None] * Xs) <= k, sample_lo, lo)
+    hi = np.where(count_inversions(Ys - sample_hi[:, None] * Xs) > k, sample_hi, hi)
+
+    # count(slope < t) <= k means the k-th slope is at or above t
+    for _ in range(max_iter):
+        mid = (lo + hi) / 2
+        below = count_inversions(Ys - mid[:, None] * Xs)
+        go_up = below <= k
+        lo = np.where(go_up, mid, lo)
+        hi = np.where(go_up, hi, mid)
+        if np.all(hi - lo <= rtol * np.maximum(1.0, np.abs(mid))):
+            break
+    return (lo + hi) / 2
+
+
+def _pairwise_median_slopes(X: np.ndarray, Y: np.ndarray) -> np.ndarray:
+    """Median of all pairwise slopes, formed explicitly; fastest for small n."""
+    i, j = np.triu_indices(X.shape[1], k=1)
+    dx = X[:, j] - X[:, i]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = np.where(dx != 0, (Y[:, j] - Y[:, i]) / dx, np.nan)
+    defined = np.any(np.isfinite(slopes), axis=1)
+    medians = np.full(len(slopes), np.nan)
+    if np.any(defined):
+        medians[defined] = np.nanmedian(slopes[defined], axis=1)
+    return medians
+
+
+def theil_sen(
+    X: np.ndarray, Y: np.ndarray, max_iter: int = 100, rtol: float = 1e-10, seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batched Theil-Sen slopes and intercepts.
+
+    Args:
+        X: Array of shape (B, n), or (n,) to share one x across all rows
+        Y: Array of shape (B, n)
+        max_iter: Maximum number of bisection steps
+        rtol: Relative tolerance on the slope
+        seed: Seed for the sampled starting bracket
+
+    Returns:
+        (slopes, intercepts), each of shape (B,)
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    X = np.broadcast_to(np.asarray(X, dtype=float), Y.shape)
+    n = Y.shape[1]
+
+    if n <= PAIRWISE_MAX_N:
+        slopes = _pairwise_median_slopes(X, Y)
+        return slopes, np.median(Y - slopes[:, None] * X, axis=1)
+
+    # sort by x, ties in x by y, so pairs with equal x are never counted as inversions
+    order = np.lexsort((Y, X), axis=1)
+    Xs = np.take_along_axis(X, order, axis=1)
+    Ys = np.take_along_axis(Y, order, axis=1)
+
+    # pairs with equal x have no slope
+    positions = np.broadcast_to(np.arange(n), Xs.shape)
+    run_start = np.concatenate([np.ones((len(Xs), 1), dtype=bool), np.diff(Xs, axis=1) != 0], axis=1)
+    first_in_run = np.maximum.accumulate(np.where(run_start, positions, 0), axis=1)
+    n_pairs = n * (n - 1) // 2 - np.sum(positions - first_in_run, axis=1)
+
+    # series whose points all share one x have no slope
+    if np.any(n_pairs == 0):
+        slopes = np.full(len(Y), np.nan)
+        defined = n_pairs > 0
+        if np.any(defined):
+            slopes[defined], _ = theil_sen(X[defined], Y[defined], max_iter, rtol, seed)
+        return slopes, np.median(Y - slopes[:, None] * X, axis=1)
+
+    # lower and upper middle order statistics; one batch when they coincide (odd number of pairs)
+    k_lo, k_hi = (n_pairs - 1) // 2, n_pairs // 2
+    if np.array_equal(k_lo, k_hi):
+        slopes = _kth_pairwise_slope(Xs, Ys, k_lo, n_pairs, max_iter, rtol, seed)
+    else:
+        both = _kth_pairwise_slope(
+            np.vstack([Xs, Xs]), np.vstack([Ys, Ys]), np.concatenate([k_lo, k_hi]),
+            np.concatenate([n_pairs, n_pairs]), max_iter, rtol, seed,
+        )
+        slopes = (both[: len(Xs)] + both[len(Xs):]) / 2
+    intercepts = np.median(Y - slopes[:, None] * X, axis=1)
+    return slopes, intercepts
+
+
+def _profile_check_loss(X: np.ndarray, Y: np.ndarray, slopes: np.ndarray, quantile: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Check loss of the best line with each series' slope; its intercept is a quantile of y - slope * x."""
+    residuals = Y - slopes[:, None] * X
+    intercepts = np.quantile(residuals, quantile, axis=1, method="inverted_cdf")
+    r = residuals - intercepts[:, None]
+    return np.sum(np.maximum(quantile * r, (quantile - 1) * r), axis=1), intercepts
+
+
+def _pairwise_quantile_slopes(X: np.ndarray, Y: np.ndarray, quantile: float) -> np.ndarray:
+    """Exact slopes: binary search for the minimum of the convex profile loss over the sorted pairwise slopes."""
+    i, j = np.triu_indices(X.shape[1], k=1)
+    dx = X[:, j] - X[:, i]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        candidates = np.sort(np.where(dx != 0, (Y[:, j] - Y[:, i]) / dx, np.nan), axis=1)  # NaN last
+    last = np.sum(np.isfinite(candidates), axis=1) - 1
+    rows = np.arange(len(candidates))
+    lo, hi = np.zeros(len(candidates), dtype=np.int64), np.maximum(last, 0)
+    while np.any(lo < hi):
+        mid = (lo + hi) // 2
+        step = np.minimum(mid + 1, hi)
+        loss_mid, _ = _profile_check_loss(X, Y, np.nan_to_num(candidates[rows, mid]), quantile)
+        loss_step, _ = _profile_check_loss(X, Y, np.nan_to_num(candidates[rows, step]), quantile)
+        # the loss is convex in the slope, so it stops decreasing at the minimum
+        at_or_past = loss_mid <= loss_step
+        hi = np.where(lo < hi, np.where(at_or_past, mid, hi), hi)
+        lo = np.where(lo < hi, np.where(at_or_past, lo, mid + 1), lo)
+    return np.where(last >= 0, candidates[rows, lo], np.nan)
+
+
+def _golden_quantile_slopes(X: np.ndarray, Y: np.ndarray, quantile: float, rtol: float) -> np.ndarray:
+    """Golden-section search for the minimum of the convex profile loss, to rtol, for long series."""
+    # a bracket that surely contains every pairwise slope, as in theil_sen
+    Xs = np.sort(X, axis=1)
+    gaps = np.diff(Xs, axis=1)
+    min_gap = np.min(np.where(gaps > 0, gaps, np.inf), axis=1)
+    defined = np.isfinite(min_gap)
+    bound = np.where(defined, np.ptp(Y, axis=1) / np.where(defined, min_gap, 1.0) * (1 + 1e-9) + 1e-12, 1.0)
+
+    # the bracket shrinks by inv_phi per step, so the number of steps to reach rtol is known in advance
+    inv_phi = (np.sqrt(5) - 1) / 2
+    n_steps = int(np.ceil(np.log(rtol / (2 * bound.max())) / np.log(inv_phi))) + 1
+    lo, hi = -bound, bound
+    c, d = hi - inv_phi * (hi - lo), lo + inv_phi * (hi - lo)
+    loss_c, _ = _profile_check_loss(X, Y, c, quantile)
+    loss_d, _ = _profile_check_loss(X, Y, d, quantile)
+    for _ in range(max(n_steps, 0)):
+        left = loss_c <= loss_d  # the minimum is in [lo, d]
+        lo, hi = np.where(left, lo, c), np.where(left, d, hi)
+        new = np.where(left, hi - inv_phi * (hi - lo), lo + inv_phi * (hi - lo))
+        loss_new, _ = _profile_check_loss(X, Y, new, quantile)
+        c, d = np.where(left, new, d), np.where(left, c, new)
+        loss_c, loss_d = np.where(left, loss_new, loss_d), np.where(left, loss_c, loss_new)
+    return np.where(defined, np.where(loss_c <= loss_d, c, d), np.nan)
+
+
+def quantile_regression(
+    X: np.ndarray, Y: np.ndarray, quantile: float = 0.5, rtol: float = 1e-12
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batched quantile regression slopes and intercepts.
+
+    Exact for series of up to PAIRWISE_MAX_N points; longer series are solved to rtol on the slope.
+
+    Args:
+        X: Array of shape (B, n), or (n,) to share one x across all rows
+        Y: Array of shape (B, n)
+        quantile: Quantile to fit, 0.5 for median regression
+        rtol: Tolerance on the slope for series longer than PAIRWISE_MAX_N, relative to the slope bracket
+
+    Returns:
+        (slopes, intercepts), each of shape (B,); NaN for series whose points all share one x
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    X = np.broadcast_to(np.asarray(X, dtype=float), Y.shape)
+    if Y.shape[1] <= PAIRWISE_MAX_N:
+        slopes = _pairwise_quantile_slopes(X, Y, quantile)
+    else:
+        slopes = _golden_quantile_slopes(X, Y, quantile, rtol)
+    _, intercepts = _profile_check_loss(X, Y, np.nan_to_num(slopes), quantile)
+    return slopes, np.where(np.isfinite(slopes), intercepts, np.nan)
+
+
+def fit_lines(X: np.ndarray, Y: np.ndarray, method: str = "theil_sen") -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fit robust lines with the named backend.
+
+    Args:
+        X: Array of shape (B, n), or (n,) to share one x across all rows
+        Y: Array of shape (B, n)
+        method: "theil_sen" or "quantile"
+
+    Returns:
+        (slopes, intercepts), each of shape (B,)
+    """
+    if method == "theil_sen":
+        return theil_sen(X, Y)
+    if method == "quantile":
+        return quantile_regression(X, Y)
+    raise ValueError(f"Unknown robust fitting method: {method}")
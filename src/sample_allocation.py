@@ -0,0 +1,159 @@
+# allocation of a national respondent budget across states (or any strata)
+# input: ../data/figure_5.csv
+# output: ../data/sample_allocation.csv
+
+# from the data defect identity, the MSE of a state share estimate with n respondents is
+#     MSE_s(n) = E[rho_s^2] sigma_s^2 (N_s - n) / n = a_s / n - b_s,  a_s = E[rho_s^2] sigma_s^2 N_s, b_s = E[rho_s^2] sigma_s^2
+# two objectives, both convex in n:
+# 1. national: minimize sum_s W_s^2 MSE_s with W_s = N_s / sum(N), the MSE of the vote-weighted national share
+#    when state errors are independent. The continuous optimum is n_s proportional to W_s sqrt(a_s)
+#    (found by water-filling between the bounds n_min and N_s); the units lost to rounding down are then
+#    handed out one at a time, by a heap, to the stratum with the largest marginal MSE reduction.
+# 2. minimax: minimize max_s MSE_s. MSE_s <= t needs n_s = a_s / (t + b_s), so bisection on t finds the smallest
+#    t whose allocation fits the budget; leftover units go, by a heap, to the currently worst stratum.
+# the heap only ever sees at most one unit per stratum, so thousands of strata cost milliseconds.
+
+# E[rho_s^2] comes from rho_shrinkage.py when its columns are present (shrunk^2 + posterior_sd^2),
+# otherwise from the mean and spread of rho across states.
+
+import heapq
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+CANDIDATES = ["harris", "trump"]
+N_MIN = 2
+BISECTION_STEPS = 100
+
+budget = None  # respondents to allocate; None uses the CCES total in figure_5.csv
+
+
+def _water_fill(scores: np.ndarray, lower: np.ndarray, upper: np.ndarray, budget: float) -> np.ndarray:
+    """Continuous n = clip(lam * scores, lower, upper) with sum(n) = budget, lam found by bisection."""
+    lo, hi = 0.0, np.max(upper / np.maximum(scores, 1e-300)) * 2
+    for _ in range(BISECTION_STEPS):
+        lam = (lo + hi) / 2
+        if np.clip(lam * scores, lower, upper).sum() > budget:
+            hi = lam
+        else:
+            lo = lam
+    return np.clip(lo * scores, lower, upper)
+
+
+def _hand_out(n: np.ndarray, remaining: int, gain, upper: np.ndarray) -> np.ndarray:
+    """Give the remaining units one at a time to the stratum with the largest gain(i, n_i), using a heap."""
+    heap = [(-gain(i, n[i]), i) for i in range(len(n)) if n[i] < upper[i]]
+    heapq.heapify(heap)
+    while remaining > 0 and heap:
+        _, i = heapq.heappop(heap)
+        n[i] += 1
+        remaining -= 1
+        if n[i] < upper[i]:
+            heapq.heappush(heap, (-gain(i, n[i]), i))
+    return n
+
+
+def allocate(
+    budget: int,
+    a: np.ndarray,
+    b: np.ndarray,
+    N: np.ndarray,
+    objective: str = "national",
+    weights: Optional[np.ndarray] = None,
+    n_min: int = N_MIN,
+) -> np.ndarray:
+    """
+    Integer allocation of budget respondents across strata.
+
+    Args:
+        budget: Total number of respondents
+        a, b: MSE_s(n) = a_s / n - b_s
+        N: Population size per stratum, the upper bound on n
+        objective: "national" (minimize sum weights^2 * MSE) or "minimax" (minimize the largest MSE)
+        weights: Stratum weights for "national", N / sum(N) if None
+        n_min: Smallest allowed n per stratum
+
+    Returns:
+        Integer n per stratum, summing to budget (unless every stratum hits N)
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    upper = np.floor(np.asarray(N, dtype=float))
+    lower = np.minimum(np.full(len(a), float(n_min)), upper)
+    if budget < lower.sum():
+        raise ValueError(f"Budget {budget} is below the minimum allocation {lower.sum():.0f}")
+
+    if objective == "national":
+        weights = np.asarray(N, dtype=float) / np.sum(N) if weights is None else np.asarray(weights, dtype=float)
+        c = weights ** 2 * a
+        n = np.floor(_water_fill(np.sqrt(c), lower, upper, budget))
+        n = np.maximum(n, lower)
+        # marginal reduction of c / n from one more unit
+        return _hand_out(n, int(budget - n.sum()), lambda i, n_i: c[i] / n_i - c[i] / (n_i + 1), upper).astype(int)
+
+    if objective == "minimax":
+        def allocation(t: float) -> np.ndarray:
+            return np.clip(a / (t + b), lower, upper)
+
+        lo, hi = 0.0, np.max(a / lower - b)
+        for _ in range(BISECTION_STEPS):
+            t = (lo + hi) / 2
+            if allocation(t).sum() > budget:
+                lo = t
+            else:
+                hi = t
+        n = np.maximum(np.floor(allocation(hi)), lower)
+        # the largest current MSE gets the next unit
+        return _hand_out(n, int(budget - n.sum()), lambda i, n_i: a[i] / n_i - b[i], upper).astype(int)
+
+    raise ValueError(f"Unknown allocation objective: {objective}")
+
+
+def mse_terms(df: pd.DataFrame) -> tuple:
+    """a_s and b_s summed over candidates, from figure_5 columns."""
+    N = df["total_votes"].to_numpy(dtype=float)
+    a = np.zeros(len(df))
+    b = np.zeros(len(df))
+    for candidate in CANDIDATES:
+        sigma_sq = df[f"{candidate}_sigma_g"].to_numpy(dtype=float) ** 2
+        if f"{candidate}_data_defect_correlation_shrunk" in df.columns:
+            rho_sq = (df[f"{candidate}_data_defect_correlation_shrunk"] ** 2
+                      + df[f"{candidate}_data_defect_correlation_posterior_sd"] ** 2).to_numpy(dtype=float)
+        else:
+            rho = df[f"{candidate}_data_defect_correlation"].to_numpy(dtype=float)
+            rho_sq = np.full(len(df), rho.mean() ** 2 + rho.var(ddof=1))
+        a += rho_sq * sigma_sq * N
+        b += rho_sq * sigma_sq
+    return a, b
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    df = pd.read_csv("../data/figure_5.csv")
+    N = df["total_votes"].to_numpy(dtype=float)
+    a, b = mse_terms(df)
+    total = int(df["sample_size"].sum()) if budget is None else budget
+
+    results = pd.DataFrame({"state": df["state"], "total_votes": N, "sample_size": df["sample_size"]})
+    results["mse_current"] = a / results["sample_size"] - b
+    for name in ["national", "minimax"]:
+        n = allocate(total, a, b, N, name)
+        results[f"n_{name}"] = n
+        results[f"mse_{name}"] = a / n - b
+
+    W = N / N.sum()
+    for column in ["mse_current", "mse_national", "mse_minimax"]:
+        print(f"{column}: national {np.sum(W ** 2 * results[column]):.3e}, worst state {results[column].max():.3e}")
+
+    output_file = "../data/sample_allocation.csv"
+    results.to_csv(output_file, index=False)
+    print(f"Saved sample allocation to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# sample-size planning from the data defect identity, the forward direction of effective_sample_size.py
+# input: ../data/figure_5.csv
+# output: ../data/sample_size_planning.csv
+
+# with f = n/N, the identity error = rho * sigma * sqrt((1-f)/f) gives
+#     MSE = E[rho^2] * sigma^2 * (N - n) / n
+# so a target MSE m needs
+#     n = N / (1 + m / (E[rho^2] sigma^2))
+# which is always attainable (n = N is a census), but can be most of the population.
+# for the Z scores of figure_6_dataset.py and figure_7.py
+#     Z_n,N = rho * sqrt(N - 1)   does not depend on n: |Z_n,N| <= z is unattainable at any n when |rho| sqrt(N-1) > z
+#     Z_n  ~= rho * sqrt(N - n)   so |Z_n| <= z needs n >= N - (z / rho)^2
+# E[rho^2] = mean^2 + sd^2 for an assumed rho distribution; pass N to add the 1/(N-1) of simple random sampling.
+
+# everything is vectorized. For inner loops that query many (rho, N, target) points, build_lookup_table
+# precomputes required n on a log-spaced grid and lookup_required_n interpolates trilinearly in log space
+# (searchsorted on each axis, then one gather of the 8 corners).
+
+import hashlib
+import os
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+TABLE_PATH: str = os.path.join(DATA_DIR, ".cache", "sample_size_planning_table.npz")
+
+RHO_GRID = np.logspace(-5, -1, 81)
+N_GRID = np.logspace(3, 8, 101)
+TARGET_GRID = np.logspace(-3, 0, 61)  # standardized RMSE, sqrt(MSE) / sigma
+
+
+def expected_rho_sq(mean, sd=0.0, N=None) -> np.ndarray:
+    """E[rho^2] for an assumed rho distribution, plus the SRS term 1/(N-1) if N is given."""
+    rho_sq = np.asarray(mean, dtype=float) ** 2 + np.asarray(sd, dtype=float) ** 2
+    if N is not None:
+        rho_sq = rho_sq + 1 / (np.asarray(N, dtype=float) - 1)
+    return rho_sq
+
+
+def mse(n, N, sigma, rho_sq) -> np.ndarray:
+    """Mean squared error of the sample mean: E[rho^2] * sigma^2 * (N - n) / n."""
+    n = np.asarray(n, dtype=float)
+    return np.asarray(rho_sq) * np.asarray(sigma) ** 2 * (np.asarray(N, dtype=float) - n) / n
+
+
+def required_n_mse(N, sigma, rho_sq, target_mse) -> np.ndarray:
+    """
+    Smallest n with MSE <= target_mse.
+
+    Args:
+        N: Population size (total_votes or estimated_votes)
+        sigma: Standard deviation of the outcome, sqrt(p(1-p))
+        rho_sq: E[rho^2]
+        target_mse: Target mean squared error of the share
+
+    Returns:
+        Required n (continuous; round up for a respondent count)
+    """
+    N = np.asarray(N, dtype=float)
+    with np.errstate(divide="ignore"):
+        return N / (1 + np.asarray(target_mse) / (np.asarray(rho_sq) * np.asarray(sigma) ** 2))
+
+
+def z_n_N_attainable(N, rho, z: float = 2.0) -> np.ndarray:
+    """Whether |Z_n,N| <= z at all; Z_n,N = rho sqrt(N - 1) whatever n is."""
+    return np.abs(np.asarray(rho)) * np.sqrt(np.asarray(N, dtype=float) - 1) <= z
+
+
+def required_n_z_n(N, rho, z: float = 2.0) -> np.ndarray:
+    """Smallest n with |Z_n| <= z, from Z_n ~= rho sqrt(N - n); 0 when any n will do."""
+    N = np.asarray(N, dtype=float)
+    with np.errstate(divide="ignore"):
+        return np.clip(N - (z / np.abs(np.asarray(rho, dtype=float))) ** 2, 0, N)
+
+
+def build_lookup_table(
+    rho_grid: np.ndarray = RHO_GRID, N_grid: np.ndarray = N_GRID, target_grid: np.ndarray = TARGET_GRID
+) -> Dict[str, np.ndarray]:
+    """
+    Required n for a standardized RMSE target on a (|rho|, N, target) grid.
+
+    The target is sqrt(MSE) / sigma, so one table serves every sigma.
+    """
+    rho, N, target = np.meshgrid(rho_grid, N_grid, target_grid, indexing="ij")
+    return {
+        "rho": rho_grid,
+        "N": N_grid,
+        "target": target_grid,
+        "n": required_n_mse(N, 1.0, rho ** 2, target ** 2),
+    }
+
+
+def grid_fingerprint(rho_grid: np.ndarray, N_grid: np.ndarray, target_grid: np.ndarray) -> str:
+    """Hash of the grid values, so a table built on other grids is rebuilt."""
+    digest = hashlib.sha1()
+    for grid in [rho_grid, N_grid, target_grid]:
+        grid = np.ascontiguousarray(grid, dtype=float)
+        digest.update(f"{grid.size};".encode())
+        digest.update(grid.tobytes())
+    return digest.hexdigest()
+
+
+def load_lookup_table(
+    path: str = TABLE_PATH, rho_grid: np.ndarray = RHO_GRID, N_grid: np.ndarray = N_GRID,
+    target_grid: np.ndarray = TARGET_GRID,
+) -> Dict[str, np.ndarray]:
+    """Load the lookup table from disk, building and saving it when missing or built on other grids."""
+    key = grid_fingerprint(rho_grid, N_grid, target_grid)
+    if os.path.exists(path):
+        with np.load(path) as stored:
+            if "fingerprint" in stored.files and str(stored["fingerprint"]) == key:
+                return {name: stored[name] for name in stored.files if name != "fingerprint"}
+    table = build_lookup_table(rho_grid, N_grid, target_grid)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, fingerprint=np.array(key), **table)
+    return table
+
+
+def lookup_required_n(table: Dict[str, np.ndarray], rho, N, target) -> np.ndarray:
+    """
+    Trilinear interpolation of log required n in (log |rho|, log N, log target); queries are clipped to the grid.
+
+    Args:
+        table: From build_lookup_table or load_lookup_table
+        rho: Assumed |rho| (sqrt of E[rho^2])
+        N: Population size
+        target: Standardized RMSE target, sqrt(MSE) / sigma
+
+    Returns:
+        Interpolated required n, broadcast over the inputs
+    """
+    rho, N, target = np.broadcast_arrays(np.abs(np.asarray(rho, dtype=float)), np.asarray(N, dtype=float),
+                                         np.asarray(target, dtype=float))
+    indices, fractions = [], []
+    for values, grid in [(rho, table["rho"]), (N, table["N"]), (target, table["target"])]:
+        log_grid = np.log(grid)
+        log_values = np.clip(np.log(values), log_grid[0], log_grid[-1])
+        i = np.clip(np.searchsorted(log_grid, log_values) - 1, 0, len(grid) - 2)
+        indices.append(i)
+        fractions.append((log_values - log_grid[i]) / (log_grid[i + 1] - log_grid[i]))
+
+    log_n = np.log(table["n"])
+    result = np.zeros(rho.shape)
+    for corner in range(8):
+        offsets = [(corner >> axis) & 1 for axis in range(3)]
+        weight = np.ones(rho.shape)
+        for fraction, offset in zip(fractions, offsets):
+            weight = weight * (fraction if offset else 1 - fraction)
+        result += weight * log_n[indices[0] + offsets[0], indices[1] + offsets[1], indices[2] + offsets[2]]
+    return np.exp(result)
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    df = pd.read_csv("../data/figure_5.csv")
+    N = df["total_votes"].to_numpy(dtype=float)
+
+    results = pd.DataFrame({"state": df["state"], "total_votes": N, "sample_size": df["sample_size"]})
+    for candidate in ["harris", "trump"]:
+        rho = df[f"{candidate}_data_defect_correlation"].to_numpy(dtype=float)
+        sigma = df[f"{candidate}_sigma_g"].to_numpy(dtype=float)
+        # plan with the spread of rho across states, not the state's own estimate
+        rho_sq = expected_rho_sq(rho.mean(), rho.std(ddof=1), N)
+        for rmse_pp in [1, 2, 3]:
+            n = required_n_mse(N, sigma, rho_sq, (rmse_pp / 100) ** 2)
+            results[f"{candidate}_n_for_rmse_{rmse_pp}pp"] = np.ceil(n).astype(int)
+        results[f"{candidate}_n_for_abs_Z_n_below_2"] = np.ceil(required_n_z_n(N, np.sqrt(rho_sq))).astype(int)
+        results[f"{candidate}_abs_Z_n_N_below_2_attainable"] = z_n_N_attainable(N, np.sqrt(rho_sq))
+
+    output_file = "../data/sample_size_planning.csv"
+    results.to_csv(output_file, index=False)
+    print(results.head().to_string(index=False))
+    print(f"Saved sample size plan to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 
+from states import attach, keys_from_names
+
 # Set the current working directory to the script directory
 script_dir: str = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_dir)
@@ -13,12 +15,8 @@ os.chdir(script_dir)
 data_path = os.path.join('..', 'data', 'figure_5.csv')
 df = pd.read_csv(data_path)
 
-# Read the state classification data
-classification_path = os.path.join('..', 'data', 'State-Pre-ElectionClassification.csv')
-classification_df = pd.read_csv(classification_path)
-
-# Merge the datasets
-merged_df = pd.merge(df, classification_df, left_on='state', right_on='State', how='left')
+# Attach the state classification by state key
+merged_df = attach(df, keys_from_names(df['state']), ['classification'], {'classification': 'Pre-Election Classification'})
 
 # Create a color map
 color_map = {
@@ -0,0 +1,235 @@
+# append-only store of every AP state summary seen, for replaying the count
+# input: state_json_files/{XX}.json (run after every fetch_ap_results.py fetch)
+# input: ../data/merged_{all,likely,validated}_voters.csv (poll columns, for the metrics)
+# output: ../data/ap_snapshots.npz
+# output: ../data/snapshot_metrics.csv
+
+# 2024_us_election_results_by_state.csv only keeps the latest lastUpdated per state. Here every state summary
+# that has been seen is kept once, keyed by (state, lastUpdated): recording the same file twice adds nothing.
+# the store is columnar, one row per snapshot, sorted by (state, last_updated):
+#   state (index into states), last_updated (datetime64[ms]), total_votes, eevp, precincts_reporting_pct,
+#   votes (snapshots x candidates, columns in candidates)
+# rows are only ever added, never changed, so any earlier as-of view can be rebuilt exactly.
+# as_of finds, for every state at once, the last snapshot at or before a timestamp with one searchsorted on the
+# (state, time) key, so reconstructing the state totals is O(states log snapshots).
+# snapshot_metrics computes error and rho (figure_5_dataset.py) and Z_n (figure_7.py) at every time the
+# count changed, as a time series over the snapshots.
+
+import io
+import os
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from data_defect import data_defect_metrics
+from extract_ap_results import HARRIS_ID, STATE_NAMES, TRUMP_ID, json_files, read_summary
+from file_io import atomic_write
+
+DATA_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+JSON_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "state_json_files")
+SNAPSHOT_PATH: str = os.path.join(DATA_DIR, "ap_snapshots.npz")
+CANDIDATES = {"harris": HARRIS_ID, "trump": TRUMP_ID}
+POPULATIONS = ["all", "likely", "validated"]
+TIME_SCALE = np.int64(1) << 44  # larger than any millisecond timestamp, to build the (state, time) key
+
+Store = Dict[str, np.ndarray]
+
+
+def empty_store() -> Store:
+    return {
+        "states": np.array([], dtype="<U2"),
+        "candidates": np.array([], dtype=np.int64),
+        "state": np.array([], dtype=np.int16),
+        "last_updated": np.array([], dtype="datetime64[ms]"),
+        "total_votes": np.array([], dtype=np.int64),
+        "eevp": np.array([], dtype=np.float32),
+        "precincts_reporting_pct": np.array([], dtype=np.float32),
+        "votes": np.zeros((0, 0), dtype=np.int64),
+    }
+
+
+def load_snapshots(path: str = SNAPSHOT_PATH) -> Store:
+    """The snapshot store, empty if there is none yet."""
+    if not os.path.exists(path):
+        return empty_store()
+    with np.load(path) as stored:
+        return {name: stored[name] for name in stored.files}
+
+
+def save_snapshots(store: Store, path: str = SNAPSHOT_PATH) -> None:
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **store)
+    atomic_write(path, buffer.getvalue())
+
+
+def _time_key(state: np.ndarray, last_updated: np.ndarray) -> np.ndarray:
+    return state.astype(np.int64) * TIME_SCALE + last_updated.astype(np.int64)
+
+
+def record(store: Store, folder: str = JSON_DIR) -> Store:
+    """
+    Add the summaries in folder that are not in the store yet.
+
+    Returns:
+        The new store (the input store is not modified)
+    """
+    summaries = []
+    for name in json_files(folder):
+        summary = read_summary(os.path.join(folder, name))
+        summaries.append((name.split(".")[0], summary))
+
+    states = list(store["states"])
+    state_code = {abbr: code for code, abbr in enumerate(states)}
+    for abbr, _ in summaries:
+        if abbr not in state_code:
+            state_code[abbr] = len(states)
+            states.append(abbr)
+    candidate_ids = sorted(set(store["candidates"].tolist()) | {
+        int(c["candidateID"]) for _, summary in summaries for c in summary.get("candidates", [])
+    })
+    candidate_column = {candidate_id: k for k, candidate_id in enumerate(candidate_ids)}
+
+    # deduplicate on (state, lastUpdated) against the store and within the batch
+    seen = set(_time_key(store["state"], store["last_updated"]).tolist())
+    new_rows = []
+    for abbr, summary in summaries:
+        last_updated = np.datetime64(summary["lastUpdated"].rstrip("Z"), "ms")
+        key = int(_time_key(np.array([state_code[abbr]]), np.array([last_updated]))[0])
+        if key in seen:
+            continue
+        seen.add(key)
+        new_rows.append((abbr, last_updated, summary))
+    if not new_rows:
+        return store
+
+    # widen the vote matrix when new candidates appear
+    votes = np.zeros((len(store["state"]), len(candidate_ids)), dtype=np.int64)
+    votes[:, [candidate_column[c] for c in store["candidates"].tolist()]] = store["votes"]
+    new_votes = np.zeros((len(new_rows), len(candidate_ids)), dtype=np.int64)
+    for i, (_, _, summary) in enumerate(new_rows):
+        for candidate in summary.get("candidates", []):
+            new_votes[i, candidate_column[int(candidate["candidateID"])]] = candidate["voteCount"]
+
+    state = np.concatenate([store["state"], [state_code[abbr] for abbr, _, _ in new_rows]]).astype(np.int16)
+    last_updated = np.concatenate([store["last_updated"], [t for _, t, _ in new_rows]]).astype("datetime64[ms]")
+    order = np.argsort(_time_key(state, last_updated), kind="stable")
+    return {
+        "states": np.array(states),
+        "candidates": np.array(candidate_ids, dtype=np.int64),
+        "state": state[order],
+        "last_updated": last_updated[order],
+        "total_votes": np.concatenate([
+            store["total_votes"], [s["parameters"]["vote"]["total"] for _, _, s in new_rows]
+        ]).astype(np.int64)[order],
+        "eevp": np.concatenate([
+            store["eevp"], [s.get("eevp", np.nan) for _, _, s in new_rows]
+        ]).astype(np.float32)[order],
+        "precincts_reporting_pct": np.concatenate([
+            store["precincts_reporting_pct"], [s.get("precinctsReportingPct", np.nan) for _, _, s in new_rows]
+        ]).astype(np.float32)[order],
+        "votes": np.concatenate([votes, new_votes])[order],
+    }
+
+
+def as_of_rows(store: Store, timestamps) -> np.ndarray:
+    """
+    Row of the latest snapshot at or before each timestamp, for every state.
+
+    Args:
+        store: From load_snapshots or record
+        timestamps: One timestamp or an array of them
+
+    Returns:
+        Array of shape (timestamps, states) of row indices, -1 where a state has no snapshot yet
+    """
+    times = np.atleast_1d(np.asarray(timestamps, dtype="datetime64[ms]"))
+    n_states = len(store["states"])
+    keys = _time_key(store["state"], store["last_updated"])
+    query = _time_key(np.arange(n_states)[None, :], times[:, None])
+    rows = np.searchsorted(keys, query, side="right") - 1
+    valid = rows >= 0
+    valid[valid] = store["state"][rows[valid]] == np.broadcast_to(np.arange(n_states), rows.shape)[valid]
+    return np.where(valid, rows, -1)
+
+
+def as_of(store: Store, timestamp) -> pd.DataFrame:
+    """State totals as they stood at timestamp, in the layout of 2024_us_election_results_by_state.csv."""
+    rows = as_of_rows(store, timestamp)[0]
+    present = rows >= 0
+    rows = rows[present]
+    result = pd.DataFrame({
+        "state": [STATE_NAMES.get(abbr) for abbr in store["states"][present]],
+        "trump_votes": store["votes"][rows, _column(store, TRUMP_ID)],
+        "harris_votes": store["votes"][rows, _column(store, HARRIS_ID)],
+        "total_votes": store["total_votes"][rows],
+        "last_updated": pd.to_datetime(store["last_updated"][rows]).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "eevp": store["eevp"][rows],
+    })
+    return result.sort_values("state", ignore_index=True)
+
+
+def _column(store: Store, candidate_id) -> int:
+    return int(np.flatnonzero(store["candidates"] == int(candidate_id))[0])
+
+
+def snapshot_metrics(
+    store: Store, populations: Iterable[str] = POPULATIONS, times: Optional[np.ndarray] = None
+) -> pd.DataFrame:
+    """
+    Error, rho and Z_n per state at every time the count changed (or at the given times).
+
+    Returns:
+        Long table with as_of, state, population, candidate, eevp, total_votes, share, error,
+        data_defect_correlation and Z_n
+    """
+    if times is None:
+        times = np.unique(store["last_updated"])
+    rows = as_of_rows(store, times)
+    present = rows >= 0
+    safe_rows = np.maximum(rows, 0)
+    total_votes = np.where(present, store["total_votes"][safe_rows], np.nan)
+    state_names = np.array([STATE_NAMES.get(abbr) for abbr in store["states"]])
+
+    tables = []
+    for population in populations:
+        merged = pd.read_csv(f"{DATA_DIR}/merged_{population}_voters.csv").set_index("state").reindex(state_names)
+        n = merged[f"num_respondents_{population}"].to_numpy(dtype=float)
+        for candidate, candidate_id in CANDIDATES.items():
+            share = np.where(present, store["votes"][safe_rows, _column(store, candidate_id)], np.nan) / total_votes
+            poll = merged[f"{candidate}_poll_{population}"].to_numpy(dtype=float)
+            metrics = data_defect_metrics(poll[None, :], share, n[None, :], total_votes)
+            tables.append(pd.DataFrame({
+                "as_of": np.repeat(pd.to_datetime(times), len(state_names)),
+                "state": np.tile(state_names, len(times)),
+                "population": population,
+                "candidate": candidate,
+                "eevp": np.where(present, store["eevp"][safe_rows], np.nan).ravel(),
+                "total_votes": total_votes.ravel(),
+                "share": share.ravel(),
+                "error": metrics["error"].ravel(),
+                "data_defect_correlation": metrics["data_defect_correlation"].ravel(),
+                "Z_n": metrics["Z_n"].ravel(),
+            }))
+    return pd.concat(tables, ignore_index=True).dropna(subset=["state", "share"])
+
+
+def main():
+    # Set the current working directory to the script directory
+    script_dir: str = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_dir)
+
+    store = load_snapshots()
+    before = len(store["state"])
+    store = record(store)
+    if len(store["state"]) > before:
+        save_snapshots(store)
+    print(f"Recorded {len(store['state']) - before} new snapshots, {len(store['state'])} in total")
+
+    output_file = "../data/snapshot_metrics.csv"
+    snapshot_metrics(store).to_csv(output_file, index=False)
+    print(f"Saved metrics at {len(np.unique(store['last_updated']))} snapshot times to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# the state dimension: one row per state (and DC), keyed by a small integer
+# input: ../data/State-Pre-ElectionClassification.csv
+# input: ../data/Turnout_2016G_v1.0.csv, ../data/Turnout_2024G_v0.3.csv (through turnout.py)
+
+# state identity used to be rebuilt in every script (fips_to_state dicts, abbreviation maps, state_abbr.csv,
+# .str.title() / .str.strip('"') normalization) and joined by merging on state names.
+# here it is built once: state_key 0..50 in FIPS order, with fips, abbr, name, is_state (False for DC),
+# the pre-election classification and the 2016 / 2024 turnout columns of turnout.load_turnout_by_state.
+# the only string matching happens here, when the classification and turnout files are attached.
+# downstream code maps its own identifiers to keys once (keys_from_fips is a direct-address array lookup)
+# and joins by gathering rows: gather(column, keys), attach(df, keys, columns) and inner_join.
+# keys are -1 for unknown identifiers; gathered values are NaN there.
+
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from turnout import load_turnout_by_state
+
+DATA_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+CLASSIFICATION_PATH: str = os.path.join(DATA_DIR, "State-Pre-ElectionClassification.csv")
+
+# (FIPS, abbreviation, name)
+STATE_FIPS = [
+    (1, "AL", "Alabama"), (2, "AK", "Alaska"), (4, "AZ", "Arizona"), (5, "AR", "Arkansas"),
+    (6, "CA", "California"), (8, "CO", "Colorado"), (9, "CT", "Connecticut"), (10, "DE", "Delaware"),
+    (11, "DC", "District of Columbia"), (12, "FL", "Florida"), (13, "GA", "Georgia"), (15, "HI", "Hawaii"),
+    (16, "ID", "Idaho"), (17, "IL", "Illinois"), (18, "IN", "Indiana"), (19, "IA", "Iowa"),
+    (20, "KS", "Kansas"), (21, "KY", "Kentucky"), (22, "LA", "Louisiana"), (23, "ME", "Maine"),
+    (24, "MD", "Maryland"), (25, "MA", "Massachusetts"), (26, "MI", "Michigan"), (27, "MN", "Minnesota"),
+    (28, "MS", "Mississippi"), (29, "MO", "Missouri"), (30, "MT", "Montana"), (31, "NE", "Nebraska"),
+    (32, "NV", "Nevada"), (33, "NH", "New Hampshire"), (34, "NJ", "New Jersey"), (35, "NM", "New Mexico"),
+    (36, "NY", "New York"), (37, "NC", "North Carolina"), (38, "ND", "North Dakota"), (39, "OH", "Ohio"),
+    (40, "OK", "Oklahoma"), (41, "OR", "Oregon"), (42, "PA", "Pennsylvania"), (44, "RI", "Rhode Island"),
+    (45, "SC", "South Carolina"), (46, "SD", "South Dakota"), (47, "TN", "Tennessee"), (48, "TX", "Texas"),
+    (49, "UT", "Utah"), (50, "VT", "Vermont"), (51, "VA", "Virginia"), (53, "WA", "Washington"),
+    (54, "WV", "West Virginia"), (55, "WI", "Wisconsin"), (56, "WY", "Wyoming"),
+]
+MAX_FIPS = 100
+
+_KEY_BY_FIPS = np.full(MAX_FIPS, -1, dtype=np.int64)
+_KEY_BY_FIPS[[fips for fips, _, _ in STATE_FIPS]] = np.arange(len(STATE_FIPS))
+_ABBR_INDEX = pd.Index([abbr for _, abbr, _ in STATE_FIPS])
+_NAME_INDEX = pd.Index([name.casefold() for _, _, name in STATE_FIPS])
+
+_states: Dict[str, pd.DataFrame] = {}
+
+
+def keys_from_fips(fips) -> np.ndarray:
+    """State keys for FIPS codes (int, float or string), -1 where unknown."""
+    fips = pd.to_numeric(pd.Series(np.atleast_1d(fips)), errors="coerce").to_numpy(dtype=float)
+    valid = np.isfinite(fips) & (fips >= 0) & (fips < MAX_FIPS)
+    return np.where(valid, _KEY_BY_FIPS[np.where(valid, fips, 0).astype(np.int64)], -1)
+
+
+def keys_from_abbr(abbrs) -> np.ndarray:
+    """State keys for two-letter abbreviations, -1 where unknown."""
+    return _ABBR_INDEX.get_indexer(pd.Series(np.atleast_1d(abbrs), dtype="string").str.strip().str.upper())
+
+
+def keys_from_names(names) -> np.ndarray:
+    """State keys for state names, ignoring case, surrounding quotes and whitespace; -1 where unknown."""
+    normalized = pd.Series(np.atleast_1d(names), dtype="string").str.strip().str.strip('"').str.casefold()
+    return _NAME_INDEX.get_indexer(normalized)
+
+
+def load_states() -> pd.DataFrame:
+    """The state dimension, indexed by state_key; built once per process."""
+    if "states" in _states:
+        return _states["states"]
+
+    fips, abbr, name = zip(*STATE_FIPS)
+    states = pd.DataFrame({"fips": fips, "abbr": abbr, "name": name})
+    states.index.name = "state_key"
+    states["is_state"] = states["abbr"] != "DC"
+
+    classification = pd.read_csv(CLASSIFICATION_PATH)
+    states["classification"] = _scatter(
+        keys_from_names(classification["State"]), classification["Pre-Election Classification"], len(states)
+    )
+
+    turnout = load_turnout_by_state()
+    turnout_keys = keys_from_abbr(turnout["STATE_ABV"])
+    for column in turnout.columns.drop(["STATE", "STATE_ABV"]):
+        states[column] = _scatter(turnout_keys, turnout[column], len(states))
+
+    _states["states"] = states
+    return states
+
+
+def _scatter(keys: np.ndarray, values: pd.Series, n_states: int) -> np.ndarray:
+    result = np.full(n_states, np.nan, dtype=object if values.dtype == object else float)
+    valid = keys >= 0
+    result[keys[valid]] = values.to_numpy()[valid]
+    return result
+
+
+def gather(column: str, keys) -> np.ndarray:
+    """Values of a state dimension column for every key (NaN for -1)."""
+    values = load_states()[column].to_numpy()
+    keys = np.asarray(keys)
+    missing = keys < 0
+    if not missing.any():
+        return values[keys]
+    result = values[np.maximum(keys, 0)].astype(object if values.dtype == object else float)
+    result[missing] = np.nan
+    return result
+
+
+def attach(df: pd.DataFrame, keys, columns: Iterable[str], names: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    Add state dimension columns to df by gathering on keys.
+
+    Args:
+        df: Any table with one state key per row
+        keys: State key per row of df
+        columns: State dimension columns to add
+        names: Optional new names for the added columns
+
+    Returns:
+        A copy of df with the columns added
+    """
+    df = df.copy()
+    names = names or {}
+    for column in columns:
+        df[names.get(column, column)] = gather(column, keys)
+    return df
+
+
+def inner_join(left: pd.DataFrame, left_keys, right: pd.DataFrame, right_keys) -> pd.DataFrame:
+    """
+    Rows of left with a matching state in right (one row per state), right's columns appended, left's order kept.
+
+    This is pd.merge(left, right, how="inner") on the state, as an array gather.
+    """
+    position = np.full(len(STATE_FIPS), -1, dtype=np.int64)
+    right_keys = np.asarray(right_keys)
+    valid = right_keys >= 0
+    position[right_keys[valid]] = np.flatnonzero(valid)
+    rows = np.where(np.asarray(left_keys) >= 0, position[np.maximum(left_keys, 0)], -1)
+    keep = rows >= 0
+    return pd.concat([
+        left[keep].reset_index(drop=True),
+        right.iloc[rows[keep]].reset_index(drop=True),
+    ], axis=1)
+
+
+def turnout_columns() -> List[str]:
+    """The turnout columns of the state dimension (suffixed _2016 / _2024)."""
+    return [column for column in load_states().columns if column.endswith(("_2016", "_2024"))]
+
+
+def state_abbreviations(include_dc: bool = False) -> List[str]:
+    """Two-letter abbreviations in FIPS order."""
+    return [abbr for _, abbr, _ in STATE_FIPS if include_dc or abbr != "DC"]
+
+
+def main():
+    states = load_states()
+    print(states[["fips", "abbr", "name", "is_state", "classification", "VEP_2024", "VEP_TURNOUT_RATE_2016"]])
+
+
+if __name__ == "__main__":
+    main()
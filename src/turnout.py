@@ -0,0 +1,89 @@
+# typed loader for the Election Lab turnout files
+# input: ../data/Turnout_2016G_v1.0.csv
+# input: ../data/Turnout_2024G_v0.3.csv
+
+# the raw files store counts as strings with thousands separators ("3,609,696", sometimes without)
+# and rates as percentage strings ("59.12%"). Each column is parsed once, vectorized, instead of
+# applying a per-cell cleaner. Counts become float64 (NaN where blank), percentages become proportions.
+
+import os
+from typing import List
+
+import pandas as pd
+
+DATA_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+TURNOUT_2016_PATH: str = os.path.join(DATA_DIR, "Turnout_2016G_v1.0.csv")
+TURNOUT_2024_PATH: str = os.path.join(DATA_DIR, "Turnout_2024G_v0.3.csv")
+
+# Columns holding counts (possibly with thousands separators)
+COUNT_COLUMNS: List[str] = [
+    "TOTAL_BALLOTS_COUNTED",
+    "VOTE_FOR_HIGHEST_OFFICE",
+    "VAP",
+    "INELIGIBLE_PRISON",
+    "INELIGIBLE_PROBATION",
+    "INELIGIBLE_PAROLE",
+    "INELIGIBLE_FELONS_TOTAL",
+    "ELIGIBLE_OVERSEAS",
+    "VEP",
+]
+
+# Columns holding percentage strings
+PERCENT_COLUMNS: List[str] = ["NONCITIZEN_PCT", "VEP_TURNOUT_RATE", "VAP_TURNOUT_RATE"]
+
+
+def parse_counts(column: pd.Series) -> pd.Series:
+    """Parse a column of count strings like "3,609,696" into float64."""
+    cleaned = column.astype("string").str.replace(",", "", regex=False).str.strip()
+    return pd.to_numeric(cleaned, errors="coerce").astype("float64")
+
+
+def parse_percentages(column: pd.Series) -> pd.Series:
+    """Parse a column of percentage strings like "59.12%" into proportions."""
+    cleaned = column.astype("string").str.rstrip("%").str.strip()
+    return pd.to_numeric(cleaned, errors="coerce").astype("float64") / 100
+
+
+def load_turnout(path: str, include_national: bool = False) -> pd.DataFrame:
+    """
+    Load one turnout file with typed numeric columns.
+
+    Args:
+        path: Path to a Turnout_*G_*.csv file
+        include_national: Keep the "United States" row if True
+
+    Returns:
+        DataFrame with STATE, STATE_ABV and every count/percentage column parsed.
+        Source URL columns are dropped.
+    """
+    raw = pd.read_csv(path, dtype=str)
+    raw = raw.loc[:, ~raw.columns.str.startswith("Unnamed")]
+
+    turnout = pd.DataFrame({
+        "STATE": raw["STATE"].str.strip(),
+        "STATE_ABV": raw["STATE_ABV"].str.strip(),
+    })
+    for col in COUNT_COLUMNS:
+        if col in raw.columns:
+            turnout[col] = parse_counts(raw[col])
+    for col in PERCENT_COLUMNS:
+        if col in raw.columns:
+            turnout[col] = parse_percentages(raw[col])
+
+    if not include_national:
+        turnout = turnout[turnout["STATE"] != "United States"]
+    return turnout.reset_index(drop=True)
+
+
+def load_turnout_by_state() -> pd.DataFrame:
+    """
+    Load the 2016 and 2024 turnout files side by side, one row per state.
+
+    Returns:
+        DataFrame keyed by STATE with every numeric column suffixed _2016 or _2024
+    """
+    turnout_2016 = load_turnout(TURNOUT_2016_PATH).drop(columns="STATE_ABV")
+    turnout_2024 = load_turnout(TURNOUT_2024_PATH)
+    turnout_2016 = turnout_2016.set_index("STATE").add_suffix("_2016")
+    turnout_2024 = turnout_2024.set_index(["STATE", "STATE_ABV"]).add_suffix("_2024").reset_index("STATE_ABV")
+    return turnout_2024.join(turnout_2016, how="inner").reset_index()